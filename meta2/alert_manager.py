@@ -1,9 +1,13 @@
+import startup
 import socket
 import json
 import paho.mqtt.client as mqtt
 from datetime import datetime, timedelta
 from collections import defaultdict
 import threading
+import time
+import metrics
+import logger
 
 class AlertManager:
     def __init__(self, group_id, udp_ip, udp_port):
@@ -24,26 +28,55 @@ class AlertManager:
         self.alarm_history = defaultdict(list)
         self.cooldowns = defaultdict(lambda: False)
         
+        # Metrics (served on /metrics when METRICS_PORT is set)
+        self.metrics = metrics.Registry("alert_manager_")
+        self.m_messages = self.metrics.counter("messages", "Control commands received")
+        self.m_errors = self.metrics.counter("message_errors", "Control commands that failed processing")
+        self.m_record = self.metrics.histogram("record_seconds", "Alarm recording and threshold check latency")
+        self.m_alerts = self.metrics.counter("alerts", "CRITICAL alerts sent over UDP")
+        self.m_alert_failures = self.metrics.counter("alert_failures", "Alerts that could not be sent")
+        self.m_cooldown_skips = self.metrics.counter("cooldown_skips", "Alerts skipped during cooldown")
+        self.m_tracked = self.metrics.gauge("tracked_machines", "Machines with alarm history")
+        self.m_tracked.set_function(lambda: len(self.alarm_history))
+
+        # Logging categories (see logger.setup in __main__)
+        self.log = logger.get("alert_manager", "main")
+        self.log_payload = logger.get("alert_manager", "payload")
+        self.log_alert = logger.get("alert_manager", "alert")
+        self.log_error = logger.get("alert_manager", "error")
+
         # MQTT client for monitoring control commands
         self.mqtt_client = mqtt.Client()
         self.mqtt_client.on_connect = self._on_mqtt_connect
         self.mqtt_client.on_message = self._on_mqtt_message
+        self.subscribed = False
 
     def _on_mqtt_connect(self, client, userdata, flags, rc):
-        print(f"Connected to MQTT broker with result code {rc}")
+        self.log.info("Connected to MQTT broker with result code %s", rc)
         client.subscribe(self.control_topic)
-        print(f"Subscribed to control topic: {self.control_topic}")
+        self.log.info("Subscribed to control topic: %s", self.control_topic)
+        if not self.subscribed:
+            self.subscribed = True
+            startup.mark("subscribe")
+            startup.report("receiving")
 
     def _on_mqtt_message(self, client, userdata, msg):
         """Track all control commands as potential alarms"""
         try:
-            command = json.loads(msg.payload.decode())
-            print(f"command received by MachineDataManager: {command}")
-            machine_id = command["machine_id"]
-            self._record_alarm(machine_id)
-            self._check_alarm_condition(machine_id)
+            self._process_command(json.loads(msg.payload.decode()))
         except Exception as e:
-            print(f"Error processing control command: {e}")
+            self.m_errors.inc()
+            self.log_error.error("Error processing control command: %s", e)
+
+    def _process_command(self, command):
+        """Count a decoded control command as an alarm of its machine"""
+        self.m_messages.inc()
+        self.log_payload.debug("command received by MachineDataManager: %s", command)
+        machine_id = command["machine_id"]
+        start = time.perf_counter()
+        self._record_alarm(machine_id)
+        self._check_alarm_condition(machine_id)
+        self.m_record.observe(time.perf_counter() - start)
 
     def _record_alarm(self, machine_id):
         """Log alarm occurrence with timestamp"""
@@ -70,16 +103,18 @@ class AlertManager:
                 # Start a timer thread to reset cooldown after 2 seconds
                 threading.Timer(2, self._reset_cooldown, args=[machine_id]).start()
             else:
-                print(f"Cooldown active, skipping alert for {machine_id}")
+                self.m_cooldown_skips.inc()
+                self.log_alert.info("Cooldown active, skipping alert for %s", machine_id)
                 
     def _reset_cooldown(self, machine_id):
-        print(f"Cooldown ended for {machine_id}, ready for new alerts")
+        self.log_alert.info("Cooldown ended for %s, ready for new alerts", machine_id)
         self.alarm_history[machine_id].clear()
         self.cooldowns[machine_id] = False
 
     def _send_alert(self, machine_id):
         """Send critical alert via UDP to Data Manager Agent"""
         alert = {
+            "group_id": self.group_id,      # routes the alert in a multi-group agent (tenants.py)
             "machine_id": machine_id,
             "level": "CRITICAL",
             "reason": "high number of control alarms",
@@ -87,19 +122,30 @@ class AlertManager:
         }
         
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(json.dumps(alert).encode(), (self.udp_ip, self.udp_port))
-            print(f"Sent CRITICAL alert for {machine_id}")
+            self._deliver_alert(alert)
+            self.m_alerts.inc()
+            self.log_alert.warning("Sent CRITICAL alert for %s", machine_id)
         except Exception as e:
-            print(f"Failed to send alert: {e}")
+            self.m_alert_failures.inc()
+            self.log_error.error("Failed to send alert: %s", e)
+
+    def _deliver_alert(self, alert):
+        """Alert to the Data Manager Agent over UDP (replaced in fused mode)"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto(json.dumps(alert).encode(), (self.udp_ip, self.udp_port))
 
     def run(self):
         """Start the alert manager"""
+        if METRICS_PORT:
+            metrics.start_http_server(self.metrics, METRICS_PORT)
+        startup.mark("servers")
         self.mqtt_client.connect(MQTT_BROKER_IP, MQTT_PORT)
+        startup.mark("mqtt_connect")
         self.mqtt_client.loop_forever()
-        print(f"Alert Manager started. Monitoring for critical conditions...")
+        self.log.info("Alert Manager started. Monitoring for critical conditions...")
 
 if __name__ == "__main__":
+    startup.begin()
 
     # ===== CONFIGURATION =====
     MQTT_BROKER_IP = "10.6.1.9"
@@ -109,6 +155,20 @@ if __name__ == "__main__":
     # ==== UDP COMMUNICATIONS CONFIG ====
     UDP_PORT = 5005
     UDP_IP = "localhost"
-    
+
+    # ===== METRICS CONFIG =====
+    METRICS_PORT = 9103     # local /metrics endpoint (None = off)
+
+    # ===== LOGGING CONFIG =====
+    logger.setup(
+        "alert_manager",
+        level="INFO",
+        json_output=False,
+        levels={"payload": "WARNING"},                  # "DEBUG" prints every command
+        rate_limits={"alert": 50, "error": 10}          # lines per second
+    )
+    startup.mark("config")
+
     manager = AlertManager(GROUP_ID, UDP_IP, UDP_PORT)
+    startup.mark("init")
     manager.run()
\ No newline at end of file
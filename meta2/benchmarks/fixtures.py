@@ -0,0 +1,99 @@
+import json
+import random
+
+import alert_manager
+import data_manager_agent
+import machine
+import machine_data_manager
+
+# Builds the pipeline components outside their __main__ blocks: the module globals they
+# read are set from config/ (run from meta2/) and network I/O is replaced by the fakes
+# below. Shared by the benchmarks and the soak harness.
+
+PARAM_MAP = {
+    "rpm": ["0x01"],
+    "consumption": ["0x02", "consumption_unit"],
+    "coolant_temp": ["0x03", "temp_unit"],
+    "oil_pressure": ["0x04", "oil_unit"],
+    "battery_potential": ["0x05", "batt_unit"]
+}
+
+REASON_MAP = {
+    "high number of control alarms": "0x01",
+}
+
+class FakeInflux:
+    """Stands in for InfluxDBClient3, keeps a count instead of the points"""
+
+    def __init__(self):
+        self.writes = 0
+        self.points = 0
+
+    def write(self, record=None, **kwargs):
+        self.writes += 1
+        self.points += len(record) if isinstance(record, list) else 1
+
+class NullMQTT:
+    """Client that drops everything it is asked to publish"""
+
+    def __init__(self):
+        self.published = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+
+def configure():
+    """Set the module globals normally defined in each component's __main__"""
+    with open("config/all_machines.json", "r", encoding="utf-8") as f:
+        specs = json.load(f)
+    with open("config/intervals.json", "r", encoding="utf-8") as f:
+        intervals = json.load(f)
+
+    machine.MACHINE_SPECS = specs
+
+    agent_globals = dict(
+        MACHINE_SPECS=specs, PARAM_MAP=PARAM_MAP, REASON_MAP=REASON_MAP,
+        MQTT_BROKER_IP="127.0.0.1", MQTT_PORT=1883, UDP_IP="127.0.0.1", UDP_PORT=5005,
+        URL="http://127.0.0.1:1", TOKEN="", ORG="", BUCKET="",
+        METRICS_PORT=None, PROFILE_DURATION=30, PROFILE_CONTROL_PORT=None,
+        STATE_CAPACITY=720, STATE_PORT=None, STATE_WARM_SECONDS=0, STATE_WARM_LOG=None,
+        QUANTILE_SKETCHES=True, INTERVALS=intervals, DEDUP_TTL=60, DEDUP_MAX_ENTRIES=100000,
+        QUARANTINE_SIZE=1000, QUARANTINE_FLOOD_REJECTS=50, QUARANTINE_FLOOD_WINDOW=10, QUARANTINE_BLOCK_SECONDS=60,
+        MANAGER_PARTITIONS=0, STARTUP_BUFFER=10000,
+        HEALTH_WEIGHTS={"deviation": 1.0, "commands": 0.2, "alarms": 2.0, "link": 0.5},
+        HEALTH_LINK_LEVELS={"rssi": {"good": -90, "bad": -120}, "snr": {"good": -5, "bad": -20}},
+        TRACE_REPORT_EVERY=float("inf")     # no periodic trace reports on stdout
+    )
+    for name, value in agent_globals.items():
+        setattr(data_manager_agent, name, value)
+    for module in (machine_data_manager, alert_manager):
+        for name in ("MQTT_BROKER_IP", "MQTT_PORT", "UDP_IP", "UDP_PORT", "METRICS_PORT",
+                     "TRACE_REPORT_EVERY", "PROFILE_DURATION", "PROFILE_CONTROL_PORT"):
+            setattr(module, name, agent_globals[name])
+    return specs, intervals
+
+def make_agent(group_id="19"):
+    return data_manager_agent.DataManagerAgent(group_id, influx_client=FakeInflux())
+
+def make_manager(intervals, group_id="19", policy=True, burst_duration=60):
+    reporting_policy = machine_data_manager.ReportingPolicy(intervals, 1, 5, 30, 0.1, 10) if policy else None
+    return machine_data_manager.MachineDataManager(group_id, intervals, reporting_policy, burst_duration)
+
+def make_alert_manager(group_id="19", udp_port=5005):
+    return alert_manager.AlertManager(group_id, "127.0.0.1", udp_port)
+
+def fleet_ids(specs, size):
+    """size fleet-style machine ids ("<spec id>-<n>") mapped to their machine codes"""
+    codes = list(specs)
+    return {f"{specs[codes[i % len(codes)]]['machine_id']}-{i}": codes[i % len(codes)] for i in range(size)}
+
+def sample_readings(specs, count, seed=1):
+    """Decoded uplink payloads (native units) from simulated machines of every code"""
+    random.seed(seed)
+    machines = [machine.Machine(code, 5) for code in specs]
+    readings = []
+    for i in range(count):
+        m = machines[i % len(machines)]
+        m.update_sensors()
+        readings.append(json.loads(m.generate_payload())["uplink_message"]["decoded_payload"])
+    return readings
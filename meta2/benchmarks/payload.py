@@ -0,0 +1,75 @@
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+import machine
+
+# Run from meta2/:  python3 -m benchmarks.payload [TICKS]
+
+def legacy_payload(m):
+    """Per-tick payload as machine.py built it before the templates (reference only)"""
+    return json.dumps({
+        "end_device_ids": {
+            "machine_id": m.machine_id,
+            "application_id": "SRSA2025:industrial-monitoring",
+            "dev_eui": "".join(random.choices("0123456789ABCDEF", k=16)),
+            "join_eui": "0000000000000000",
+            "dev_addr": "".join(random.choices("0123456789ABCDEF", k=8))
+        },
+        "received_at": datetime.now().isoformat(),
+        "uplink_message": {
+            "f_port": 1,
+            "f_cnt": 1234,
+            "frm_payload": "BASE64_SIMULATED_PAYLOAD",
+            "decoded_payload": {
+                "rpm": round(m.rpm,2),
+                "coolant_temperature": round(m.coolant_temp,2),
+                "oil_pressure": round(m.oil_pressure,2),
+                "battery_potential": round(m.battery_potential,2),
+                "consumption": round(m.consumption,2),
+                "machine_type": m.machine_code
+            },
+            "rx_metadata": [{
+                "gateway_id": "dei-gateway-1",
+                "rssi": round(m.rssi,2),
+                "snr": round(m.snr,2),
+                "channel_rssi": round(m.rssi_channel,2),
+                "uplink_token": "SIMULATED_TOKEN"
+            }],
+            "settings": {
+                "data_rate": {
+                    "modulation": "LORA",
+                    "bandwidth": 125000,
+                    "spreading_factor": 7
+                },
+                "frequency": "868300000",
+                "timestamp": int(time.time())
+            },
+            "consumed_airtime": f"{random.uniform(0.05, 0.07):.6f}s"
+        }
+    })
+
+def per_tick_us(func, ticks):
+    start = time.perf_counter()
+    for _ in range(ticks):
+        func()
+    return (time.perf_counter() - start) / ticks * 1e6
+
+if __name__ == "__main__":
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with open("config/all_machines.json", "r", encoding="utf-8") as f:
+        machine.MACHINE_SPECS = json.load(f)
+
+    m = machine.Machine("H65P", 1)
+
+    sensors = per_tick_us(m.update_sensors, ticks)
+    legacy = per_tick_us(lambda: legacy_payload(m), ticks)
+    template = per_tick_us(m.generate_payload, ticks)
+
+    print(f"update_sensors        {sensors:8.2f} us/tick")
+    print(f"payload (dict+dumps)  {legacy:8.2f} us/tick")
+    print(f"payload (template)    {template:8.2f} us/tick  ({legacy / template:.1f}x faster)")
+    print(f"full tick             {sensors + template:8.2f} us  -> ~{1e6 / (sensors + template):,.0f} uplinks/s per core")
@@ -0,0 +1,318 @@
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from array import array
+
+import logger
+from benchmarks import fixtures
+from faults import FaultInjector
+from fleet import Fleet
+from fused import FusedPipeline
+from local_broker import LocalBroker
+
+# Run from meta2/ (needs numpy for the fleet):
+#   python3 -m benchmarks.soak ramp [UPDATE_TIME] [START_MACHINES] [MAX_MACHINES]
+#   python3 -m benchmarks.soak soak <MACHINES> <UPDATE_TIME> <HOURS>
+#
+# The whole pipeline runs in this process: the NumPy fleet, DataManagerAgent (InfluxDB
+# replaced by a fake writer), MachineDataManager and AlertManager, connected through
+# the queued LocalBroker and a loopback UDP socket for the alerts. Nothing leaves the box.
+#
+# Latency is measured from the moment a tick was *scheduled*, not from when the fleet
+# managed to publish it, so a pipeline that falls behind shows up as latency instead of
+# silently slowing the offered load down. A sample of the uplinks carries a trace:
+#   ingest  = scheduled tick -> reading forwarded to MachineDataManager (stored and converted)
+#   control = scheduled tick -> actuator downlink back at the fleet (out-of-range readings)
+#
+# With FUSED the components are wired by fused.FusedPipeline (in-memory queues) and
+# only the uplinks and downlinks cross the broker.
+
+def rss_mb():
+    """Current resident set size"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+class Pipeline:
+    """One in-process deployment: fleet, components and the broker stand-in between them"""
+
+    def __init__(self, machines, update_time, group_id="19"):
+        self.group_id = group_id
+        self.update_time = update_time
+        self.broker = LocalBroker(QUEUE_SIZE)
+
+        codes = list(SPECS)
+        self.fleet = Fleet([codes[i % len(codes)] for i in range(machines)], SPECS, update_time, seed=SEED)
+        self.up_topics = [f"v3/{group_id}@ttn/devices/{m}/up" for m in self.fleet.machine_ids]
+        self.fleet_lock = threading.Lock()
+        self.faults = FaultInjector.from_file(FAULT_SCENARIO, SEED) if FAULT_SCENARIO else None
+
+        # Alerts travel over loopback UDP as in production, the agent listener is ours
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.udp.settimeout(0.5)
+
+        self.agent = fixtures.make_agent(group_id)
+        self.manager = fixtures.make_manager(INTERVALS, group_id, policy=False, burst_duration=0)
+        self.alerts = fixtures.make_alert_manager(group_id, self.udp.getsockname()[1])
+        self.fused = None
+        if FUSED:
+            self.fused = FusedPipeline(self.agent, self.manager, self.alerts)
+            to_manager = self.fused._from_agent
+
+            def forward(topic, payload):
+                self._observe_forwarded(payload)
+                to_manager(topic, payload)
+            self.agent._publish_internal = forward
+            self.broker.attach(self.agent)
+        else:
+            for component in (self.agent, self.manager, self.alerts):
+                self.broker.attach(component)
+
+        self.publisher = self.broker.client()
+        self.downlinks = self.broker.client(self._on_connect_downlinks, self._on_downlink)
+        self.probe = self.broker.client(self._on_connect_probe, self._on_forwarded)
+
+        self.ingest_ms = array("d")
+        self.control_ms = array("d")
+        self.sent = 0
+        self.late_ticks = 0
+        self.running = True
+
+    # ===== OBSERVERS =====
+
+    def _on_connect_downlinks(self, client, userdata, flags, rc):
+        client.subscribe(f"v3/{self.group_id}@ttn/devices/+/down/+")
+
+    def _on_connect_probe(self, client, userdata, flags, rc):
+        client.subscribe(self.agent.internal_topic)
+
+    def _on_forwarded(self, client, userdata, msg):
+        self._observe_forwarded(json.loads(msg.payload))
+
+    def _observe_forwarded(self, payload):
+        trace = payload.get("trace")
+        if trace:
+            self.ingest_ms.append((time.monotonic_ns() - trace["hops"][0][1]) / 1e6)
+
+    def _on_downlink(self, client, userdata, msg):
+        topic_parts = msg.topic.split("/")
+        i = self.fleet.index.get(topic_parts[3])
+        if i is None:
+            return
+        payload = json.loads(msg.payload)
+        command = payload["downlinks"][0]["frm_payload"]
+        with self.fleet_lock:
+            if topic_parts[-1] == "push_alert":
+                self.fleet.process_alert_command(i, command)
+            else:
+                self.fleet.process_control_command(i, command)
+        trace = payload.get("trace")
+        if trace:
+            self.control_ms.append((time.monotonic_ns() - trace["hops"][0][1]) / 1e6)
+
+    def _relay_alerts(self):
+        while self.running:
+            try:
+                data, _ = self.udp.recvfrom(1024)
+            except socket.timeout:
+                continue
+            self.agent._process_alert(json.loads(data.decode()))
+
+    # ===== LOAD =====
+
+    def components(self):
+        """Components connected to the broker"""
+        if self.fused:
+            return (self.agent,)
+        return (self.agent, self.manager, self.alerts)
+
+    def start(self):
+        for client in [c.mqtt_client for c in self.components()] + [self.publisher, self.downlinks, self.probe]:
+            client.connect()
+        if self.fused:
+            self.fused.start()
+        else:
+            threading.Thread(target=self._relay_alerts, daemon=True).start()
+
+    def run_for(self, seconds):
+        """Tick the fleet at its update time for the given wall time"""
+        tick = time.monotonic()
+        end = tick + seconds
+        while tick < end:
+            scheduled_ns = int(tick * 1e9)
+            with self.fleet_lock:
+                self.fleet.update_sensors()
+                due = list(self.fleet.generate_payloads())
+            if self.faults:
+                self.faults.advance(self.update_time)
+            for i, payload in due:
+                if random.random() < TRACE_SAMPLE_RATE:
+                    payload["uplink_message"]["decoded_payload"]["trace"] = {
+                        "id": f"{random.getrandbits(64):016x}", "hops": [["fleet_tick", scheduled_ns]]}
+                uplinks = self.faults.process_payload(self.fleet.machine_ids[i], payload) if self.faults else [payload]
+                for uplink in uplinks:
+                    self.publisher.publish(self.up_topics[i], json.dumps(uplink))
+                    self.sent += 1
+
+            tick += self.update_time
+            delay = tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late_ticks += 1
+
+    def drain(self, timeout=10):
+        """Wait for the queues to empty after the load stops"""
+        end = time.monotonic() + timeout
+        while (self.broker.pending() or (self.fused and self.fused.pending())) and time.monotonic() < end:
+            time.sleep(0.05)
+
+    def stop(self):
+        self.running = False
+        for client in [c.mqtt_client for c in self.components()] + [self.downlinks, self.probe]:
+            client.disconnect()
+        if self.fused:
+            self.fused.stop()
+
+    # ===== RESULTS =====
+
+    def counters(self):
+        errors = sum(child.value for child in self.agent.m_errors.children.values())
+        errors += self.manager.m_errors.value + self.alerts.m_errors.value
+        if self.fused:
+            errors += sum(child.value for child in self.fused.m_errors.children.values())
+        return {
+            "sent": self.sent,
+            "stored": self.agent.influx_client.points,
+            "dropped": self.broker.dropped,
+            "broker_messages": self.broker.published,
+            "errors": errors,
+            "late_ticks": self.late_ticks
+        }
+
+    def take_latencies(self):
+        """Latency samples since the previous call, then start over"""
+        ingest, control = self.ingest_ms, self.control_ms
+        self.ingest_ms, self.control_ms = array("d"), array("d")
+        return ingest, control
+
+def summarize(ingest, control):
+    return {
+        "ingest_p50_ms": round(percentile(ingest, 0.50), 2),
+        "ingest_p99_ms": round(percentile(ingest, 0.99), 2),
+        "ingest_max_ms": round(max(ingest, default=float("nan")), 2),
+        "control_p50_ms": round(percentile(control, 0.50), 2),
+        "control_p99_ms": round(percentile(control, 0.99), 2),
+        "traced": len(ingest)
+    }
+
+def ramp(update_time, start_machines, max_machines):
+    """Double the fleet every step until the ingest p99 SLO or the drop budget breaks"""
+    # sent_per_s < offered_per_s when alerts shut machines down, stored points are what counts
+    results = []
+    machines = start_machines
+    while machines <= max_machines:
+        pipeline = Pipeline(machines, update_time)
+        pipeline.start()
+        pipeline.run_for(WARMUP_SECONDS)
+        pipeline.take_latencies()
+        before = pipeline.counters()
+
+        pipeline.run_for(STEP_SECONDS)
+        pipeline.drain()
+        after = pipeline.counters()
+        ingest, control = pipeline.take_latencies()
+        pipeline.stop()
+
+        step = {"machines": machines, "update_time": update_time,
+                "offered_per_s": round(machines / update_time, 1),
+                "sent_per_s": round((after["sent"] - before["sent"]) / STEP_SECONDS, 1),
+                "sustained_per_s": round((after["stored"] - before["stored"]) / STEP_SECONDS, 1),
+                "broker_per_s": round((after["broker_messages"] - before["broker_messages"]) / STEP_SECONDS, 1),
+                "dropped": after["dropped"] - before["dropped"],
+                "errors": after["errors"] - before["errors"],
+                "late_ticks": after["late_ticks"] - before["late_ticks"],
+                "rss_mb": round(rss_mb(), 1)}
+        step.update(summarize(ingest, control))
+        sent = after["sent"] - before["sent"]
+        step["slo_ok"] = step["ingest_p99_ms"] <= SLO_P99_MS and step["dropped"] <= DROP_BUDGET * max(sent, 1)
+        results.append(step)
+        print(json.dumps(step))
+
+        if not step["slo_ok"]:
+            break
+        machines *= 2
+
+    passing = [r for r in results if r["slo_ok"]]
+    best = passing[-1] if passing else None
+    print(f"Highest load within SLO (p99 ingest <= {SLO_P99_MS} ms): "
+          + (f"{best['machines']} machines, {best['sustained_per_s']} msg/s" if best else "none"))
+    return results
+
+def soak(machines, update_time, hours):
+    """Fixed load for hours, one report line per SOAK_REPORT_SECONDS with the memory trend"""
+    pipeline = Pipeline(machines, update_time)
+    pipeline.start()
+    pipeline.run_for(WARMUP_SECONDS)
+    pipeline.take_latencies()
+    start_rss = rss_mb()
+    started = time.monotonic()
+    previous = pipeline.counters()
+
+    end = started + hours * 3600
+    while time.monotonic() < end:
+        pipeline.run_for(min(SOAK_REPORT_SECONDS, end - time.monotonic()))
+        current = pipeline.counters()
+        elapsed_h = (time.monotonic() - started) / 3600
+        rss = rss_mb()
+        line = {"elapsed_h": round(elapsed_h, 3),
+                "sustained_per_s": round((current["stored"] - previous["stored"]) / SOAK_REPORT_SECONDS, 1),
+                "dropped": current["dropped"], "errors": current["errors"], "late_ticks": current["late_ticks"],
+                "rss_mb": round(rss, 1), "rss_growth_mb_per_h": round((rss - start_rss) / max(elapsed_h, 1e-9), 2)}
+        line.update(summarize(*pipeline.take_latencies()))
+        print(json.dumps(line))
+        previous = current
+
+    pipeline.drain()
+    pipeline.stop()
+
+if __name__ == "__main__":
+    # ===== SOAK CONFIG =====
+    SLO_P99_MS = 250            # ingest latency objective
+    DROP_BUDGET = 0.001         # fraction of uplinks that may be dropped at a passing step
+    QUEUE_SIZE = 10000          # per-client broker queue, overflow = dropped message
+    TRACE_SAMPLE_RATE = 0.05    # fraction of uplinks traced for the latency figures
+    WARMUP_SECONDS = 5
+    STEP_SECONDS = 30
+    SOAK_REPORT_SECONDS = 60
+    SEED = 1
+    FAULT_SCENARIO = None       # scenario name in config/fault_scenarios.json (None = off)
+    FUSED = False               # components wired in memory (fused.py) instead of through the broker
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("ramp", "soak") or (sys.argv[1] == "soak" and len(sys.argv) != 5):
+        print("Usage: python3 -m benchmarks.soak ramp [UPDATE_TIME] [START_MACHINES] [MAX_MACHINES]")
+        print("       python3 -m benchmarks.soak soak <MACHINES> <UPDATE_TIME> <HOURS>")
+        sys.exit(1)
+
+    SPECS, INTERVALS = fixtures.configure()
+    random.seed(SEED)
+    for component in ("agent", "manager", "alert_manager", "fused"):
+        logger.setup(component, level="ERROR", rate_limits={"error": 5})
+
+    if sys.argv[1] == "ramp":
+        update_time = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+        start_machines = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+        max_machines = int(sys.argv[4]) if len(sys.argv) > 4 else 100000
+        ramp(update_time, start_machines, max_machines)
+    else:
+        soak(int(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]))
@@ -0,0 +1,384 @@
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import machine
+import sketches
+import tenants
+from benchmarks import fixtures
+
+# Run from meta2/:
+#   python3 -m benchmarks.suite run   [FILTER]   print the timings
+#   python3 -m benchmarks.suite save  [FILTER]   store them as the baseline
+#   python3 -m benchmarks.suite check [FILTER]   compare with the baseline, exit 1 on a regression
+#
+# A benchmark is a setup(size) returning a no-argument callable that performs one call
+# of the function under test. Component benchmarks run at growing fleet sizes: the
+# component is warmed with state for `size` machines and the calls cycle through them.
+# The reported time is the best of ROUNDS rounds, the least noisy statistic for
+# single-threaded CPU-bound code. As in timeit, the garbage collector is off while
+# measuring, so the state left by earlier benchmarks does not leak into later ones.
+#
+# Timings drift by far more than the threshold on a busy or frequency-scaled host, in
+# bursts of seconds to a minute, so one slow run is not a regression: save makes
+# BASELINE_PASSES passes over the suite and keeps each benchmark's best run, and check
+# measures the benchmarks that look slower again, in up to RECHECK_PASSES passes
+# RECHECK_PAUSE seconds apart, and judges each on its best run. A benchmark is cleared
+# as soon as one run is within its threshold, a real regression never is. Even best runs
+# vary by about 30% on a shared host, hence the 1.5x default threshold.
+# Baselines only compare meaningfully on the same host: against a baseline recorded on
+# another host or Python, check still prints the comparison but never fails.
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 1.5     # best of the runs slower than baseline * threshold = regression
+FLEET_SIZES = (1, 100, 1000, 10000)
+ROUND_SECONDS = 0.05
+ROUNDS = 5
+BASELINE_PASSES = 3         # passes over the suite when saving, each benchmark's best run is kept
+RECHECK_PASSES = 5          # passes over the benchmarks still over their threshold before they count
+RECHECK_PAUSE = 3           # seconds between passes, to get out of a slow spell
+
+BENCHMARKS = []
+
+def benchmark(name, sizes=(1,), threshold=DEFAULT_THRESHOLD):
+    def register(setup):
+        BENCHMARKS.append((name, sizes, threshold, setup))
+        return setup
+    return register
+
+def cycle(items):
+    """Callable returning the items round-robin, cheaper than itertools.cycle + next() lookups"""
+    state = [0, len(items)]
+
+    def next_item():
+        i = state[0]
+        state[0] = i + 1 if i + 1 < state[1] else 0
+        return items[i]
+    return next_item
+
+# ===== DATA MANAGER AGENT =====
+
+@benchmark("agent.standardize_units", FLEET_SIZES)
+def bench_standardize(size):
+    agent = fixtures.make_agent()
+    agent.machine_types.update(fixtures.fleet_ids(SPECS, size))
+    machine_ids = list(agent.machine_types)
+    readings = cycle([(machine_ids[i % size], r) for i, r in enumerate(fixtures.sample_readings(SPECS, 1000))])
+
+    def call():
+        machine_id, reading = readings()
+        agent._standardize_units(machine_id, reading)
+    return call
+
+@benchmark("agent.destandardize_units", FLEET_SIZES)
+def bench_destandardize(size):
+    agent = fixtures.make_agent()
+    agent.machine_types.update(fixtures.fleet_ids(SPECS, size))
+    units = ("temp_unit", "oil_unit", "batt_unit", "consumption_unit")
+    args = cycle([(machine_id, 2.5, units[i % 4]) for i, machine_id in enumerate(agent.machine_types)])
+
+    def call():
+        agent._destandardize_units(*args())
+    return call
+
+@benchmark("agent.destandardize_units[spec scan]")
+def bench_destandardize_scan(size):
+    # Machines not learned from an uplink yet fall back to the config's machine_codes (spec id -> code)
+    agent = fixtures.make_agent()
+    args = cycle([(specs["machine_id"], 2.5, "oil_unit") for specs in SPECS.values()])
+
+    def call():
+        agent._destandardize_units(*args())
+    return call
+
+@benchmark("agent.validate_uplink")
+def bench_validate_uplink(size):
+    agent = fixtures.make_agent()
+    payloads = cycle([json.loads(machine.Machine(code, 1).generate_payload()) for code in SPECS])
+
+    def call():
+        agent.configs.current.validate_uplink(payloads())
+    return call
+
+@benchmark("agent.process_control_message", FLEET_SIZES)
+def bench_control_message(size):
+    # Influx point + destandardization + hex encoding + downlink JSON, broker excluded
+    agent = fixtures.make_agent()
+    agent.mqtt_client = fixtures.NullMQTT()
+    agent.machine_types.update(fixtures.fleet_ids(SPECS, size))
+    params = list(fixtures.PARAM_MAP)
+    commands = cycle([{"machine_id": machine_id, "modify_param": params[i % len(params)], "adjustment": -2.5 + i % 6}
+                      for i, machine_id in enumerate(agent.machine_types)])
+
+    def call():
+        agent._process_control_message(commands())
+    return call
+
+@benchmark("tenants.route", (1, 10, 100))
+def bench_tenant_route(size):
+    # Topic -> group agent of a multi-tenant agent serving `size` groups
+    router = tenants.TopicRouter()
+    for group in range(size):
+        router.add(tenants.Tenant(str(group), fixtures.make_agent(str(group)), 1, None))
+    topics = cycle([f"v3/{i % size}@ttn/devices/M{i}/up" for i in range(1000)] +
+                   [f"{i % size}/internal/control_commands" for i in range(100)])
+
+    def call():
+        router.route(topics())
+    return call
+
+# ===== SKETCHES =====
+
+def warmed_sketches(size):
+    """FleetSketches holding an hour of readings for `size` machines, query time"""
+    fleet_sketches = sketches.FleetSketches()
+    agent = fixtures.make_agent()
+    machine_ids = list(fixtures.fleet_ids(SPECS, size))
+    readings = [agent._standardize_units(None, r) for r in fixtures.sample_readings(SPECS, 1000)]
+    now = time.time()
+    for i in range(max(size, len(readings))):
+        fleet_sketches.add(machine_ids[i % size], now - 3600 + 3600 * i / max(size, len(readings)),
+                           readings[i % len(readings)])
+    return fleet_sketches, machine_ids, readings, now
+
+@benchmark("sketches.add", FLEET_SIZES)
+def bench_sketch_add(size):
+    fleet_sketches, machine_ids, readings, now = warmed_sketches(size)
+    args = cycle([(machine_ids[i % size], now, r) for i, r in enumerate(readings)])
+
+    def call():
+        fleet_sketches.add(*args())
+    return call
+
+@benchmark("sketches.quantiles[machine]", FLEET_SIZES)
+def bench_sketch_machine(size):
+    fleet_sketches, machine_ids, _, now = warmed_sketches(size)
+    machine_ids = cycle(machine_ids)
+
+    def call():
+        fleet_sketches.quantiles("coolant_temp", (0.95,), now, machine_id=machine_ids())
+    return call
+
+@benchmark("sketches.quantiles[fleet]", FLEET_SIZES)
+def bench_sketch_fleet(size):
+    fleet_sketches, _, _, now = warmed_sketches(size)
+
+    def call():
+        fleet_sketches.quantiles("oil_pressure", (0.99,), now)
+    return call
+
+# ===== HEALTH RANKING =====
+
+@benchmark("health.observe_reading", FLEET_SIZES)
+def bench_health_reading(size):
+    agent = fixtures.make_agent()
+    machine_ids = list(fixtures.fleet_ids(SPECS, size))
+    comm_data = {"rssi": -95, "snr": -8}
+    readings = [(machine_ids[i % size], agent._standardize_units(None, r))
+                for i, r in enumerate(fixtures.sample_readings(SPECS, 1000))]
+    for machine_id, reading in readings[:size]:
+        agent.health.observe_reading(machine_id, reading, comm_data)
+    readings = cycle(readings)
+
+    def call():
+        machine_id, reading = readings()
+        agent.health.observe_reading(machine_id, reading, comm_data)
+    return call
+
+# ===== MACHINE =====
+
+@benchmark("machine.update_sensors")
+def bench_update_sensors(size):
+    return machine.Machine("H65P", 1).update_sensors
+
+@benchmark("machine.generate_payload")
+def bench_generate_payload(size):
+    return machine.Machine("H65P", 1).generate_payload
+
+@benchmark("machine.process_control_command")
+def bench_process_control_command(size):
+    m = machine.Machine("H65P", 1)
+    commands = cycle(["0x01 0x01 0x01 0x0A", "0x01 0x01 0x01 0xF6", "0x01 0x01 0x03 0x02", "0x01 0x01 0x03 0xFE"])
+
+    def call():
+        m.process_control_command(commands())
+    return call
+
+# ===== MACHINE DATA MANAGER =====
+
+@benchmark("manager.process_machine_data", FLEET_SIZES)
+def bench_process_machine_data(size):
+    manager = fixtures.make_manager(INTERVALS)
+    manager.mqtt_client = fixtures.NullMQTT()
+    agent = fixtures.make_agent()
+    machine_ids = list(fixtures.fleet_ids(SPECS, size))
+    readings = fixtures.sample_readings(SPECS, 1000)
+    payloads = [{"machine_id": machine_ids[i % size], "sensor_data": agent._standardize_units(None, r)}
+                for i, r in enumerate(readings)]
+    for payload in payloads[:size]:
+        manager._process_machine_data(payload)
+    payloads = cycle(payloads)
+
+    def call():
+        manager._process_machine_data(payloads())
+    return call
+
+# ===== ALERT MANAGER =====
+
+@benchmark("alert_manager.record_alarm", FLEET_SIZES)
+def bench_record_alarm(size):
+    alerts = fixtures.make_alert_manager()
+    machine_ids = list(fixtures.fleet_ids(SPECS, size))
+    for machine_id in machine_ids:
+        for _ in range(4):
+            alerts._record_alarm(machine_id)
+    machine_ids = cycle(machine_ids)
+
+    def call():
+        alerts._record_alarm(machine_ids())
+    return call
+
+# ===== RUNNER =====
+
+def measure(call):
+    """Best per-call time in ns over ROUNDS rounds of ~ROUND_SECONDS each"""
+    perf_counter = time.perf_counter
+    loops = 1
+    while True:
+        start = perf_counter()
+        for _ in range(loops):
+            call()
+        elapsed = perf_counter() - start
+        if elapsed >= ROUND_SECONDS / 5:
+            break
+        loops *= 4
+    loops = max(1, int(loops * ROUND_SECONDS / elapsed))
+
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = perf_counter()
+        for _ in range(loops):
+            call()
+        best = min(best, (perf_counter() - start) / loops)
+    return best * 1e9
+
+def run(name_filter=None, keys=None):
+    """name -> {"ns": ..., "threshold": ...} for every benchmark matching the filter (or in keys)"""
+    results = {}
+    # Machine methods print on every command, keep the terminal out of the numbers
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, sizes, threshold, setup in BENCHMARKS:
+            for size in sizes:
+                key = f"{name}[n={size}]" if len(sizes) > 1 else name
+                if (name_filter and name_filter not in key) or (keys is not None and key not in keys):
+                    continue
+                gc.collect()
+                call = setup(size)
+                gc.disable()
+                try:
+                    results[key] = {"ns": round(measure(call), 1), "threshold": threshold}
+                finally:
+                    gc.enable()
+                    del call
+                print(f"{key:<52} {results[key]['ns'] / 1000:10.2f} us/call", file=sys.stderr)
+    return results
+
+def load_baseline():
+    with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def host():
+    """Where timings were taken, baselines from elsewhere are advisory"""
+    return {"node": platform.node(), "python": platform.python_version(), "machine": platform.machine()}
+
+def save_baseline(results):
+    baseline = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "node": platform.node(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "benchmarks": results
+    }
+    # Partial runs (with a filter) update their entries only
+    if os.path.exists(BASELINE_PATH):
+        baseline["benchmarks"] = {**load_baseline()["benchmarks"], **results}
+    with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def best_of(passes, name_filter=None):
+    """Best run of every benchmark over several passes of the suite"""
+    results = run(name_filter)
+    for _ in range(passes - 1):
+        for key, result in run(name_filter).items():
+            if result["ns"] < results[key]["ns"]:
+                results[key] = result
+    return results
+
+def over_threshold(results, baseline):
+    return [key for key, result in results.items() if key in baseline
+            and result["ns"] / baseline[key]["ns"] > baseline[key].get("threshold", DEFAULT_THRESHOLD)]
+
+def recheck(results, baseline):
+    """Re-measure the benchmarks over their threshold, pass after pass, keep their best run"""
+    for n in range(RECHECK_PASSES):
+        suspects = over_threshold(results, baseline)
+        if not suspects:
+            break
+        if n:
+            time.sleep(RECHECK_PAUSE)
+        print(f"Re-measuring {len(suspects)} benchmark(s) over their threshold", file=sys.stderr)
+        for key, result in run(keys=set(suspects)).items():
+            if result["ns"] < results[key]["ns"]:
+                results[key] = result
+    return results
+
+def check(results):
+    """Print the comparison with the baseline, returns the regressed benchmark names"""
+    baseline = load_baseline()["benchmarks"]
+    results = recheck(results, baseline)
+    regressions = []
+    print(f"{'BENCHMARK':<52} {'BASE us':>10} {'NOW us':>10} {'RATIO':>7}")
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print(f"{key:<52} {'-':>10} {result['ns'] / 1000:10.2f}     new")
+            continue
+        ratio = result["ns"] / reference["ns"]
+        regressed = ratio > reference.get("threshold", DEFAULT_THRESHOLD)
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<52} {reference['ns'] / 1000:10.2f} {result['ns'] / 1000:10.2f} {ratio:7.2f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    name_filter = sys.argv[2] if len(sys.argv) > 2 else None
+    if command not in ("run", "save", "check"):
+        print("Usage: python3 -m benchmarks.suite [run|save|check] [FILTER]")
+        sys.exit(1)
+
+    SPECS, INTERVALS = fixtures.configure()
+    results = best_of(BASELINE_PASSES, name_filter) if command == "save" else run(name_filter)
+
+    if command == "save":
+        save_baseline(results)
+        print(f"Baseline written to {BASELINE_PATH}")
+    elif command == "check":
+        recorded = load_baseline()
+        recorded_on = {key: recorded.get(key) for key in host()}
+        regressions = check(results)
+        if recorded_on != host():
+            print(f"Baseline recorded on {recorded_on}, this is {host()}: comparison is advisory")
+            sys.exit(0)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
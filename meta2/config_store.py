@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+import logger
+import validation
+
+# Machine specs and healthy intervals, reloaded while the components run.
+#
+# The files are loaded, validated and compiled into a Snapshot: one generated
+# standardize function per machine code, destandardize functions per code and unit,
+# the intervals as (field, low, high, ideal, width) vectors, the PARAM_MAP/REASON_MAP
+# downlink prefixes and the uplink validator. A Snapshot is never modified once built.
+#
+# A ConfigStore watches the file mtimes from its own thread and builds the next
+# Snapshot there, off the message path, then publishes it by rebinding store.current:
+# one reference assignment, so readers never wait. Code on the message path takes
+# `config = store.current` once per message and uses that snapshot throughout, it sees
+# the old config or the new one, never a mix. Records it emits carry config.version.
+# A file that does not load or validate is logged and counted, the running snapshot
+# stays in use until the file is fixed.
+
+# Standardized field -> (uplink field, unit key in the specs)
+SENSORS = {
+    "rpm": ("rpm", None),
+    "coolant_temp": ("coolant_temperature", "temp_unit"),
+    "oil_pressure": ("oil_pressure", "oil_unit"),
+    "battery_potential": ("battery_potential", "batt_unit"),
+    "consumption": ("consumption", "consumption_unit")
+}
+
+# Unit key -> (standard unit, other accepted units)
+UNITS = {
+    "temp_unit": ("°C", ("°F",)),
+    "oil_unit": ("bar", ("psi",)),
+    "batt_unit": ("V", ("mV",)),
+    "consumption_unit": ("l/h", ("gal/h",))
+}
+
+# Machine unit -> expression converting an uplink value to the standard unit
+TO_STANDARD = {
+    "°F": "round(({} - 32) * 5/9, 2)",
+    "psi": "round({} * 0.0689476, 2)",
+    "mV": "round({} / 1000, 2)",
+    "gal/h": "round({} * 3.78541, 2)"
+}
+
+# Machine unit -> standard value back to the machine's unit (command adjustments)
+FROM_STANDARD = {
+    "°F": lambda value: (value * 9/5) + 32,
+    "psi": lambda value: value / 0.0689476,
+    "mV": lambda value: value * 1000,
+    "gal/h": lambda value: value / 3.78541
+}
+
+# Signed byte -> "0xNN", indexed by value & 0xFF
+ADJUSTMENT_HEX = tuple(f"0x{value:02X}" for value in range(256))
+
+class Snapshot:
+    __slots__ = ("version", "loaded_at", "specs", "intervals", "ranges", "standardizers", "destandardizers",
+                 "machine_codes", "param_codes", "reason_codes", "validate_uplink")
+
+def _check_specs(specs):
+    if not isinstance(specs, dict):
+        raise ValueError("specs: not an object")
+    for code, spec in specs.items():
+        if not isinstance(spec, dict) or not isinstance(spec.get("machine_id"), str):
+            raise ValueError(f"specs.{code}: missing machine_id")
+        for unit_key, (standard, others) in UNITS.items():
+            if spec.get(unit_key) not in (standard,) + others:
+                raise ValueError(f"specs.{code}.{unit_key}: unknown unit {spec.get(unit_key)!r}")
+
+def _check_intervals(intervals):
+    if not isinstance(intervals, dict):
+        raise ValueError("intervals: not an object")
+    for field, interval in intervals.items():
+        if field not in SENSORS:
+            raise ValueError(f"intervals.{field}: unknown field")
+        bounds = [interval.get(key) if isinstance(interval, dict) else None for key in ("low", "ideal", "high")]
+        if not all(isinstance(bound, (int, float)) and not isinstance(bound, bool) for bound in bounds):
+            raise ValueError(f"intervals.{field}: low, ideal and high must be numbers")
+        if not bounds[0] <= bounds[1] <= bounds[2] or bounds[0] == bounds[2]:
+            raise ValueError(f"intervals.{field}: needs low <= ideal <= high and low < high")
+
+def _compile_standardize(code, spec):
+    """Generated function(uplink decoded_payload) -> standardized reading of one machine code"""
+    items = [f'"machine_type": {code!r}']
+    for field, (source, unit_key) in SENSORS.items():
+        value = f"data[{source!r}]"
+        unit = spec[unit_key] if unit_key else None
+        items.append(f"{field!r}: {TO_STANDARD[unit].format(value) if unit in TO_STANDARD else value}")
+    source = "def standardize(data):\n    return {" + ", ".join(items) + "}\n"
+    namespace = {}
+    exec(compile(source, f"<standardize {code}>", "exec"), namespace)
+    return namespace["standardize"]
+
+def range_vectors(intervals):
+    """(field, low, high, ideal, width) per interval, in file order"""
+    return tuple((field, interval["low"], interval["high"], interval["ideal"], interval["high"] - interval["low"])
+                 for field, interval in intervals.items())
+
+def compile_config(specs, intervals, param_map=None, reason_map=None, version=1):
+    """Validated, compiled Snapshot; ValueError naming the offending entry otherwise"""
+    _check_specs(specs)
+    _check_intervals(intervals)
+    param_map = param_map or {}
+    for param, encoding in param_map.items():
+        if len(encoding) > 1 and encoding[1] not in UNITS:
+            raise ValueError(f"PARAM_MAP.{param}: unknown unit key {encoding[1]!r}")
+
+    snapshot = Snapshot()
+    snapshot.version = version
+    snapshot.loaded_at = time.time()
+    snapshot.specs = MappingProxyType(specs)
+    snapshot.intervals = MappingProxyType(intervals)
+    snapshot.ranges = range_vectors(intervals)
+    snapshot.standardizers = MappingProxyType({code: _compile_standardize(code, spec) for code, spec in specs.items()})
+    snapshot.destandardizers = MappingProxyType({
+        code: MappingProxyType({unit_key: FROM_STANDARD.get(spec[unit_key]) for unit_key in UNITS})
+        for code, spec in specs.items()})
+    # Fallback for machines not seen in an uplink yet, first code listed wins
+    machine_codes = {}
+    for code, spec in specs.items():
+        machine_codes.setdefault(spec["machine_id"], code)
+    snapshot.machine_codes = MappingProxyType(machine_codes)
+    # param -> (actuator command up to the adjustment byte, unit key or None)
+    snapshot.param_codes = MappingProxyType({
+        param: (f"0x01 0x01 {encoding[0]} ", encoding[1] if len(encoding) > 1 else None)
+        for param, encoding in param_map.items()})
+    snapshot.reason_codes = MappingProxyType({reason: f"0x02 0x01 {code}" for reason, code in (reason_map or {}).items()})
+    snapshot.validate_uplink = validation.uplink_validator(specs)
+    return snapshot
+
+class ConfigStore:
+    """Current Snapshot of the specs and intervals, reloaded when their files change"""
+
+    def __init__(self, specs, intervals, param_map=None, reason_map=None,
+                 specs_path=None, intervals_path=None, reload_every=2, component="agent"):
+        self.specs = specs
+        self.intervals = intervals
+        self.param_map = param_map
+        self.reason_map = reason_map
+        self.paths = {"specs": specs_path, "intervals": intervals_path}     # None = not watched
+        self.reload_every = reload_every
+        self.mtimes = {name: self._mtime(path) for name, path in self.paths.items()}
+        self.listeners = []
+        self.reloads = 0
+        self.failures = 0
+        self.running = False
+        # Logged under the owning component's categories (see logger.setup in its __main__)
+        self.log = logger.get(component, "main")
+        self.log_error = logger.get(component, "error")
+        self.current = compile_config(specs, intervals, param_map, reason_map)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns if path else None
+        except OSError:
+            return None
+
+    def subscribe(self, listener):
+        """listener(snapshot) after every swap, from the watcher thread"""
+        self.listeners.append(listener)
+
+    def reload(self):
+        """Load the watched files and swap in their snapshot, False if they are invalid"""
+        loaded = {"specs": self.specs, "intervals": self.intervals}
+        try:
+            for name, path in self.paths.items():
+                if path:
+                    with open(path, "r", encoding="utf-8") as f:
+                        loaded[name] = json.load(f)
+            snapshot = compile_config(loaded["specs"], loaded["intervals"], self.param_map, self.reason_map,
+                                      self.current.version + 1)
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError is a ValueError
+            self.failures += 1
+            self.log_error.error("Config not reloaded, keeping version %s: %s", self.current.version, e)
+            return False
+
+        self.specs, self.intervals = loaded["specs"], loaded["intervals"]
+        self.current = snapshot
+        self.reloads += 1
+        self.log.info("Config version %s loaded (%s machine types, %s intervals)",
+                      snapshot.version, len(snapshot.specs), len(snapshot.ranges))
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                self.log_error.error("Config listener failed: %s", e)
+        return True
+
+    def check(self):
+        """Reload if a watched file changed since the last check"""
+        mtimes = {name: self._mtime(path) for name, path in self.paths.items()}
+        if mtimes == self.mtimes:
+            return False
+        # Remembered even if the reload fails: the next attempt waits for the next edit
+        self.mtimes = mtimes
+        return self.reload()
+
+    def _watch(self):
+        while self.running:
+            time.sleep(self.reload_every)
+            self.check()
+
+    def start(self):
+        """Watch the files from a daemon thread (no-op without paths or if already watching)"""
+        if self.running or not any(self.paths.values()) or not self.reload_every:
+            return
+        self.running = True
+        threading.Thread(target=self._watch, daemon=True).start()
@@ -1,18 +1,52 @@
+import startup
 import paho.mqtt.client as mqtt
 import socket
 import json
 import threading
-from influxdb_client_3 import InfluxDBClient3, Point
-from datetime import datetime
+import time
+import metrics
+import tracing
+import logger
+import profiler
+import state_store
+import sketches
+import health
+import dedup
+import validation
+import partitioning
+import config_store
+from traffic_log import TrafficLogReader
+from datetime import datetime, timedelta
+
+# influxdb_client_3 pulls in pyarrow: seconds of a cold start. It is imported by import_influx(),
+# from the thread that creates the client once MQTT is up (see DataManagerAgent._init_influx)
+InfluxDBClient3 = Point = None
+
+def import_influx():
+    """Import the InfluxDB client library (once)"""
+    global InfluxDBClient3, Point
+    if Point is None:
+        from influxdb_client_3 import InfluxDBClient3, Point
 
 class DataManagerAgent:
-    def __init__(self, group_id):
+    def __init__(self, group_id, config=None, influx_client=None, mqtt_client=None):
         self.group_id = group_id
-        self.mqtt_client = mqtt.Client()
+        self.mqtt_client = mqtt_client or mqtt.Client()
         self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Compiled specs, intervals and encodings (config_store.py), swapped when the files change.
+        # Defaults to this module's config, not watched; __main__, fused.py and tenants.py pass watched stores
+        self.configs = config or config_store.ConfigStore(MACHINE_SPECS, INTERVALS, PARAM_MAP, REASON_MAP)
+        self.configs.subscribe(self._on_config)
         
-        # Initialize InfluxDB client
-        self.influx_client = InfluxDBClient3(host=URL,token=TOKEN,database=BUCKET,org=ORG)
+        # InfluxDB client: given, or created off-thread once subscribed (start_influx). Until it is
+        # ready, messages are held in order in a bounded buffer and replayed by attach_influx
+        self.influx_client = None
+        self.influx_ready = threading.Event()
+        self.influx_thread = None
+        self.startup_buffer = []
+        self.startup_lock = threading.Lock()
+        self.subscribed = False
         
         # MQTT callbacks
         self.mqtt_client.on_connect = self._on_mqtt_connect
@@ -21,50 +55,290 @@ class DataManagerAgent:
         # Internal communication topics
         self.internal_topic = f"{group_id}/internal/machine_data"
         self.control_topic = f"{group_id}/internal/control_commands"
+        self.rate_topic = f"{group_id}/internal/rate_commands"
+        self.routes = {self.control_topic: "control_commands", self.rate_topic: "rate_commands"}
+
+        # Partitioned managers: readings go to internal/machine_data/<partition of the machine>
+        self.partitions = MANAGER_PARTITIONS
+        self.forward_topics = {}    # machine_id -> forward topic
+
+        # False when fused.py delivers the internal messages in memory instead of the broker/UDP
+        self.standalone = True
+
+        # machine_id -> machine code, learned from uplinks (fleet ids are not in the specs)
+        self.machine_types = {}
+
+        # Latest values, recent history and rolling quantiles, queried locally instead of through InfluxDB
+        self.sketches = sketches.FleetSketches() if QUANTILE_SKETCHES else None
+        self.state = state_store.StateStore(STATE_CAPACITY, self.sketches)
+
+        # Repeated deliveries of an uplink (several gateways, QoS redelivery) are dropped
+        self.dedup = dedup.UplinkDeduplicator(DEDUP_TTL, DEDUP_MAX_ENTRIES) if DEDUP_TTL else None
+
+        # Uplinks are checked against the TTN uplink schema (compiled with the config), rejects kept for diagnosis
+        self.quarantine = validation.Quarantine(QUARANTINE_SIZE, QUARANTINE_FLOOD_REJECTS,
+                                                QUARANTINE_FLOOD_WINDOW, QUARANTINE_BLOCK_SECONDS)
+
+        # Worst machines first: distance from ideal, command/alarm rate and link quality
+        self.health = health.HealthIndex(self.configs.current.intervals, HEALTH_WEIGHTS, HEALTH_LINK_LEVELS)
+
+        # Metrics (served on /metrics when METRICS_PORT is set)
+        self.metrics = metrics.Registry("agent_")
+        self.m_messages = self.metrics.counter("messages", "MQTT/UDP messages received", ["topic"])
+        self.m_errors = self.metrics.counter("message_errors", "Messages that failed processing", ["topic"])
+        self.m_decode = self.metrics.histogram("decode_seconds", "JSON decode latency")
+        self.m_convert = self.metrics.histogram("convert_seconds", "Unit standardization latency")
+        self.m_write = self.metrics.histogram("influx_write_seconds", "InfluxDB write latency")
+        self.m_batch = self.metrics.histogram("influx_batch_points", "Points per InfluxDB write", metrics.SIZE_BUCKETS)
+        self.m_write_failures = self.metrics.counter("influx_write_failures", "Failed InfluxDB writes")
+        self.m_downlinks = self.metrics.counter("downlinks", "Downlinks published", ["type"])
+        self.m_forwarded = self.metrics.counter("forwarded", "Readings forwarded to MachineDataManager")
+        self.m_machines = self.metrics.gauge("machines", "Machines seen since start")
+        self.m_machines.set_function(lambda: len(self.machine_types))
+        self.m_rejected = self.metrics.counter("rejected_uplinks", "Uplinks quarantined or refused", ["reason"])
+        self.m_duplicates = self.metrics.counter("duplicate_uplinks", "Uplink deliveries dropped as duplicates")
+        if self.dedup:
+            self.metrics.gauge("dedup_hit_ratio", "Share of uplink deliveries that were duplicates") \
+                .set_function(self.dedup.hit_rate)
+            self.metrics.gauge("dedup_entries", "Uplinks remembered for deduplication") \
+                .set_function(lambda: len(self.dedup.entries))
+            self.metrics.gauge("dedup_memory_bytes", "Approximate memory of the dedup cache") \
+                .set_function(self.dedup.memory_bytes)
+        self.metrics.gauge("config_version", "Version of the config in use").set_function(
+            lambda: self.configs.current.version)
+        self.metrics.gauge("config_reload_failures", "Config changes rejected as invalid").set_function(
+            lambda: self.configs.failures)
+        self.m_out_queue = self.metrics.gauge("mqtt_out_queue", "Packets queued in the MQTT client")
+        self.m_out_queue.set_function(lambda: len(getattr(self.mqtt_client, "_out_packet", ())))
+        self.metrics.gauge("startup_buffered", "Messages held until the InfluxDB client is ready") \
+            .set_function(lambda: len(self.startup_buffer))
+        self.m_startup_dropped = self.metrics.counter("startup_dropped", "Messages dropped, startup buffer full")
+
+        # Logging categories (see logger.setup in __main__)
+        self.log = logger.get("agent", "main")
+        self.log_payload = logger.get("agent", "payload")
+        self.log_message = logger.get("agent", "message")
+        self.log_storage = logger.get("agent", "storage")
+        self.log_error = logger.get("agent", "error")
+
+        # End-to-end tracing: hops of the traces started by the machines
+        self.tracer = tracing.Tracer("agent", report_every=TRACE_REPORT_EVERY)
+
+        # Runtime profiling hooks, idle until a capture is requested
+        self.profiler = profiler.StageProfiler("agent", {
+            "decode": (self, "_decode"),
+            "standardize_units": (self, "_standardize_units"),
+            "influx_write": (self, "_write_influx"),
+            "publish": (self.mqtt_client, "publish")
+        })
+
+        if influx_client is not None:
+            import_influx()
+            self.attach_influx(influx_client)
 
     def _on_mqtt_connect(self, client, userdata, flags, rc):
-        print(f"Connected to MQTT broker with result code {rc}")
+        self.log.info("Connected to MQTT broker with result code %s", rc)
         # Subscribe to machine data topics
         client.subscribe(f"v3/{self.group_id}@ttn/devices/+/up")
-        # Subscribe to control commands from MachineDataManager
-        client.subscribe(self.control_topic)
-        print(f"Subscribed to topics:\n- v3/{self.group_id}@ttn/devices/+/up\n- {self.control_topic}")
+        if self.standalone:
+            # Subscribe to control commands from MachineDataManager
+            client.subscribe(self.control_topic)
+            # Subscribe to reporting period changes from MachineDataManager
+            client.subscribe(self.rate_topic)
+            self.log.info("Subscribed to topics:\n- v3/%s@ttn/devices/+/up\n- %s\n- %s", self.group_id, self.control_topic, self.rate_topic)
+        else:
+            self.log.info("Subscribed to topic: v3/%s@ttn/devices/+/up (fused mode)", self.group_id)
+
+        if not self.subscribed:
+            self.subscribed = True
+            startup.mark("subscribe")
+            startup.report("receiving")
+            self.start_influx()
+
+    def start_influx(self):
+        """Create the InfluxDB client in the background, unless there is one already"""
+        if self.influx_thread is None and not self.influx_ready.is_set():
+            self.influx_thread = threading.Thread(target=self._init_influx, daemon=True)
+            self.influx_thread.start()
+
+    def _init_influx(self):
+        """Import the library and create the client off the MQTT thread, then replay"""
+        start = time.perf_counter()
+        try:
+            import_influx()
+            startup.mark("influx_import", start)
+            start = time.perf_counter()
+            client = InfluxDBClient3(host=URL,token=TOKEN,database=BUCKET,org=ORG)
+            startup.mark("influx_client", start)
+        except Exception as e:
+            # Messages stay held (up to STARTUP_BUFFER): nothing can be stored without a client
+            self.log_error.error("Could not create the InfluxDB client: %s", e)
+            return
+        start = time.perf_counter()
+        replayed = self.attach_influx(client)
+        startup.mark(f"replay of {replayed} held messages", start)
+        startup.report("storing")
+
+    def attach_influx(self, client):
+        """Store through client from now on, after replaying the held messages; returns how many"""
+        self.influx_client = client
+        replayed = 0
+        while True:
+            # Batches taken under the lock, processed outside it; arrivals meanwhile queue behind
+            with self.startup_lock:
+                held, self.startup_buffer = self.startup_buffer, []
+                if not held:
+                    self.influx_ready.set()
+                    break
+            for kind, message, device_id in held:
+                self._process(kind, message, device_id)
+            replayed += len(held)
+        if replayed:
+            self.log.info("InfluxDB client ready, %d held messages replayed", replayed)
+        return replayed
+
+    def _hold(self, kind, message, device_id=None):
+        """Buffer a message while the InfluxDB client is not ready, False once it is"""
+        with self.startup_lock:
+            if self.influx_ready.is_set():
+                return False
+            if len(self.startup_buffer) < STARTUP_BUFFER:
+                self.startup_buffer.append((kind, message, device_id))
+            else:
+                self.m_startup_dropped.inc()
+            return True
+
+    def _process(self, kind, message, device_id=None):
+        """Any message, UDP alerts included, once past the startup buffer"""
+        if kind != "udp_alert":
+            self._dispatch_message(kind, message, device_id)
+            return
+        try:
+            self._process_alert(message)
+        except Exception as e:
+            self.m_errors.labels(kind).inc()
+            self.log_error.error("Error processing UDP alert: %s", e)
 
 
     def _on_mqtt_message(self, client, userdata, msg):
+        # Metric label per subscription, not per machine
+        kind = self.routes.get(msg.topic, "up")
+        self._handle_message(kind, msg, msg.topic.split("/")[3] if kind == "up" else None)
+
+    def _handle_message(self, kind, msg, device_id=None):
+        """One MQTT message whose kind (and device, for uplinks) the caller took from the topic"""
+        if not self.influx_ready.is_set() and self._hold(kind, msg, device_id):
+            return
+        self._dispatch_message(kind, msg, device_id)
+
+    def _dispatch_message(self, kind, msg, device_id=None):
+        self.m_messages.labels(kind).inc()
+
+        # A device flooding malformed uplinks is refused by topic, before any decoding
+        if kind == "up":
+            if self.quarantine.blocked(device_id):
+                self.m_rejected.labels("blocked").inc()
+                return
+
         try:
-            payload = json.loads(msg.payload.decode())
-            print(f"Received data:\n{payload}")
+            start = time.perf_counter()
+            try:
+                payload = self._decode(msg.payload)
+            except ValueError:
+                if kind != "up":
+                    raise
+                self._reject(device_id, "json", msg.payload)
+                return
+            self.m_decode.observe(time.perf_counter() - start)
+            self.log_payload.debug("Received data:\n%s", payload)
+
+            # One config snapshot for the whole message, even if a reload happens meanwhile
+            config = self.configs.current
+            if kind == "up":
+                reason = config.validate_uplink(payload)
+                if reason:
+                    self._reject(device_id, reason, msg.payload)
+                    return
             
             # Route messages based on topic
-            if msg.topic == self.control_topic:
-                self._process_control_message(payload)
+            if kind == "control_commands":
+                self._process_control_message(payload, config)
+            elif kind == "rate_commands":
+                self._process_rate_message(payload, config)
             else:
-                self._process_machine_data(payload)
+                self._process_machine_data(payload, config)
                 
         except Exception as e:
-            print(f"Error processing MQTT message: {e}")
+            self.m_errors.labels(kind).inc()
+            self.log_error.error("Error processing MQTT message: %s", e)
 
-    def _process_machine_data(self, payload):
+    def _decode(self, data):
+        return json.loads(data.decode())
+
+    def _on_config(self, snapshot):
+        """Derived state that is not read through a snapshot follows the swap"""
+        self.health.intervals = snapshot.intervals
+
+    def _reject(self, device_id, reason, raw):
+        """Quarantine a malformed uplink"""
+        self.m_rejected.labels(reason).inc()
+        if self.quarantine.reject(device_id, reason, raw):
+            self.log_error.warning("Refusing uplinks from %s for %ss: too many malformed messages (%s)",
+                                   device_id, QUARANTINE_BLOCK_SECONDS, reason)
+
+    def _process_machine_data(self, payload, config=None):
         """Process incoming machine data"""
+        config = config or self.configs.current
         machine_id = payload["end_device_ids"]["machine_id"]
-        print(f"Received data from {machine_id}")
+        self.log_message.info("Received data from %s", machine_id)
+
+        gateways = payload["uplink_message"]["rx_metadata"]
+        if self.dedup:
+            gateways = self.dedup.check(machine_id, payload)
+            if gateways is None:
+                self.m_duplicates.inc()
+                self.log_message.info("Dropped duplicate uplink from %s", machine_id)
+                return
         
-        # Extract and process sensor data
+        # Extract and process sensor data (link figures of the gateway that heard it best)
         sensor_data = payload["uplink_message"]["decoded_payload"]
-        comm_data = payload["uplink_message"]["rx_metadata"][0]
+        comm_data = max(gateways, key=lambda gateway: gateway.get("snr", float("-inf")))
+        self.machine_types[machine_id] = sensor_data["machine_type"]
+
+        trace = sensor_data.get("trace")
+        if trace:
+            self.tracer.hop(trace, "agent_uplink")
         
         # Standardize units
-        standardized_data = self._standardize_units(machine_id, sensor_data)
+        start = time.perf_counter()
+        standardized_data = self._standardize_units(machine_id, sensor_data, config)
+        self.m_convert.observe(time.perf_counter() - start)
         
-        # Store in InfluxDB
-        self._store_in_influxdb(machine_id, standardized_data, comm_data)
+        # Multi-sample uplinks go into the local history sample by sample (see below)
+        if "samples" not in sensor_data:
+            self.state.add(machine_id, time.time(), standardized_data, comm_data)
+
+        # Store in InfluxDB (summary uplinks carry no raw reading of their own)
+        if "summary" in sensor_data:
+            self._store_summary_in_influxdb(machine_id, payload["received_at"], sensor_data, comm_data, config)
+        if "samples" in sensor_data:
+            self._store_samples_in_influxdb(machine_id, payload["received_at"], sensor_data, comm_data, config)
+        elif "summary" not in sensor_data:
+            self._store_in_influxdb(machine_id, standardized_data, comm_data, config)
         
+        # Backfilled readings are history, the control loop only acts on live data
+        if sensor_data.get("backfill"):
+            return
+
+        # Multi-sample uplinks only forward the latest reading (top-level values)
         if sensor_data["rpm"] != 0 or sensor_data["battery_potential"] != 0 or sensor_data["consumption"] != 0:
+            # Stopped machines keep their last score instead of ranking on zeros
+            self.health.observe_reading(machine_id, standardized_data, comm_data)
+
             # Forward to Machine Data Manager
-            self._forward_to_data_manager(machine_id, standardized_data)
+            self._forward_to_data_manager(machine_id, standardized_data, trace, config)
 
-    def _process_control_message(self, payload):
+    def _process_control_message(self, payload, config=None):
         """Process control messages without modification"""
 
         """RECEIVING DATA OF THIS TYPE"""
@@ -75,45 +349,94 @@ class DataManagerAgent:
         #        "timestamp: ..."
         #        }
 
+        config = config or self.configs.current
         machine_id = payload["machine_id"]
         param = payload["modify_param"] 
         adjustment = payload["adjustment"]
+        self.health.observe_command(machine_id)
+
+        trace = payload.get("trace")
+        if trace:
+            self.tracer.hop(trace, "agent_control")
 
         # Store raw control message
         try:
             point = Point("machine_control") \
                 .tag("machine_id", machine_id) \
+                .tag("group_id", self.group_id) \
                 .field("modify_param", param) \
                 .field("adjustment", float(adjustment)) \
+                .field("config_version", config.version) \
                 .time(datetime.now().isoformat())
-            self.influx_client.write([point])
-            print(f"Stored control message for {machine_id} in InfluxDB")
+            self._write_influx([point])
+            self.log_storage.info("Stored control message for %s in InfluxDB", machine_id)
         except Exception as e:
-            print(f"Failed to write to InfluxDB: {str(e)}")
+            self.log_error.error("Failed to write to InfluxDB: %s", e)
         
-        # Forward encoded command
-
-        param_enc = PARAM_MAP[param][0]  # Always exists
-
-        # Only retrieve units if there's a second item
-        units = PARAM_MAP[param][1] if len(PARAM_MAP[param]) > 1 else None
+        # Forward encoded command (prefix "0x01 0x01 <param code> " precompiled from PARAM_MAP)
+        prefix, units = config.param_codes[param]
 
         if units:
             # Destandardize the adjustment
-            adjustment = self._destandardize_units(machine_id, adjustment, units)
+            adjustment = self._destandardize_units(machine_id, adjustment, units, config)
 
-            adjustment = int(round(adjustment))
+        # The command carries a signed byte (RPM adjustments arrive as floats too,
+        # millivolt adjustments can exceed the byte and are clamped)
+        adjustment = max(-128, min(int(round(adjustment)), 127))
 
-        if adjustment < 0:
-            hex_adj = hex(0x100 + adjustment)[2:].upper().zfill(2)
+        command = prefix + config_store.ADJUSTMENT_HEX[adjustment & 0xFF]
+
+        # send to TTN Server
+        downlink = {
+            "downlinks": [{
+                "frm_payload": command,
+                "f_port": 10,
+                "priority": "NORMAL"
+            }]
+        }
+        if trace:
+            self.tracer.hop(trace, "agent_downlink")
+            downlink["trace"] = trace
+        topic = f"v3/{self.group_id}@ttn/devices/{machine_id}/down/push_actuator"
+        self.mqtt_client.publish(topic, json.dumps(downlink))
+        self.m_downlinks.labels("actuator").inc()
+
+    def _process_rate_message(self, payload, config=None):
+        """Forward a reporting period change or raw burst request as a push_actuator downlink"""
+
+        """RECEIVING DATA OF THIS TYPE"""
+        # OBJ = {
+        #        "machine_id":"M1",
+        #        "report_period": 30.0,     (or)    "burst_duration": 60,
+        #        "timestamp: ..."
+        #        }
+
+        config = config or self.configs.current
+        machine_id = payload["machine_id"]
+        if "burst_duration" in payload:
+            param, value, action = "burst_duration", payload["burst_duration"], "0x03"
+            # Duration travels as whole seconds in two unsigned bytes
+            encoded = max(1, min(int(round(value)), 0xFFFF))
         else:
-            hex_adj = hex(adjustment)[2:].upper().zfill(2)
+            param, value, action = "report_period", payload["report_period"], "0x02"
+            # Period travels as tenths of a second in two unsigned bytes
+            encoded = max(1, min(int(round(value * 10)), 0xFFFF))
 
-        adjustment_enc = f"0x{hex_adj}"
+        try:
+            point = Point("machine_control") \
+                .tag("machine_id", machine_id) \
+                .tag("group_id", self.group_id) \
+                .field("modify_param", param) \
+                .field("adjustment", float(value)) \
+                .field("config_version", config.version) \
+                .time(datetime.now().isoformat())
+            self._write_influx([point])
+            self.log_storage.info("Stored %s for %s in InfluxDB", param, machine_id)
+        except Exception as e:
+            self.log_error.error("Failed to write to InfluxDB: %s", e)
 
-        command = f"0x01 0x01 {param_enc} {adjustment_enc}"
+        command = f"0x01 {action} 0x{encoded >> 8:02X} 0x{encoded & 0xFF:02X}"
 
-        # send to TTN Server
         downlink = {
             "downlinks": [{
                 "frm_payload": command,
@@ -123,131 +446,161 @@ class DataManagerAgent:
         }
         topic = f"v3/{self.group_id}@ttn/devices/{machine_id}/down/push_actuator"
         self.mqtt_client.publish(topic, json.dumps(downlink))
-
-    def _destandardize_units(self, machine_id, value, unit_type):
-       
-        machine_spec = None
-        for specs in MACHINE_SPECS.values():
-            if specs["machine_id"] == machine_id:
-                machine_spec = specs
-                break
-        
-        if not machine_spec:
+        self.m_downlinks.labels(param).inc()
+
+    def _destandardize_units(self, machine_id, value, unit_type, config=None):
+        """Standardized value back to the unit of the machine (unit_type: "temp_unit", ...)"""
+        config = config or self.configs.current
+        machine_code = self.machine_types.get(machine_id) or config.machine_codes.get(machine_id)
+        converters = config.destandardizers.get(machine_code)
+        if converters is None:
             raise ValueError(f"Unknown machine ID: {machine_id}")
-        
-        # Get the machine's specific unit for this type
-        machine_unit = machine_spec[unit_type]
-        
-        # Conversion logic based on unit type
-        if unit_type == "temp_unit":
-            if machine_unit == "°F":
-                # Convert from standardized °C to °F
-                return (value * 9/5) + 32
-        
-        elif unit_type == "oil_unit":
-            if machine_unit == "psi":
-                # Convert from standardized bar to psi
-                return value / 0.0689476
-        
-        elif unit_type == "batt_unit":
-            if machine_unit == "mV":
-                # Convert from standardized V to mV
-                return value * 1000
-        
-        elif unit_type == "consumption_unit":
-            if machine_unit == "gal/h":
-                # Convert from standardized l/h to gal/h
-                return value / 3.78541
-        
-        # Return original value if no conversion needed
-        return value
 
+        # None when the machine already uses the standard unit
+        convert = converters[unit_type]
+        return value if convert is None else convert(value)
 
-    def _standardize_units(self, machine_id, sensor_data):
+    def _standardize_units(self, machine_id, sensor_data, config=None):
         """Convert all values to standardized units"""
-        machine_code = sensor_data["machine_type"]
-        standardized = {}
-        standardized["machine_type"] = machine_code
-        
-        # RPM (no conversion needed)
-        standardized["rpm"] = sensor_data["rpm"]
-        
-        # Temperature (convert °F to °C if needed)
-        if MACHINE_SPECS[machine_code]["temp_unit"] == "°F":
-            standardized["coolant_temp"] = round((sensor_data["coolant_temperature"] - 32) * 5/9,2)
-        else:
-            standardized["coolant_temp"] = sensor_data["coolant_temperature"]
-        
-        # Oil pressure (convert psi to bar if needed)
-        if MACHINE_SPECS[machine_code]["oil_unit"] == "psi":
-            standardized["oil_pressure"] = round(sensor_data["oil_pressure"] * 0.0689476,2)
-        else:
-            standardized["oil_pressure"] = sensor_data["oil_pressure"]
-        
-        # Battery (convert mV to V if needed)
-        if MACHINE_SPECS[machine_code]["batt_unit"] == "mV":
-            standardized["battery_potential"] = round(sensor_data["battery_potential"] / 1000,2)
-        else:
-            standardized["battery_potential"] = sensor_data["battery_potential"]
-        
-        # Consumption (convert gal/h to l/h if needed)
-        if MACHINE_SPECS[machine_code]["consumption_unit"] == "gal/h":
-            standardized["consumption"] = round(sensor_data["consumption"] * 3.78541,2)
-        else:
-            standardized["consumption"] = sensor_data["consumption"]
-        
-        return standardized
+        # One generated function per machine code, see config_store.py
+        return (config or self.configs.current).standardizers[sensor_data["machine_type"]](sensor_data)
 
-    def _store_in_influxdb(self, machine_id, standartize_data, comm_data):
+    def _write_influx(self, points):
+        """Write a batch of Points, timed and counted"""
+        start = time.perf_counter()
+        try:
+            self.influx_client.write(points)
+        except Exception:
+            self.m_write_failures.inc()
+            raise
+        finally:
+            self.m_write.observe(time.perf_counter() - start)
+        self.m_batch.observe(len(points))
+
+    def _make_point(self, machine_id, standartize_data, comm_data, timestamp, config_version):
+        """Build a single InfluxDB Point with all machine data"""
+        return Point("machine_data") \
+            .tag("machine_id", machine_id) \
+            .tag("group_id", self.group_id) \
+            .tag("machine_type", standartize_data["machine_type"]) \
+            .field("rpm", float(standartize_data["rpm"])) \
+            .field("coolant_temp", float(standartize_data["coolant_temp"])) \
+            .field("oil_pressure", float(standartize_data["oil_pressure"])) \
+            .field("battery_potential", float(standartize_data["battery_potential"])) \
+            .field("consumption", float(standartize_data["consumption"])) \
+            .field("rssi", float(comm_data["rssi"])) \
+            .field("snr", float(comm_data["snr"])) \
+            .field("channel_rssi", float(comm_data.get("channel_rssi", comm_data["rssi"]))) \
+            .field("config_version", config_version) \
+            .time(timestamp)
+
+    def _store_in_influxdb(self, machine_id, standartize_data, comm_data, config):
         """Store all machine data in a single InfluxDB Point"""
         try:
-            # Create a single Point with all data
-            point = Point("machine_data") \
-                .tag("machine_id", machine_id) \
-                .tag("machine_type", standartize_data["machine_type"]) \
-                .field("rpm", float(standartize_data["rpm"])) \
-                .field("coolant_temp", float(standartize_data["coolant_temp"])) \
-                .field("oil_pressure", float(standartize_data["oil_pressure"])) \
-                .field("battery_potential", float(standartize_data["battery_potential"])) \
-                .field("consumption", float(standartize_data["consumption"])) \
-                .field("rssi", float(comm_data["rssi"])) \
-                .field("snr", float(comm_data["snr"])) \
-                .field("channel_rssi", float(comm_data.get("channel_rssi", comm_data["rssi"]))) \
-                .time(datetime.now().isoformat())
+            point = self._make_point(machine_id, standartize_data, comm_data, datetime.now().isoformat(),
+                                     config.version)
             
             # Write the combined data point
-            self.influx_client.write(point)
+            self._write_influx([point])
             
-            print(f"Stored combined data for {machine_id} in InfluxDB")
+            self.log_storage.info("Stored combined data for %s in InfluxDB", machine_id)
         except Exception as e:
-            print(f"Error storing in InfluxDB: {e}")
+            self.log_error.error("Error storing in InfluxDB: %s", e)
 
-    def _forward_to_data_manager(self, machine_id, sensor_data):
+    def _store_samples_in_influxdb(self, machine_id, received_at, sensor_data, comm_data, config):
+        """Unpack a multi-sample uplink and store every sample in one batch write"""
+        try:
+            sent_at = datetime.fromisoformat(received_at)
+            points = []
+            for sample in sensor_data["samples"]:
+                sample_data = dict(sample, machine_type=sensor_data["machine_type"])
+                standardized = self._standardize_units(machine_id, sample_data, config)
+                timestamp = sent_at + timedelta(milliseconds=sample["offset_ms"])
+                self.state.add(machine_id, timestamp.timestamp(), standardized, comm_data)
+                points.append(self._make_point(machine_id, standardized, comm_data, timestamp.isoformat(),
+                                               config.version))
+
+            self._write_influx(points)
+
+            self.log_storage.info("Stored %d samples for %s in InfluxDB", len(points), machine_id)
+        except Exception as e:
+            self.log_error.error("Error storing in InfluxDB: %s", e)
+
+    def _store_summary_in_influxdb(self, machine_id, received_at, sensor_data, comm_data, config):
+        """Store an edge window summary (min/max/mean/last per sensor) as one Point"""
+        try:
+            summary = sensor_data["summary"]
+            point = Point("machine_summary") \
+                .tag("machine_id", machine_id) \
+                .tag("group_id", self.group_id) \
+                .tag("machine_type", sensor_data["machine_type"]) \
+                .field("count", int(summary["count"])) \
+                .field("window_ms", int(summary["window_ms"])) \
+                .field("rssi", float(comm_data["rssi"])) \
+                .field("snr", float(comm_data["snr"])) \
+                .field("config_version", config.version) \
+                .time(received_at)
+
+            # Every statistic is converted to standard units like a raw reading
+            for stat in ("min", "max", "mean", "last"):
+                values = {field: stats[stat] for field, stats in summary.items() if isinstance(stats, dict)}
+                values["machine_type"] = sensor_data["machine_type"]
+                standardized = self._standardize_units(machine_id, values, config)
+                for field in ("rpm", "coolant_temp", "oil_pressure", "battery_potential", "consumption"):
+                    point.field(f"{field}_{stat}", float(standardized[field]))
+
+            self._write_influx([point])
+
+            self.log_storage.info("Stored summary of %s readings for %s in InfluxDB", summary["count"], machine_id)
+        except Exception as e:
+            self.log_error.error("Error storing in InfluxDB: %s", e)
+
+    def _forward_to_data_manager(self, machine_id, sensor_data, trace=None, config=None):
         """Send standardized data to Machine Data Manager"""
         payload = {
             "machine_id": machine_id,
             "timestamp": datetime.now().isoformat(),
-            "sensor_data": sensor_data
+            "sensor_data": sensor_data,
+            "config_version": (config or self.configs.current).version
         }
+        if trace:
+            self.tracer.hop(trace, "agent_forward")
+            payload["trace"] = trace
+            self.tracer.maybe_report()
         
-        self.mqtt_client.publish(self.internal_topic, json.dumps(payload))
-        print(f"Forwarded data for {machine_id} to Machine Data Manager")
+        topic = self.internal_topic
+        if self.partitions:
+            topic = self.forward_topics.get(machine_id)
+            if topic is None:
+                topic = self.forward_topics[machine_id] = \
+                    f"{self.internal_topic}/{partitioning.partition_of(machine_id, self.partitions)}"
+        self._publish_internal(topic, payload)
+        self.m_forwarded.inc()
+        self.log_message.info("Forwarded data for %s to Machine Data Manager", machine_id)
+
+    def _publish_internal(self, topic, payload):
+        """Internal message to the other components (replaced in fused mode)"""
+        self.mqtt_client.publish(topic, json.dumps(payload))
 
     def _handle_udp_alerts(self):
         """Listen for UDP alerts with socket timeout"""
         self.udp_socket.settimeout(1.0)  # Prevents complete lock
         self.udp_socket.bind((UDP_IP, UDP_PORT))
-        print(F"UDP listener started on port {UDP_PORT}")
+        self.log.info("UDP listener started on port %s", UDP_PORT)
         
         while True:
             try:
                 data, addr = self.udp_socket.recvfrom(1024)
+                self.m_messages.labels("udp_alert").inc()
                 try:
                     alert = json.loads(data.decode())
-                    print(f"Alert UDP message: {alert}")
+                    self.log_payload.debug("Alert UDP message: %s", alert)
+                    if not self.influx_ready.is_set() and self._hold("udp_alert", alert):
+                        continue
                     self._process_alert(alert)
                 except Exception as e:
-                    print(f"Error processing UDP alert: {e}")
+                    self.m_errors.labels("udp_alert").inc()
+                    self.log_error.error("Error processing UDP alert: %s", e)
             except socket.timeout:
                 continue  # Normal timeout occurrence
 
@@ -262,25 +615,26 @@ class DataManagerAgent:
         #        "level": "CRITICAL",
         #        }
 
+        config = self.configs.current
         machine_id = alert["machine_id"]
         reason = alert["reason"]
+        self.health.observe_alarm(machine_id)
         
         # Store raw alert message
         try:
             point = Point("machine_alerts") \
                 .tag("machine_id", machine_id) \
+                .tag("group_id", self.group_id) \
                 .field("reason", reason) \
+                .field("config_version", config.version) \
                 .time(datetime.now().isoformat())
-            self.influx_client.write([point])
-            print(f"Stored alert message for {machine_id} in InfluxDB")
+            self._write_influx([point])
+            self.log_storage.info("Stored alert message for %s in InfluxDB", machine_id)
         except Exception as e:
-            print(f"Failed to write to InfluxDB: {str(e)}")
+            self.log_error.error("Failed to write to InfluxDB: %s", e)
         
-        # Forward encoded command
-
-        reason_enc = REASON_MAP[reason]
-
-        command = f"0x02 0x01 {reason_enc}"
+        # Forward encoded command (precompiled from REASON_MAP)
+        command = config.reason_codes[reason]
 
         # send to TTN Server
         downlink = {
@@ -292,22 +646,76 @@ class DataManagerAgent:
         }
         topic = f"v3/{self.group_id}@ttn/devices/{machine_id}/down/push_alert"
         self.mqtt_client.publish(topic, json.dumps(downlink))
+        self.m_downlinks.labels("alert").inc()
+
+    def _query_worst(self, query):
+        """/worst?k=10[&type=C89Z] on the state API"""
+        return self.health.worst(int(query.get("k", 10)), query.get("type"))
+
+    def _query_gateways(self, query):
+        """/gateways?machine=M1-0 on the state API: every gateway that heard its latest uplink"""
+        if "machine" not in query:
+            raise ValueError("machine is required")
+        return self.dedup.gateways(query["machine"])
+
+    def state_routes(self):
+        """Extra routes of the state API"""
+        routes = {
+            "worst": self._query_worst,
+            "quarantine": lambda query: self.quarantine.snapshot(int(query.get("limit", 50)))
+        }
+        if self.dedup:
+            routes["gateways"] = self._query_gateways
+        return routes
+
+    def _warm_state(self):
+        """Fill the local history from the traffic log if configured, else from InfluxDB"""
+        try:
+            if STATE_WARM_LOG:
+                reader = TrafficLogReader(STATE_WARM_LOG)
+                count = state_store.warm_from_traffic_log(
+                    self.state, reader, STATE_WARM_SECONDS, self._standardize_units, self.group_id)
+            else:
+                self.influx_ready.wait()
+                count = state_store.warm_from_influx(self.state, self.influx_client, STATE_WARM_SECONDS,
+                                                     self.group_id)
+            self.log.info("Machine state warmed with %d readings", count)
+        except Exception as e:
+            self.log_error.error("Could not warm the machine state: %s", e)
 
     def run(self):
-        """Start the agent"""
-        # Connect to MQTT broker
+        """Start the agent: subscribed first, the InfluxDB client follows from a thread"""
+        if METRICS_PORT:
+            metrics.start_http_server(self.metrics, METRICS_PORT)
+        if STATE_PORT:
+            state_store.start_http_server(self.state, STATE_PORT, routes=self.state_routes())
+        self.configs.start()
+        if STATE_WARM_SECONDS:
+            # Live readings win over warmed ones, so warming can overlap with normal work
+            threading.Thread(target=self._warm_state, daemon=True).start()
+
+        # Profiling on demand: kill -USR1 (stage timers) / -USR2 (cProfile), or the UDP channel
+        self.profiler.install_signal_handlers(PROFILE_DURATION)
+        if PROFILE_CONTROL_PORT:
+            self.profiler.serve_control(PROFILE_CONTROL_PORT)
+        startup.mark("servers")
+
+        # Connect to MQTT broker (the subscriptions and start_influx follow in _on_mqtt_connect)
         self.mqtt_client.connect(MQTT_BROKER_IP, MQTT_PORT)
+        startup.mark("mqtt_connect")
         
-        # Start UDP listener in a separate thread
-        udp_thread = threading.Thread(target=self._handle_udp_alerts)
-        udp_thread.daemon = True
-        udp_thread.start()
+        # Start UDP listener in a separate thread (fused mode hands alerts over in memory)
+        if self.standalone:
+            udp_thread = threading.Thread(target=self._handle_udp_alerts)
+            udp_thread.daemon = True
+            udp_thread.start()
         
         # Start MQTT loop
         self.mqtt_client.loop_forever()
 
 
 if __name__ == "__main__":
+    startup.begin()
 
     # ===== MACHINE CONFIGURATION =====
     machines_path = "config/all_machines.json"
@@ -319,6 +727,15 @@ if __name__ == "__main__":
             print("File not found/invalid")
             MACHINE_SPECS = {}
 
+    intervals_path = "config/intervals.json"
+
+    try:
+        with open(intervals_path, "r", encoding="utf-8") as f:
+            INTERVALS =  json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+            print("File not found/invalid")
+            INTERVALS = {}
+
     PARAM_MAP = {
         "rpm": ["0x01"],
         "consumption": ["0x02", "consumption_unit"],
@@ -340,11 +757,68 @@ if __name__ == "__main__":
     UDP_PORT = 5005
     UDP_IP = "localhost"
 
+    # ===== METRICS CONFIG =====
+    METRICS_PORT = 9101     # local /metrics endpoint (None = off)
+
+    # ===== TRACING CONFIG =====
+    TRACE_REPORT_EVERY = 60     # seconds between p50/p99 reports of traced hops
+
+    # ===== MACHINE STATE CONFIG =====
+    STATE_CAPACITY = 720        # readings kept per machine (1 h at a 5 s period, 36 bytes each)
+    STATE_PORT = 9301           # local HTTP/JSON query API (None = off)
+    STATE_WARM_SECONDS = 3600   # history loaded at startup (0 = start empty)
+    STATE_WARM_LOG = None       # traffic_log.py recording to warm from instead of InfluxDB
+    QUANTILE_SKETCHES = True    # rolling p50/p95/p99 per machine, type and fleet on /quantiles
+
+    # ===== HEALTH RANKING CONFIG =====
+    # Score = sum of weight * term, see health.py (served on STATE_PORT as /worst)
+    HEALTH_WEIGHTS = {"deviation": 1.0, "commands": 0.2, "alarms": 2.0, "link": 0.5}
+    HEALTH_LINK_LEVELS = {"rssi": {"good": -90, "bad": -120}, "snr": {"good": -5, "bad": -20}}
+
+    # ===== DEDUPLICATION CONFIG =====
+    DEDUP_TTL = 60              # seconds an uplink is remembered (None = no deduplication)
+    DEDUP_MAX_ENTRIES = 100000  # uplinks remembered at most, oldest evicted first
+
+    # ===== VALIDATION CONFIG =====
+    QUARANTINE_SIZE = 1000          # rejected uplinks kept for /quarantine on STATE_PORT
+    QUARANTINE_FLOOD_REJECTS = 50   # rejects from one device within the window that block it
+    QUARANTINE_FLOOD_WINDOW = 10    # seconds
+    QUARANTINE_BLOCK_SECONDS = 60   # how long a flooding device is refused
+
+    # ===== CONFIG RELOAD =====
+    CONFIG_RELOAD_SECONDS = 2   # how often the config files are checked for changes (None = never)
+
+    # ===== PARTITIONING CONFIG =====
+    MANAGER_PARTITIONS = 0      # same as PARTITIONS in machine_data_manager.py (0 = one unpartitioned topic)
+
+    # ===== STARTUP CONFIG =====
+    STARTUP_BUFFER = 10000      # messages held while the InfluxDB client starts, newer ones dropped
+
+    # ===== PROFILING CONFIG =====
+    PROFILE_DURATION = 30           # seconds per capture started by signal
+    PROFILE_CONTROL_PORT = 9201     # local UDP control channel (None = off)
+
+    # ===== LOGGING CONFIG =====
+    logger.setup(
+        "agent",
+        level="INFO",
+        json_output=False,
+        levels={"payload": "WARNING"},                  # "DEBUG" prints every payload
+        sample_rates={"message": 0.01},                 # 1% of per-message lines
+        rate_limits={"message": 20, "storage": 20, "error": 10}   # lines per second
+    )
+
     # ===== INFLUXDB CONFIG =====
     URL="https://eu-central-1-1.aws.cloud2.influxdata.com/"
     TOKEN="############"
     ORG="Coimbra lecd test"
     BUCKET="Project part2"
 
-    agent = DataManagerAgent(GROUP_ID)
+    # Specs and intervals are reloaded when their files change (config_store.py)
+    configs = config_store.ConfigStore(MACHINE_SPECS, INTERVALS, PARAM_MAP, REASON_MAP,
+                                       machines_path, intervals_path, CONFIG_RELOAD_SECONDS)
+    startup.mark("config")
+
+    agent = DataManagerAgent(GROUP_ID, configs)
+    startup.mark("init")
     agent.run()
\ No newline at end of file
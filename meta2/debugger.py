@@ -1,28 +1,66 @@
+import sys
+import threading
+import time
 import paho.mqtt.client as mqtt
-from datetime import datetime
-from pprint import pprint
+import metrics
+import logger
+import traffic_stats
 
 class MQTTDebugger:
-    def __init__(self, group_id):
+    def __init__(self, group_id, top=False):
         self.group_id = group_id
+        # "top" mode replaces the message log with a live view of the bus statistics
+        self.stats = traffic_stats.TrafficStats(SILENCE_FACTOR, MIN_SILENCE) if top else None
         self.client = mqtt.Client()
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
 
+        # Logging categories (see logger.setup in __main__)
+        self.log = logger.get("debugger", "main")
+        self.log_traffic = logger.get("debugger", "traffic")
+
+        # Metrics (served on /metrics when METRICS_PORT is set)
+        self.metrics = metrics.Registry("debugger_")
+        self.m_messages = self.metrics.counter("messages", "Messages seen on the bus", ["kind"])
+        self.m_bytes = self.metrics.histogram("payload_bytes", "Payload size",
+                                              (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+
     def _on_connect(self, client, userdata, flags, rc):
-        pprint(f"Debugger connected to broker (rc={rc})")
+        self.log.info("Debugger connected to broker (rc=%s)", rc)
         # Subscribe to all relevant topics
         client.subscribe(f"v3/{self.group_id}@ttn/devices/+/up")
         client.subscribe(f"v3/{self.group_id}@ttn/devices/+/down/+")
         client.subscribe(f"{self.group_id}/internal/#")
-        pprint("Subscribed to all monitoring topics")
+        self.log.info("Subscribed to all monitoring topics")
 
     def _on_message(self, client, userdata, msg):
-        """print all messages with timestamp"""
-        pprint(f"[{datetime.now().isoformat()}] {msg.topic}: {msg.payload.decode()}")
-        print()
+        """Log all messages with timestamp"""
+        # up, push_actuator, push_alert, machine_data, control_commands, ...
+        kind = msg.topic.rsplit("/", 1)[-1]
+        self.m_messages.labels(kind).inc()
+        self.m_bytes.observe(len(msg.payload))
+        if self.stats:
+            self.stats.record(msg.topic, len(msg.payload))
+            return
+        # Decoding is deferred to the writer thread as well (bytes are immutable)
+        self.log_traffic.info("%s: %s", msg.topic, logger.Decoded(msg.payload))
+
+    def _render_loop(self):
+        """Redraw the top view, rendering is the only place stats are aggregated"""
+        while True:
+            time.sleep(REFRESH_INTERVAL)
+            # A failed redraw is logged, the next one still happens
+            try:
+                sys.stdout.write("\x1b[H\x1b[2J" + self.stats.render(TOP_ROWS) + "\n")
+                sys.stdout.flush()
+            except Exception as e:
+                self.log.error("Top view render failed: %s", e)
 
     def run(self):
+        if METRICS_PORT:
+            metrics.start_http_server(self.metrics, METRICS_PORT)
+        if self.stats:
+            threading.Thread(target=self._render_loop, daemon=True).start()
         self.client.connect(MQTT_BROKER_IP, MQTT_PORT)
         self.client.loop_forever()
 
@@ -31,7 +69,30 @@ if __name__ == "__main__":
     MQTT_BROKER_IP = "10.6.1.9"
     MQTT_PORT = 1883
     GROUP_ID = "19"
-    
-    debugger = MQTTDebugger(GROUP_ID)
-    pprint("MQTT Debugger started. Monitoring all messages...")
+
+    # ===== METRICS CONFIG =====
+    METRICS_PORT = 9104     # local /metrics endpoint (None = off)
+
+    # ===== TOP MODE CONFIG =====
+    REFRESH_INTERVAL = 0.5  # seconds between redraws
+    TOP_ROWS = 15           # rows per table
+    SILENCE_FACTOR = 3      # a machine is silent after this many of its usual gaps...
+    MIN_SILENCE = 10        # ...and at least this many seconds without an uplink
+
+    # ===== LOGGING CONFIG =====
+    logger.setup(
+        "debugger",
+        level="INFO",
+        json_output=False,
+        rate_limits={"traffic": 200}    # messages printed per second, the rest are counted
+    )
+
+    # Usage: python3 debugger.py [top]
+    top = len(sys.argv) > 1 and sys.argv[1] == "top"
+    if top:
+        # Keep connection messages from scrolling the live view
+        logger.get("debugger", "main").setLevel("WARNING")
+
+    debugger = MQTTDebugger(GROUP_ID, top)
+    debugger.log.info("MQTT Debugger started. Monitoring all messages...")
     debugger.run()
\ No newline at end of file
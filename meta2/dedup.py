@@ -0,0 +1,117 @@
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Drops repeated deliveries of the same uplink: TTN forwards an uplink once per
+# gateway that heard it, and the broker redelivers under QoS 1. The first delivery is
+# processed, later ones only add their gateways to the cached record; the merged
+# gateways of a machine's latest uplink are served by gateways() (state API /gateways).
+#
+# An uplink is identified by (machine_id, f_cnt) once the device's frame counter is
+# seen to move. Until then (our simulators send a constant f_cnt) the key is
+# (machine_id, f_cnt, digest of received_at and decoded_payload), so two different
+# readings with the same counter are not mistaken for duplicates. This fallback only
+# catches byte-identical redeliveries, which is all the simulators produce.
+#
+# Entries live for ttl seconds and at most max_entries are kept; both bounds evict
+# from the oldest end of an insertion-ordered dict, so every check is O(1).
+
+class UplinkRecord:
+    __slots__ = ("first_seen", "deliveries", "gateways", "size")
+
+    def __init__(self, key, first_seen, gateways):
+        self.first_seen = first_seen
+        self.deliveries = 1
+        self.gateways = gateways    # merged rx_metadata, one entry per gateway
+        self.size = sys.getsizeof(key) + sys.getsizeof(self) + sys.getsizeof(gateways) + \
+            sum(sys.getsizeof(gateway) for gateway in gateways)
+
+    def merge(self, gateways):
+        """Add the gateways not heard yet, returns the bytes added"""
+        before = sys.getsizeof(self.gateways)
+        added = 0
+        known = {gateway.get("gateway_id") for gateway in self.gateways}
+        for gateway in gateways:
+            if gateway.get("gateway_id") not in known:
+                self.gateways.append(gateway)
+                added += sys.getsizeof(gateway)
+        added += sys.getsizeof(self.gateways) - before
+        self.size += added
+        return added
+
+class UplinkDeduplicator:
+    def __init__(self, ttl=60, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()    # key -> UplinkRecord, oldest first
+        self.last_f_cnt = {}            # machine_id -> last f_cnt, until the counter moves
+        self.latest = {}                # machine_id -> key of its latest uplink
+        self.counting = set()           # machines whose f_cnt is known to advance
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.entry_bytes = 0
+        self.lock = threading.Lock()
+
+    def _key(self, machine_id, payload):
+        uplink = payload["uplink_message"]
+        f_cnt = uplink.get("f_cnt")
+        if machine_id not in self.counting:
+            last = self.last_f_cnt.get(machine_id)
+            if last is not None and f_cnt != last:
+                self.counting.add(machine_id)
+                del self.last_f_cnt[machine_id]
+            else:
+                self.last_f_cnt[machine_id] = f_cnt
+                content = json.dumps(uplink["decoded_payload"], sort_keys=True)
+                return (machine_id, f_cnt, hash((payload.get("received_at"), content)))
+        return (machine_id, f_cnt)
+
+    def _expire(self, now):
+        entries = self.entries
+        while entries:
+            record = next(iter(entries.values()))
+            if now - record.first_seen < self.ttl and len(entries) < self.max_entries:
+                break
+            entries.popitem(last=False)
+            self.entry_bytes -= record.size
+            self.evicted += 1
+
+    def check(self, machine_id, payload, now=None):
+        """rx_metadata of an uplink payload on its first delivery, None for a duplicate"""
+        now = time.monotonic() if now is None else now
+        uplink = payload["uplink_message"]
+        with self.lock:
+            self._expire(now)
+            key = self._key(machine_id, payload)
+            record = self.entries.get(key)
+            if record is None:
+                record = self.entries[key] = UplinkRecord(key, now, list(uplink["rx_metadata"]))
+                self.entry_bytes += record.size
+                self.latest[machine_id] = key
+                self.misses += 1
+                return record.gateways
+
+            self.hits += 1
+            record.deliveries += 1
+            self.entry_bytes += record.merge(uplink["rx_metadata"])
+            return None
+
+    def gateways(self, machine_id):
+        """Deliveries and merged gateways of the machine's latest uplink still cached, or None"""
+        with self.lock:
+            record = self.entries.get(self.latest.get(machine_id))
+            if record is None:
+                return None
+            return {"deliveries": record.deliveries, "gateways": list(record.gateways)}
+
+    def hit_rate(self):
+        checks = self.hits + self.misses
+        return self.hits / checks if checks else 0.0
+
+    def memory_bytes(self):
+        """Approximate bytes held by the dicts, keys, records and gateway dicts (shallow)"""
+        return sys.getsizeof(self.entries) + self.entry_bytes + sys.getsizeof(self.last_f_cnt) + \
+            sys.getsizeof(self.latest)
@@ -0,0 +1,179 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+# Fault injection for the simulators (machine.py and fleet.py).
+#
+# A scenario is a list of faults, each selecting its machines either by id
+# ("machines": ["M1-3", ...]) or as a share of the fleet ("fraction": 0.1), and active
+# from "start" for "duration" seconds (forever when omitted). Time is simulated time:
+# the simulator calls advance(update_time) once per tick, so a run is reproducible for
+# a given seed regardless of how fast the host is.
+#
+# Sensor faults distort what a machine *reports*, the simulated process underneath
+# keeps running (and keeps reacting to the control loop):
+#   stuck      the reading freezes at its value when the fault starts
+#   step       constant offset "delta" (native units of the machine)
+#   drift      offset growing by "rate" units per second
+#   noise      gaussian noise of "sigma" units on every reading
+# Transport faults act on the uplinks:
+#   loss       uplink dropped with "probability"
+#   duplicate  uplink sent twice with "probability"
+#   reorder    uplink held back with "probability" and sent after the next one
+#   clock_skew device clock off by "offset" seconds plus "drift_ppm" of the elapsed time
+#
+# Sensor fields use the uplink names: rpm, coolant_temperature, oil_pressure,
+# battery_potential, consumption.
+
+class Fault:
+    sensor = False
+
+    def __init__(self, spec, index, seed):
+        self.spec = spec
+        self.index = index
+        self.seed = seed
+        self.start = spec.get("start", 0)
+        self.end = self.start + spec["duration"] if "duration" in spec else float("inf")
+        self.machines = set(spec.get("machines", ()))
+        self.fraction = spec.get("fraction", 0 if self.machines else 1.0)
+        self.rngs = {}
+
+    def selects(self, machine_id):
+        """Same answer for the same seed and machine, in any process"""
+        if machine_id in self.machines:
+            return True
+        return random.Random(f"{self.seed}:{self.index}:{machine_id}").random() < self.fraction
+
+    def active(self, now):
+        return self.start <= now < self.end
+
+    def rng(self, machine_id):
+        rng = self.rngs.get(machine_id)
+        if rng is None:
+            rng = self.rngs[machine_id] = random.Random(f"{self.seed}:{self.index}:{machine_id}:draws")
+        return rng
+
+class Stuck(Fault):
+    sensor = True
+
+    def __init__(self, spec, index, seed):
+        super().__init__(spec, index, seed)
+        self.held = {}
+
+    def distort(self, machine_id, value, now):
+        return self.held.setdefault(machine_id, value)
+
+class Step(Fault):
+    sensor = True
+
+    def distort(self, machine_id, value, now):
+        return value + self.spec["delta"]
+
+class Drift(Fault):
+    sensor = True
+
+    def distort(self, machine_id, value, now):
+        return value + self.spec["rate"] * (now - self.start)
+
+class Noise(Fault):
+    sensor = True
+
+    def distort(self, machine_id, value, now):
+        return value + self.rng(machine_id).gauss(0, self.spec["sigma"])
+
+class Loss(Fault):
+    def transmit(self, machine_id, items):
+        return [] if self.rng(machine_id).random() < self.spec["probability"] else items
+
+class Duplicate(Fault):
+    def transmit(self, machine_id, items):
+        return items + items[-1:] if items and self.rng(machine_id).random() < self.spec["probability"] else items
+
+class Reorder(Fault):
+    def __init__(self, spec, index, seed):
+        super().__init__(spec, index, seed)
+        self.held = {}
+
+    def transmit(self, machine_id, items):
+        held = self.held.pop(machine_id, None)
+        if held is not None:
+            return items + [held]
+        if items and self.rng(machine_id).random() < self.spec["probability"]:
+            self.held[machine_id] = items[-1]
+            return items[:-1]
+        return items
+
+class ClockSkew(Fault):
+    def offset(self, now):
+        return self.spec.get("offset", 0) + self.spec.get("drift_ppm", 0) * 1e-6 * (now - self.start)
+
+FAULT_TYPES = {
+    "stuck": Stuck,
+    "step": Step,
+    "drift": Drift,
+    "noise": Noise,
+    "loss": Loss,
+    "duplicate": Duplicate,
+    "reorder": Reorder,
+    "clock_skew": ClockSkew
+}
+
+class FaultInjector:
+    """Applies a scenario to the readings and uplinks of any number of machines"""
+
+    def __init__(self, faults, seed=0):
+        self.faults = [FAULT_TYPES[spec["type"]](spec, i, seed) for i, spec in enumerate(faults)]
+        self.now = 0.0
+        self.by_machine = {}    # machine_id -> faults that selected it, most machines have none
+
+    @classmethod
+    def from_file(cls, name, seed=0, path="config/fault_scenarios.json"):
+        with open(path, "r", encoding="utf-8") as f:
+            scenarios = json.load(f)
+        if name not in scenarios:
+            raise ValueError(f"Unknown fault scenario {name!r}, choose from: {list(scenarios)}")
+        return cls(scenarios[name], seed)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def _faults(self, machine_id):
+        faults = self.by_machine.get(machine_id)
+        if faults is None:
+            faults = self.by_machine[machine_id] = [f for f in self.faults if f.selects(machine_id)]
+        return faults
+
+    def distort(self, machine_id, values):
+        """Apply the active sensor faults to a reading dict in place"""
+        for fault in self._faults(machine_id):
+            field = fault.spec.get("field")
+            if fault.sensor and field in values and fault.active(self.now):
+                values[field] = round(fault.distort(machine_id, values[field], self.now), 2)
+        return values
+
+    def transmit(self, machine_id, item):
+        """Uplinks (payloads, readings...) to send now in place of item, in order"""
+        items = [item]
+        for fault in self._faults(machine_id):
+            if hasattr(fault, "transmit") and fault.active(self.now):
+                items = fault.transmit(machine_id, items)
+        return items
+
+    def clock_offset(self, machine_id):
+        """Seconds the machine's clock is ahead (negative: behind)"""
+        return sum(f.offset(self.now) for f in self._faults(machine_id)
+                   if isinstance(f, ClockSkew) and f.active(self.now))
+
+    def process_payload(self, machine_id, payload):
+        """Fleet path: distort, skew and transmit one TTN payload dict"""
+        faults = self._faults(machine_id)
+        if not faults:
+            return [payload]
+        uplink = payload["uplink_message"]
+        self.distort(machine_id, uplink["decoded_payload"])
+        offset = self.clock_offset(machine_id)
+        if offset:
+            received_at = datetime.fromisoformat(payload["received_at"]) + timedelta(seconds=offset)
+            payload["received_at"] = received_at.isoformat()
+            uplink["settings"]["timestamp"] = int(received_at.timestamp())
+        return self.transmit(machine_id, payload)
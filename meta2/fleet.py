@@ -0,0 +1,397 @@
+import paho.mqtt.client as mqtt
+import numpy as np
+import json
+import time
+import sys
+import threading
+from datetime import datetime
+from faults import FaultInjector
+from machine import FixedRateScheduler, WALK_PERIOD
+
+# Per-unit simulation model: initial value, random step range (per WALK_PERIOD, scaled to
+# the update time as in Machine._step) and clamp bounds.
+# Mirrors the constants hardcoded in Machine.update_sensors / _restart_machine.
+SENSOR_MODELS = {
+    "rpm": {
+        None: {"initial": 1100, "step": (-50, 200), "bounds": (800, 3000)}
+    },
+    "coolant_temp": {
+        "°C": {"initial": 90.0, "step": (-0.3, 1.0), "bounds": (70.0, 130.0)},
+        "°F": {"initial": 194.0, "step": (-0.54, 1.8), "bounds": (158.0, 266.0)}
+    },
+    "oil_pressure": {
+        "bar": {"initial": 3.0, "step": (-0.1, 0.5), "bounds": (1.5, 8.0)},
+        "psi": {"initial": 43.5, "step": (-1.45, 7.25), "bounds": (21.75, 116.0)}
+    },
+    "battery_potential": {
+        "V": {"initial": 13.0, "step": (-0.1, 0.2), "bounds": (10.0, 14.0)},
+        "mV": {"initial": 13000.0, "step": (-100, 200), "bounds": (10000.0, 14000.0)}
+    },
+    "consumption": {
+        "l/h": {"initial": 25.0, "step": (-1, 1), "bounds": (1.0, 50.0)},
+        "gal/h": {"initial": 6.6, "step": (-0.26, 0.26), "bounds": (0.26, 13.21)}
+    },
+    "rssi": {
+        None: {"initial": -85, "step": (-3, 3), "bounds": (-120, -50)}
+    },
+    "snr": {
+        None: {"initial": -15.0, "step": (-0.5, 0.5), "bounds": (-20, 10)}
+    },
+    "rssi_channel": {
+        None: {"initial": -85, "step": (-3, 3), "bounds": (-120, -50)}
+    }
+}
+
+# Which spec key selects the unit of each sensor (None = unitless)
+UNIT_KEYS = {
+    "rpm": None,
+    "coolant_temp": "temp_unit",
+    "oil_pressure": "oil_unit",
+    "battery_potential": "batt_unit",
+    "consumption": "consumption_unit",
+    "rssi": None,
+    "snr": None,
+    "rssi_channel": None
+}
+
+# Downlink parameter byte -> sensor array
+PARAM_FIELDS = {
+    "0x01": "rpm",
+    "0x02": "consumption",
+    "0x03": "coolant_temp",
+    "0x04": "oil_pressure",
+    "0x05": "battery_potential"
+}
+
+class Fleet:
+
+    def __init__(self, machine_codes, specs, update_time, seed=None):
+        self.machine_codes = list(machine_codes)
+        self.specs = specs
+        self.update_time = update_time
+        self.walk_drift = update_time / WALK_PERIOD
+        self.walk_noise = np.sqrt(self.walk_drift)
+        self.size = len(self.machine_codes)
+        self.rng = np.random.default_rng(seed)
+
+        # Every simulated device needs its own id, the spec id is only the model's
+        self.machine_ids = [
+            f"{specs[code]['machine_id']}-{i}" for i, code in enumerate(self.machine_codes)
+        ]
+        self.index = {machine_id: i for i, machine_id in enumerate(self.machine_ids)}
+
+        # Per-machine model parameters (unit-aware), one column per machine
+        self.initial = {}
+        self.step_low = {}
+        self.step_high = {}
+        self.low = {}
+        self.high = {}
+        for field, models in SENSOR_MODELS.items():
+            rows = [models[self._unit(code, field)] for code in self.machine_codes]
+            self.initial[field] = np.array([r["initial"] for r in rows], dtype=np.float64)
+            self.step_low[field] = np.array([r["step"][0] for r in rows], dtype=np.float64)
+            self.step_high[field] = np.array([r["step"][1] for r in rows], dtype=np.float64)
+            self.low[field] = np.array([r["bounds"][0] for r in rows], dtype=np.float64)
+            self.high[field] = np.array([r["bounds"][1] for r in rows], dtype=np.float64)
+
+        # Shutdown sequence constants
+        self.oil_drop = np.array(
+            [2.0 if specs[c]["oil_unit"] == "bar" else 29.0 for c in self.machine_codes])
+        self.restart_temp = np.array(
+            [20.0 if specs[c]["temp_unit"] == "°C" else 68.0 for c in self.machine_codes])
+
+        # Sensor state
+        self.state = {field: self.initial[field].copy() for field in SENSOR_MODELS}
+
+        self.is_operational = np.ones(self.size, dtype=bool)
+        self.is_shutting_down = np.zeros(self.size, dtype=bool)
+        self.waiting_for_adjustment = np.zeros(self.size, dtype=bool)
+
+        # Per-machine reporting period (set by downlink), the fleet ticks at update_time
+        self.report_period = np.full(self.size, float(update_time))
+        self.next_report = np.zeros(self.size)
+
+    def _unit(self, machine_code, field):
+        unit_key = UNIT_KEYS[field]
+        return self.specs[machine_code][unit_key] if unit_key else None
+
+    def update_sensors(self):
+        """Step every machine of the fleet in one vectorized call"""
+        running = ~self.is_shutting_down
+
+        for field in SENSOR_MODELS:
+            mean = (self.step_low[field] + self.step_high[field]) / 2
+            noise = self.rng.uniform(self.step_low[field], self.step_high[field]) - mean
+            step = mean * self.walk_drift + noise * self.walk_noise
+            stepped = np.clip(self.state[field] + step, self.low[field], self.high[field])
+            self.state[field] = np.where(running, stepped, self.state[field])
+
+        if self.is_shutting_down.any():
+            self._shutdown_step(self.is_shutting_down)
+
+    def _shutdown_step(self, mask):
+        """Gradually reduce values to 0 and restart machines that cooled down"""
+        s = self.state
+        s["rpm"][mask] = 0
+        s["coolant_temp"][mask] = np.maximum(0.0, s["coolant_temp"][mask] * 0.4)
+        s["oil_pressure"][mask] = np.maximum(0.0, s["oil_pressure"][mask] - self.oil_drop[mask])
+        s["consumption"][mask] = 0
+        s["battery_potential"][mask] = 0
+
+        restart = mask & (s["oil_pressure"] == 0) & (s["coolant_temp"] < self.restart_temp)
+        if restart.any():
+            self._restart_machines(restart)
+
+    def _restart_machines(self, mask):
+        """Reset the selected machines to normal operation"""
+        for field in SENSOR_MODELS:
+            self.state[field][mask] = self.initial[field][mask]
+
+        self.is_operational[mask] = True
+        self.is_shutting_down[mask] = False
+        self.waiting_for_adjustment[mask] = False
+        for i in np.flatnonzero(mask):
+            print(f"[{datetime.now()}] Machine {self.machine_codes[i]} ({self.machine_ids[i]}) restarted")
+
+    def process_control_command(self, i, command):
+        """Apply a push_actuator downlink to machine i"""
+        parts = command.split()
+
+        if len(parts) != 4:
+            print("[ERROR] process_control_command: !=4 ")
+            return
+
+        msg_type, msg_mod, param = parts[0], parts[1], parts[2]
+
+        adjustment = int(parts[3], 16)
+        if adjustment > 127:  # Handle negative values
+            adjustment -= 256
+
+        if msg_type != "0x01":
+            print("[ERROR] process_control_command: No 0x01 = Control")
+            return
+
+        if msg_mod == "0x02":
+            # Reporting period in tenths of a second, never faster than the fleet tick
+            period = ((int(parts[2], 16) << 8) | int(parts[3], 16)) / 10
+            self.report_period[i] = max(period, self.update_time)
+            self.next_report[i] = min(self.next_report[i], time.monotonic() + self.report_period[i])
+            return
+
+        if msg_mod == "0x03":
+            # Raw burst request: the fleet always streams raw readings
+            return
+
+        if msg_mod != "0x01":
+            print("[ERROR] process_control_command: No 0x01 = modification")
+            return
+
+        field = PARAM_FIELDS.get(param)
+        if field is None:
+            print(f"[ERROR] bad request adjustment: No such param")
+            return
+
+        self.state[field][i] += adjustment
+
+    def process_alert_command(self, i, command):
+        """Apply a push_alert downlink to machine i"""
+        parts = command.split()
+        if len(parts) != 3:
+            print("[ERROR] process_alert_command ")
+            return
+
+        if parts[0] == "0x02" and parts[1] == "0x01":
+            print(f"[{datetime.now()}] CRITICAL ALERT: Shutting down machine {self.machine_ids[i]}!")
+            self.is_shutting_down[i] = True
+            self.waiting_for_adjustment[i] = True
+
+    def generate_payloads(self):
+        """Generate the TTN-compatible payload of every operational machine due to report"""
+        # Round and convert to Python floats once for the whole fleet
+        values = {field: np.round(self.state[field], 2).tolist() for field in SENSOR_MODELS}
+        received_at = datetime.now().isoformat()
+        timestamp = int(time.time())
+
+        now = time.monotonic()
+        due = self.is_operational & (self.next_report <= now)
+        self.next_report[due] = now + self.report_period[due]
+
+        for i in np.flatnonzero(due):
+            yield i, {
+                "end_device_ids": {
+                    "machine_id": self.machine_ids[i],
+                    "application_id": "SRSA2025:industrial-monitoring",
+                    "dev_eui": f"{i:016X}",
+                    "join_eui": "0000000000000000",
+                    "dev_addr": f"{i:08X}"
+                },
+                "received_at": received_at,
+                "uplink_message": {
+                    "f_port": 1,
+                    "f_cnt": 1234,
+                    "frm_payload": "BASE64_SIMULATED_PAYLOAD",
+                    "decoded_payload": {
+                        "rpm": values["rpm"][i],
+                        "coolant_temperature": values["coolant_temp"][i],
+                        "oil_pressure": values["oil_pressure"][i],
+                        "battery_potential": values["battery_potential"][i],
+                        "consumption": values["consumption"][i],
+                        "machine_type": self.machine_codes[i]
+                    },
+                    "rx_metadata": [{
+                        "gateway_id": "dei-gateway-1",
+                        "rssi": values["rssi"][i],
+                        "snr": values["snr"][i],
+                        "channel_rssi": values["rssi_channel"][i],
+                        "uplink_token": "SIMULATED_TOKEN"
+                    }],
+                    "settings": {
+                        "data_rate": {
+                            "modulation": "LORA",
+                            "bandwidth": 125000,
+                            "spreading_factor": 7
+                        },
+                        "frequency": "868300000",
+                        "timestamp": timestamp
+                    },
+                    "consumed_airtime": "0.060000s"
+                }
+            }
+
+
+class FleetPublisher:
+    """Fans the fleet's uplinks out over a small pool of MQTT connections"""
+
+    def __init__(self, fleet, group_id, connections, faults=None):
+        self.fleet = fleet
+        self.group_id = group_id
+        self.faults = faults
+        self.clients = []
+
+        for n in range(connections):
+            client = mqtt.Client()
+            client.on_connect = self._on_connect
+            client.on_message = self._on_message
+            self.clients.append(client)
+
+        self.up_topics = [f"v3/{group_id}@ttn/devices/{m}/up" for m in fleet.machine_ids]
+
+        # Downlinks are applied on the paho threads while the main loop steps the fleet:
+        # the state arrays are only touched under this lock (see step and publish)
+        self.fleet_lock = threading.Lock()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        print(f"[{datetime.now()}] Connected to MQTT Broker (rc={rc})")
+        # Only the first connection listens for downlinks of the whole fleet
+        if client is self.clients[0]:
+            downlink_topic = f"v3/{self.group_id}@ttn/devices/+/down/+"
+            client.subscribe(downlink_topic)
+            print(f"[{datetime.now()}] Subscribed to: {downlink_topic}")
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            # v3/<group>@ttn/devices/<machine_id>/down/<kind>
+            topic_parts = msg.topic.split("/")
+            i = self.fleet.index.get(topic_parts[3])
+            if i is None:
+                return
+
+            payload = json.loads(msg.payload.decode())
+            if "downlinks" in payload and len(payload["downlinks"]) > 0:
+                command = payload["downlinks"][0]["frm_payload"]
+
+                with self.fleet_lock:
+                    if topic_parts[-1] == "push_alert":
+                        self.fleet.process_alert_command(i, command)
+                    elif topic_parts[-1] == "push_actuator":
+                        self.fleet.process_control_command(i, command)
+        except Exception as e:
+            print(f"[{datetime.now()}] Error processing message: {e}")
+
+    def connect(self, host, port):
+        for client in self.clients:
+            client.connect(host, port, 60)
+            client.loop_start()
+
+    def disconnect(self):
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
+
+    def step(self):
+        """Advance the simulation by one tick"""
+        with self.fleet_lock:
+            self.fleet.update_sensors()
+
+    def publish(self):
+        """Publish one uplink per machine due to report, returns the count"""
+        count = 0
+        pool = len(self.clients)
+        with self.fleet_lock:
+            due = list(self.fleet.generate_payloads())
+        for i, payload in due:
+            if self.faults:
+                for uplink in self.faults.process_payload(self.fleet.machine_ids[i], payload):
+                    self.clients[i % pool].publish(self.up_topics[i], json.dumps(uplink))
+                    count += 1
+                continue
+            self.clients[i % pool].publish(self.up_topics[i], json.dumps(payload))
+            count += 1
+        return count
+
+# ===== MAIN EXECUTION =====
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5):
+        print("Usage: python3 fleet.py <GroupID> <UPDATE_TIME_SECONDS> <MACHINES> [CONNECTIONS]")
+        print("Example: python3 fleet.py 19 5 1000 4")
+        sys.exit(1)
+
+    group_id = sys.argv[1]
+    update_time = float(sys.argv[2])
+    machine_count = int(sys.argv[3])
+    connections = int(sys.argv[4]) if len(sys.argv) == 5 else 1
+
+    # ===== MQTT CONFIG =====
+    MQTT_BROKER_IP = "10.6.1.9"
+    MQTT_PORT = 1883
+
+    # ===== FAULT INJECTION CONFIG =====
+    FAULT_SCENARIO = None   # scenario name in config/fault_scenarios.json (None = off)
+    SEED = None             # fixes the random walk and the fault draws (None = new run every time)
+
+    # ===== MACHINE CONFIGURATION =====
+    machine_path = "config/all_machines.json"
+
+    try:
+        with open(machine_path, "r", encoding="utf-8") as f:
+            MACHINE_SPECS =  json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+            print("File not found/invalid")
+            sys.exit(1)
+
+    # Spread the fleet evenly over the known machine models
+    codes = list(MACHINE_SPECS.keys())
+    machine_codes = [codes[i % len(codes)] for i in range(machine_count)]
+
+    fleet = Fleet(machine_codes, MACHINE_SPECS, update_time, SEED)
+    faults = FaultInjector.from_file(FAULT_SCENARIO, SEED) if FAULT_SCENARIO else None
+    publisher = FleetPublisher(fleet, group_id, connections, faults)
+    scheduler = FixedRateScheduler(update_time)
+
+    try:
+        publisher.connect(MQTT_BROKER_IP, MQTT_PORT)
+
+        print(f"[{datetime.now()}] Started fleet of {machine_count} machines over {connections} connection(s) (Update every {update_time}s)")
+        while True:
+            publisher.step()
+            if faults:
+                faults.advance(update_time)
+            count = publisher.publish()
+            print(f"[{datetime.now()}] Published {count} updates")
+
+            scheduler.wait()
+
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        publisher.disconnect()
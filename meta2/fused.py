@@ -0,0 +1,221 @@
+import startup
+import json
+import queue
+import sys
+import threading
+
+import alert_manager
+import config_store
+import data_manager_agent
+import logger
+import machine_data_manager
+import metrics
+
+# Fused mode: DataManagerAgent, MachineDataManager and AlertManager in one process.
+#
+# Only the TTN traffic (uplinks in, downlinks out) goes through the broker. The internal
+# hops, agent -> manager (readings), manager -> agent and alert manager (commands) and
+# alert manager -> agent (alerts, UDP otherwise), become in-memory queues carrying the
+# message dicts as they are, without JSON or sockets. Each component keeps its own
+# thread, as it would as a process: the agent's MQTT loop stores and forwards uplinks,
+# one worker per queue runs the manager, the alert manager and the agent's handling of
+# commands and alerts.
+#
+# With MIRROR_INTERNAL the internal messages are also published on their usual topics
+# (as JSON) for observers such as debugger.py; nothing in this process consumes them.
+
+class FusedPipeline:
+    def __init__(self, agent, manager, alerts, mirror=False):
+        self.agent = agent
+        self.manager = manager
+        self.alerts = alerts
+        self.mirror = mirror
+        self.log_error = logger.get("fused", "error")
+
+        self.manager_inbox = queue.SimpleQueue()    # readings
+        self.alerts_inbox = queue.SimpleQueue()     # control commands
+        self.agent_inbox = queue.SimpleQueue()      # (handler, kind, command or alert)
+        self.threads = []
+
+        self.metrics = metrics.Registry("fused_")
+        self.m_handoffs = self.metrics.counter("handoffs", "Internal messages handed over in memory", ["route"])
+        self.m_errors = self.metrics.counter("handoff_errors", "Internal messages that failed processing", ["route"])
+        queued = self.metrics.gauge("queued", "Internal messages waiting", ["consumer"])
+        for name, inbox in (("manager", self.manager_inbox), ("alert_manager", self.alerts_inbox),
+                            ("agent", self.agent_inbox)):
+            queued.labels(name).set_function(inbox.qsize)
+
+        # Internal messages are handed over here instead of going out on MQTT/UDP
+        agent.standalone = False
+        agent._publish_internal = self._from_agent
+        manager._publish_internal = self._from_manager
+        alerts._deliver_alert = self._from_alerts
+
+    # ===== ROUTING =====
+
+    def _from_agent(self, topic, payload):
+        self.manager_inbox.put(payload)
+        self.m_handoffs.labels("machine_data").inc()
+        if self.mirror:
+            self.agent.mqtt_client.publish(topic, json.dumps(payload))
+
+    def _from_manager(self, topic, command):
+        # One trace can ride on several commands, each consumer gets its own hop list
+        trace = command.get("trace")
+        if trace:
+            command = dict(command, trace=dict(trace, hops=list(trace["hops"])))
+
+        if topic == self.manager.control_topic:
+            self.agent_inbox.put((self.agent._process_control_message, "control_commands", command))
+            self.alerts_inbox.put(command)
+            self.m_handoffs.labels("control_commands").inc()
+        else:
+            self.agent_inbox.put((self.agent._process_rate_message, "rate_commands", command))
+            self.m_handoffs.labels("rate_commands").inc()
+        if self.mirror:
+            self.agent.mqtt_client.publish(topic, json.dumps(command))
+
+    def _from_alerts(self, alert):
+        self.agent_inbox.put((self.agent._process_alert, "udp_alert", alert))
+        self.m_handoffs.labels("alerts").inc()
+
+    # ===== WORKERS =====
+
+    def _consume(self, inbox, handle, route):
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            try:
+                handle(item)
+            except Exception as e:
+                self.m_errors.labels(route).inc()
+                self.log_error.error("Error processing %s: %s", route, e)
+
+    def _handle_manager(self, payload):
+        self.manager.m_messages.inc()
+        self.manager._evaluate(payload)
+
+    def _handle_agent(self, item):
+        handler, kind, message = item
+        self.agent.m_messages.labels(kind).inc()
+        try:
+            handler(message)
+        except Exception:
+            self.agent.m_errors.labels(kind).inc()
+            raise
+
+    def start(self):
+        """Start the worker threads (the agent's MQTT loop is started by agent.run())"""
+        for inbox, handle, route in ((self.manager_inbox, self._handle_manager, "machine_data"),
+                                     (self.alerts_inbox, self.alerts._process_command, "control_commands"),
+                                     (self.agent_inbox, self._handle_agent, "agent")):
+            thread = threading.Thread(target=self._consume, args=(inbox, handle, route), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        for inbox in (self.manager_inbox, self.alerts_inbox, self.agent_inbox):
+            inbox.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def pending(self):
+        return self.manager_inbox.qsize() + self.alerts_inbox.qsize() + self.agent_inbox.qsize()
+
+    def run(self, metrics_port=None):
+        """Serve every component's metrics on one port, then run the agent (blocks)"""
+        if metrics_port:
+            metrics.start_http_server([self.agent.metrics, self.manager.metrics, self.alerts.metrics,
+                                       self.metrics], metrics_port)
+        self.start()
+        self.agent.run()
+
+def configure(module, **values):
+    """Set the globals a component normally defines in its own __main__"""
+    for name, value in values.items():
+        setattr(module, name, value)
+
+if __name__ == "__main__":
+    startup.begin()
+
+    # ===== MACHINE CONFIGURATION =====
+    machines_path, intervals_path = "config/all_machines.json", "config/intervals.json"
+    try:
+        with open(machines_path, "r", encoding="utf-8") as f:
+            MACHINE_SPECS = json.load(f)
+        with open(intervals_path, "r", encoding="utf-8") as f:
+            INTERVALS = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        print("File not found/invalid")
+        sys.exit(1)
+    PARAM_MAP = {
+        "rpm": ["0x01"],
+        "consumption": ["0x02", "consumption_unit"],
+        "coolant_temp": ["0x03", "temp_unit"],
+        "oil_pressure": ["0x04", "oil_unit"],
+        "battery_potential": ["0x05", "batt_unit"]
+    }
+    REASON_MAP = {"high number of control alarms": "0x01"}
+    CONFIG_RELOAD_SECONDS = 2   # config files checked for changes, one store for the agent and the manager
+
+    # ===== MQTT CONFIG =====
+    MQTT_BROKER_IP = "10.6.1.9"
+    MQTT_PORT = 1883
+    GROUP_ID = "19"
+
+    # ===== FUSED CONFIG =====
+    MIRROR_INTERNAL = False     # also publish internal messages for observers (debugger.py)
+    METRICS_PORT = 9100         # metrics of all three components (None = off)
+
+    # ===== INFLUXDB CONFIG =====
+    URL = "https://eu-central-1-1.aws.cloud2.influxdata.com/"
+    TOKEN = "############"
+    ORG = "Coimbra lecd test"
+    BUCKET = "Project part2"
+
+    # ===== LOGGING CONFIG =====
+    logger.setup("agent", level="INFO", levels={"payload": "WARNING"}, sample_rates={"message": 0.01},
+                 rate_limits={"message": 20, "storage": 20, "error": 10})
+    logger.setup("manager", level="INFO", levels={"payload": "WARNING"}, sample_rates={"message": 0.01},
+                 rate_limits={"message": 20, "command": 50, "error": 10})
+    logger.setup("alert_manager", level="INFO", levels={"payload": "WARNING"},
+                 rate_limits={"alert": 50, "error": 10})
+    logger.setup("fused", level="INFO", rate_limits={"error": 10})
+
+    # ===== COMPONENT CONFIG (see each component's __main__) =====
+    configure(
+        data_manager_agent,
+        MACHINE_SPECS=MACHINE_SPECS, INTERVALS=INTERVALS,
+        PARAM_MAP=PARAM_MAP, REASON_MAP=REASON_MAP,
+        MQTT_BROKER_IP=MQTT_BROKER_IP, MQTT_PORT=MQTT_PORT, UDP_IP="localhost", UDP_PORT=5005,
+        URL=URL, TOKEN=TOKEN, ORG=ORG, BUCKET=BUCKET,
+        METRICS_PORT=None, TRACE_REPORT_EVERY=60,
+        STATE_CAPACITY=720, STATE_PORT=9301, STATE_WARM_SECONDS=3600, STATE_WARM_LOG=None,
+        QUANTILE_SKETCHES=True,
+        HEALTH_WEIGHTS={"deviation": 1.0, "commands": 0.2, "alarms": 2.0, "link": 0.5},
+        HEALTH_LINK_LEVELS={"rssi": {"good": -90, "bad": -120}, "snr": {"good": -5, "bad": -20}},
+        DEDUP_TTL=60, DEDUP_MAX_ENTRIES=100000,
+        QUARANTINE_SIZE=1000, QUARANTINE_FLOOD_REJECTS=50, QUARANTINE_FLOOD_WINDOW=10, QUARANTINE_BLOCK_SECONDS=60,
+        MANAGER_PARTITIONS=0,     # one manager in this process, nothing to partition
+        STARTUP_BUFFER=10000,
+        PROFILE_DURATION=30, PROFILE_CONTROL_PORT=9201
+    )
+    configure(machine_data_manager, METRICS_PORT=None, TRACE_REPORT_EVERY=60,
+              PROFILE_DURATION=30, PROFILE_CONTROL_PORT=None)
+    configure(alert_manager, METRICS_PORT=None)
+
+    # Adaptive reporting and raw bursts, as in machine_data_manager.py
+    policy = machine_data_manager.ReportingPolicy(INTERVALS, 1, 5, 30, 0.1, 10)
+
+    configs = config_store.ConfigStore(MACHINE_SPECS, INTERVALS, PARAM_MAP, REASON_MAP,
+                                       machines_path, intervals_path, CONFIG_RELOAD_SECONDS)
+    startup.mark("config")
+
+    agent = data_manager_agent.DataManagerAgent(GROUP_ID, configs)
+    manager = machine_data_manager.MachineDataManager(GROUP_ID, INTERVALS, policy, 60, config=configs)
+    alerts = alert_manager.AlertManager(GROUP_ID, None, None)
+
+    pipeline = FusedPipeline(agent, manager, alerts, MIRROR_INTERNAL)
+    startup.mark("init")
+    pipeline.run(METRICS_PORT)
@@ -0,0 +1,243 @@
+import math
+import threading
+import time
+from heapq import heappop, heappush
+
+# "Worst machines" ranking for the control room, kept up to date as readings arrive
+# instead of being computed by scanning the fleet.
+#
+# A machine's health score (higher = worse) is a weighted sum of
+#   deviation  worst field's distance from its intervals.json ideal, scaled so the
+#              edge of the healthy range is 1.0 (2.0 = as far again outside it)
+#   commands   control commands issued for the machine, per EVENT_WINDOW
+#   alarms     AlertManager alarms for the machine, per EVENT_WINDOW
+#   link       radio link quality from rx_metadata, 0 when rssi and snr are at or above
+#              their "good" level, 1 at their "bad" level
+# Command and alarm counts decay exponentially with a time constant of EVENT_WINDOW
+# seconds. A score is recomputed whenever the machine gets a reading, command or alarm,
+# so the decay shows up at the machine's next event, not continuously.
+#
+# Scores live in indexed max-heaps (one for the fleet, one per machine type): the
+# position map makes an update O(log n), and the top k are read in O(k log k)
+# without touching the other machines.
+
+EVENT_WINDOW = 600
+
+class IndexedHeap:
+    """Max-heap of keys by score with O(log n) update and remove of any key"""
+
+    def __init__(self):
+        self.heap = []          # [score, key]
+        self.position = {}      # key -> index in heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def update(self, key, score):
+        i = self.position.get(key)
+        if i is None:
+            self.heap.append([score, key])
+            i = self.position[key] = len(self.heap) - 1
+            self._sift_up(i)
+            return
+        old = self.heap[i][0]
+        self.heap[i][0] = score
+        if score > old:
+            self._sift_up(i)
+        elif score < old:
+            self._sift_down(i)
+
+    def remove(self, key):
+        i = self.position.pop(key, None)
+        if i is None:
+            return
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.position[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self.position[last[1]])
+
+    def top(self, k):
+        """[(score, key)] of the k highest scores, highest first, heap untouched"""
+        heap = self.heap
+        result = []
+        candidates = [(-heap[0][0], 0)] if heap else []
+        while candidates and len(result) < k:
+            score, i = heappop(candidates)
+            result.append((-score, heap[i][1]))
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heappush(candidates, (-heap[child][0], child))
+        return result
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.position[heap[i][1]] = i
+        self.position[heap[j][1]] = j
+
+    def _sift_up(self, i):
+        heap = self.heap
+        while i > 0:
+            parent = (i - 1) >> 1
+            if heap[parent][0] >= heap[i][0]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        heap = self.heap
+        size = len(heap)
+        while True:
+            largest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and heap[child][0] > heap[largest][0]:
+                    largest = child
+            if largest == i:
+                return
+            self._swap(i, largest)
+            i = largest
+
+class MachineHealth:
+    __slots__ = ("machine_type", "deviation", "worst_field", "link", "rssi", "snr",
+                 "commands", "alarms", "events_ts", "ts", "score")
+
+    def __init__(self, machine_type):
+        self.machine_type = machine_type
+        self.deviation = 0.0
+        self.worst_field = None
+        self.link = 0.0
+        self.rssi = None
+        self.snr = None
+        self.commands = 0.0
+        self.alarms = 0.0
+        self.events_ts = None
+        self.ts = None
+        self.score = 0.0
+
+    def decay(self, now):
+        """Bring the command/alarm counts to now"""
+        if self.events_ts is not None and now > self.events_ts:
+            factor = math.exp((self.events_ts - now) / EVENT_WINDOW)
+            self.commands *= factor
+            self.alarms *= factor
+        self.events_ts = now
+
+    def as_dict(self):
+        return {"machine_type": self.machine_type, "score": round(self.score, 4),
+                "deviation": round(self.deviation, 4), "worst_field": self.worst_field,
+                "commands": round(self.commands, 2), "alarms": round(self.alarms, 2),
+                "link": round(self.link, 4), "rssi": self.rssi, "snr": self.snr, "ts": self.ts}
+
+class HealthIndex:
+    def __init__(self, intervals, weights, link_levels):
+        """weights: {"deviation", "commands", "alarms", "link"} -> factor,
+           link_levels: {"rssi"|"snr": {"good": ..., "bad": ...}}"""
+        self.intervals = intervals
+        self.weights = weights
+        self.link_levels = link_levels
+        self.machines = {}      # machine_id -> MachineHealth
+        self.fleet = IndexedHeap()
+        self.types = {}         # machine type -> IndexedHeap
+        self.lock = threading.Lock()
+
+    def _machine(self, machine_id, machine_type=None):
+        health = self.machines.get(machine_id)
+        if health is None:
+            health = self.machines[machine_id] = MachineHealth(machine_type)
+        elif machine_type is not None and machine_type != health.machine_type:
+            # Commands can arrive before the first reading, or a machine id gets reused
+            if health.machine_type in self.types:
+                self.types[health.machine_type].remove(machine_id)
+            health.machine_type = machine_type
+        return health
+
+    def _rescore(self, machine_id, health):
+        weights = self.weights
+        health.score = (weights.get("deviation", 0) * health.deviation
+                        + weights.get("commands", 0) * health.commands
+                        + weights.get("alarms", 0) * health.alarms
+                        + weights.get("link", 0) * health.link)
+        self.fleet.update(machine_id, health.score)
+        if health.machine_type is not None:
+            heap = self.types.get(health.machine_type)
+            if heap is None:
+                heap = self.types[health.machine_type] = IndexedHeap()
+            heap.update(machine_id, health.score)
+
+    # ===== EVENTS =====
+
+    def observe_reading(self, machine_id, sensor_data, comm_data, now=None):
+        """Standardized reading (machine_type included) and its rx_metadata"""
+        now = time.time() if now is None else now
+        deviation, worst_field = 0.0, None
+        for field, interval in self.intervals.items():
+            value = sensor_data.get(field)
+            if value is None:
+                continue
+            ideal = interval["ideal"]
+            if value >= ideal:
+                excess, half = value - ideal, interval["high"] - ideal
+            else:
+                excess, half = ideal - value, ideal - interval["low"]
+            if half:
+                distance = excess / half
+            else:
+                # Ideal on the bound (valid config): 0 there, past it 1.0 + the excess in range widths
+                distance = 1.0 + excess / (interval["high"] - interval["low"]) if excess else 0.0
+            if distance > deviation:
+                deviation, worst_field = distance, field
+
+        link, measured = 0.0, 0
+        for field, levels in self.link_levels.items():
+            value = comm_data.get(field)
+            if value is None:
+                continue
+            measured += 1
+            link += max(0.0, (levels["good"] - value) / (levels["good"] - levels["bad"]))
+
+        with self.lock:
+            health = self._machine(machine_id, sensor_data["machine_type"])
+            health.deviation, health.worst_field = deviation, worst_field
+            health.link = link / measured if measured else 0.0
+            health.rssi, health.snr = comm_data.get("rssi"), comm_data.get("snr")
+            health.ts = now
+            health.decay(now)
+            self._rescore(machine_id, health)
+
+    def observe_command(self, machine_id, now=None):
+        """Control command issued for the machine"""
+        with self.lock:
+            health = self._machine(machine_id)
+            health.decay(time.time() if now is None else now)
+            health.commands += 1
+            self._rescore(machine_id, health)
+
+    def observe_alarm(self, machine_id, now=None):
+        """Alarm raised by AlertManager for the machine"""
+        with self.lock:
+            health = self._machine(machine_id)
+            health.decay(time.time() if now is None else now)
+            health.alarms += 1
+            self._rescore(machine_id, health)
+
+    def forget(self, machine_id):
+        with self.lock:
+            health = self.machines.pop(machine_id, None)
+            if health is None:
+                return
+            self.fleet.remove(machine_id)
+            if health.machine_type in self.types:
+                self.types[health.machine_type].remove(machine_id)
+
+    # ===== QUERIES =====
+
+    def worst(self, k=10, machine_type=None):
+        """[{machine_id, score, breakdown...}] of the k worst machines (of a type), worst first"""
+        with self.lock:
+            heap = self.fleet if machine_type is None else self.types.get(machine_type)
+            if heap is None:
+                return []
+            return [dict(self.machines[machine_id].as_dict(), machine_id=machine_id)
+                    for _, machine_id in heap.top(k)]
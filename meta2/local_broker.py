@@ -0,0 +1,247 @@
+import itertools
+import queue
+import threading
+from paho.mqtt.client import topic_matches_sub
+
+# In-process stand-in for the MQTT broker. LocalClient implements the part of the paho
+# Client API the components use, so a component is moved onto the stand-in by replacing
+# its client before run():
+#
+#     broker = LocalBroker()
+#     broker.attach(agent)      # agent.mqtt_client is now a LocalClient
+#
+# By default messages are delivered synchronously in the publisher's thread, in
+# subscription order, which keeps offline runs deterministic. Every delivery runs under
+# one lock, the way the single paho network thread of each component serializes its
+# callbacks. With queue_size > 0 each client gets a bounded queue and its own delivery
+# thread instead, like separate processes behind a real broker: a message that finds
+# the queue full is dropped and counted, as mosquitto does with max_queued_messages.
+#
+# Retained messages are kept per topic (an empty payload clears one) and delivered on
+# subscribe. A will is stored but never sent: clients only disconnect cleanly here.
+
+class LocalMessage:
+    __slots__ = ("topic", "payload", "qos", "retain", "mid")
+
+    def __init__(self, topic, payload, qos=0, retain=False, mid=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+
+class PublishInfo:
+    """Stands in for paho's MQTTMessageInfo (always delivered, nothing to wait for)"""
+    __slots__ = ("rc", "mid")
+
+    def __init__(self, mid):
+        self.rc = 0
+        self.mid = mid
+
+    def wait_for_publish(self, timeout=None):
+        return True
+
+    def is_published(self):
+        return True
+
+class LocalBroker:
+    def __init__(self, queue_size=0):
+        self.queue_size = queue_size
+        self.subscriptions = []     # [topic filter, client]
+        self.exact = {}             # topic -> clients, cache of the filter matches
+        self.retained = {}          # topic -> payload
+        self.lock = threading.RLock()
+        self.mids = itertools.count(1)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def client(self, on_connect=None, on_message=None):
+        client = LocalClient(self)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        return client
+
+    def attach(self, component, attribute="mqtt_client"):
+        """Swap a component's paho client for a LocalClient with the same callbacks"""
+        old = getattr(component, attribute)
+        client = self.client(old.on_connect, old.on_message)
+        setattr(component, attribute, client)
+
+        # Profiler stages that wrap the old client's methods follow it to the new one
+        profiler = getattr(component, "profiler", None)
+        if profiler:
+            for name, (owner, method) in profiler.stages.items():
+                if owner is old:
+                    profiler.stages[name] = (client, method)
+
+        # So does a partitioned manager's coordinator (heartbeats and will)
+        coordinator = getattr(component, "coordinator", None)
+        if coordinator and coordinator.client is old:
+            coordinator.bind(client)
+        return client
+
+    def subscribe(self, client, topic_filter):
+        with self.lock:
+            if [topic_filter, client] not in self.subscriptions:
+                self.subscriptions.append([topic_filter, client])
+                self.exact.clear()
+            for topic, payload in list(self.retained.items()):
+                if topic_matches_sub(topic_filter, topic):
+                    self._send(client, LocalMessage(topic, payload, 0, True, next(self.mids)))
+
+    def unsubscribe(self, client, topic_filter):
+        with self.lock:
+            if [topic_filter, client] in self.subscriptions:
+                self.subscriptions.remove([topic_filter, client])
+                self.exact.clear()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif payload is None:
+            payload = b""
+        mid = next(self.mids)
+
+        with self.lock:
+            self.published += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            clients = self.exact.get(topic)
+            if clients is None:
+                clients = self.exact[topic] = [c for f, c in self.subscriptions if topic_matches_sub(f, topic)]
+            for client in clients:
+                self._send(client, LocalMessage(topic, payload, qos, retain, mid))
+        return mid
+
+    def _send(self, client, message):
+        if not client.connected:
+            return
+        if client.inbox is None:
+            self.delivered += 1
+            client._dispatch(message)
+            return
+        try:
+            client.inbox.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _deliver(self, client):
+        """Delivery thread of one client in queued mode"""
+        while True:
+            message = client.inbox.get()
+            if message is None:
+                return
+            self.delivered += 1
+            try:
+                client._dispatch(message)
+            except Exception as e:
+                print(f"[local broker] on_message of {client.on_message} failed: {e}")
+
+    def pending(self):
+        """Messages waiting in the client queues"""
+        with self.lock:
+            clients = {client for _, client in self.subscriptions}
+        return sum(c.inbox.qsize() for c in clients if c.inbox is not None)
+
+class LocalClient:
+    """paho Client look-alike bound to a LocalBroker"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.userdata = None
+        self.connected = False
+        self.stopped = threading.Event()
+        self.inbox = None
+        if broker.queue_size:
+            self.inbox = queue.Queue(broker.queue_size)
+            threading.Thread(target=broker._deliver, args=(self,), daemon=True).start()
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.message_callbacks = []     # [topic filter, callback], see message_callback_add
+        self.will = None
+
+    def _dispatch(self, message):
+        for topic_filter, callback in self.message_callbacks:
+            if topic_matches_sub(topic_filter, message.topic):
+                callback(self, self.userdata, message)
+                return
+        if self.on_message:
+            self.on_message(self, self.userdata, message)
+
+    def message_callback_add(self, sub, callback):
+        self.message_callback_remove(sub)
+        self.message_callbacks.append([sub, callback])
+
+    def message_callback_remove(self, sub):
+        self.message_callbacks = [entry for entry in self.message_callbacks if entry[0] != sub]
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        self.will = (topic, payload, qos, retain)
+
+    def user_data_set(self, userdata):
+        self.userdata = userdata
+
+    def connect(self, host=None, port=1883, keepalive=60):
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(self, self.userdata, {}, 0)
+        return 0
+
+    connect_async = connect
+
+    def reconnect(self):
+        return self.connect()
+
+    def disconnect(self):
+        self.connected = False
+        self.stopped.set()
+        if self.inbox is not None:
+            self.inbox.put(None)
+        if self.on_disconnect:
+            self.on_disconnect(self, self.userdata, 0)
+        return 0
+
+    def is_connected(self):
+        return self.connected
+
+    def subscribe(self, topic, qos=0):
+        # A list of (topic, qos) subscribes to several at once, as in paho
+        for topic_filter in ([t for t, _ in topic] if isinstance(topic, list) else [topic]):
+            self.broker.subscribe(self, topic_filter)
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        self.broker.unsubscribe(self, topic)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        mid = self.broker.publish(topic, payload, qos, retain)
+        if self.on_publish:
+            self.on_publish(self, self.userdata, mid)
+        return PublishInfo(mid)
+
+    # There is no network loop: deliveries happen inside publish() or the delivery thread
+    def loop_start(self):
+        return 0
+
+    def loop_stop(self):
+        return 0
+
+    def loop_forever(self, *args, **kwargs):
+        self.stopped.wait()
+        return 0
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def max_queued_messages_set(self, queue_size):
+        pass
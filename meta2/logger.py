@@ -0,0 +1,121 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+# Components log through per-category loggers named "<component>.<category>", e.g.
+# "agent.payload". Records are filtered (level, sampling, rate limit) in the calling
+# thread, then queued unformatted: %-style formatting and the stdout write happen in
+# a background thread, so a switched-off line costs one isEnabledFor check.
+
+class CategoryLimiter(logging.Filter):
+    """Per-category sampling and token-bucket rate limiting, applied before enqueueing"""
+
+    def __init__(self, sample_rates, rate_limits):
+        super().__init__()
+        self.sample_rates = sample_rates    # category -> fraction of records kept
+        self.rate_limits = rate_limits      # category -> records per second
+        self.buckets = {}                   # category -> [tokens, last refill]
+        self.suppressed = {}                # category -> records dropped since the last one kept
+
+    def filter(self, record):
+        category = record.name.rsplit(".", 1)[-1]
+
+        rate = self.sample_rates.get(category)
+        if rate is not None and random.random() >= rate:
+            return self._drop(category)
+
+        limit = self.rate_limits.get(category)
+        if limit is not None:
+            now = time.monotonic()
+            bucket = self.buckets.get(category)
+            if bucket is None:
+                bucket = self.buckets[category] = [limit, now]
+            bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return self._drop(category)
+            bucket[0] -= 1
+
+        record.suppressed = self.suppressed.pop(category, 0)
+        return True
+
+    def _drop(self, category):
+        self.suppressed[category] = self.suppressed.get(category, 0) + 1
+        return False
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self, record):
+        # The stock handler formats here, in the caller's thread. Arguments are kept
+        # by reference instead: objects mutated after the call log their later state.
+        return record
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("[%(asctime)s] %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" (+{record.suppressed} suppressed)"
+        return text
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, structured fields come from extra={"fields": {...}}"""
+
+    def format(self, record):
+        component, _, category = record.name.partition(".")
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "component": component,
+            "category": category,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", {}))
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class Decoded:
+    """Log argument that decodes bytes only when the line is actually written"""
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.decode(errors="replace")
+
+def setup(component, level="INFO", json_output=False, levels=None, sample_rates=None, rate_limits=None):
+    """Route all "<component>.*" loggers through the limiter and a background stdout writer"""
+    root = logging.getLogger(component)
+    root.setLevel(level)
+    root.propagate = False
+
+    # Per-category level overrides, e.g. {"payload": "DEBUG"}
+    for category, category_level in (levels or {}).items():
+        logging.getLogger(f"{component}.{category}").setLevel(category_level)
+
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.addFilter(CategoryLimiter(sample_rates or {}, rate_limits or {}))
+    root.handlers = [handler]
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if json_output else TextFormatter())
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return root
+
+def get(component, category):
+    return logging.getLogger(f"{component}.{category}")
@@ -1,15 +1,83 @@
 import paho.mqtt.client as mqtt
 import json
+import math
 import time
 import random
 import sys
+from collections import deque
 from datetime import datetime
+import tracing
+from faults import FaultInjector
+
+# The random-walk step ranges below are calibrated for one sample every WALK_PERIOD
+# seconds. At another sample period the drift (mean step) scales with the period and the
+# noise around it with its square root, so values wander at the same pace in wall-clock
+# time whatever the sampling rate.
+WALK_PERIOD = 5
+
+class FixedRateScheduler:
+    """Monotonic fixed-rate ticker, deadlines do not drift with the work done per tick"""
+
+    def __init__(self, period):
+        self.period = period
+        self.next_tick = time.monotonic() + period
+        self.missed_ticks = 0
+
+    def wait(self):
+        """Sleep until the next tick of the schedule"""
+        delay = self.next_tick - time.monotonic()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self.next_tick - time.monotonic()
+
+        # Overrun: skip the ticks we missed instead of bursting to catch up
+        missed = int(-delay // self.period)
+        self.missed_ticks += missed
+        self.next_tick += (missed + 1) * self.period
+
+class SensorWindow:
+    """Running min/max/mean/last of every sensor since the last summary uplink"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.started_at = None
+        self.stats = {}
+
+    def add(self, taken_at, values):
+        if self.count == 0:
+            self.started_at = taken_at
+            self.stats = {field: [value, value, 0.0, value] for field, value in values.items()}
+
+        for field, value in values.items():
+            stat = self.stats[field]
+            if value < stat[0]:
+                stat[0] = value
+            if value > stat[1]:
+                stat[1] = value
+            stat[2] += value
+            stat[3] = value
+        self.count += 1
+        self.ended_at = taken_at
+
+    def summary(self):
+        summary = {
+            field: {"min": low, "max": high, "mean": round(total / self.count, 2), "last": last}
+            for field, (low, high, total, last) in self.stats.items()
+        }
+        summary["count"] = self.count
+        summary["window_ms"] = round((self.ended_at - self.started_at) * 1000)
+        return summary
 
 class Machine:
 
     def __init__(self, machine_code, update_time):
         self.machine_code = machine_code
         self.update_time = update_time
+        self.walk_drift = update_time / WALK_PERIOD
+        self.walk_noise = math.sqrt(self.walk_drift)
         self.specs = MACHINE_SPECS[machine_code]
         self.machine_id = MACHINE_SPECS[machine_code]["machine_id"]
         
@@ -28,9 +96,34 @@ class Machine:
         self.snr = -15.0
         self.rssi_channel = -85
 
+        # Samples waiting to be packed into the next uplink (multi-sample mode)
+        self.samples = []
+
+        # Samples (or summary ticks) per uplink set by a reporting period downlink, None = as
+        # configured. The sampling period itself never changes: update_time is fixed
+        self.report_ticks = None
+
+        # Summary mode: local window, raw readings only during a requested burst
+        self.window = SensorWindow()
+        self.burst_until = 0
+
+        # Optional FaultInjector distorting the readings and the device clock
+        self.faults = None
+
+        # Stable device identity, derived from the machine so restarts keep it
+        identity = random.Random(f"{machine_code}:{self.machine_id}")
+        self.dev_eui = "".join(identity.choices("0123456789ABCDEF", k=16))
+        self.dev_addr = "".join(identity.choices("0123456789ABCDEF", k=8))
+        self.payload_template = self._build_payload_template()
+
     def _clamp_value(self, value, min_val, max_val):
         return max(min_val, min(value, max_val))
 
+    def _step(self, low, high):
+        """Random-walk increment over one sample period, from a step range per WALK_PERIOD"""
+        mean = (low + high) / 2
+        return mean * self.walk_drift + (random.uniform(low, high) - mean) * self.walk_noise
+
     def update_sensors(self):
         """Update sensor values according to project specifications"""
         if self.is_shutting_down:
@@ -54,39 +147,39 @@ class Machine:
 
         # RPM
         self.rpm = self._clamp_value(
-            self.rpm + random.uniform(-50, 200),800, 3000)
+            self.rpm + self._step(-50, 200),800, 3000)
         
         # TEMPERATURE
         if self.specs["temp_unit"] == "°C":
-            self.coolant_temp = self._clamp_value(self.coolant_temp + random.uniform(-0.3, 1.0),70.0, 130.0)
+            self.coolant_temp = self._clamp_value(self.coolant_temp + self._step(-0.3, 1.0),70.0, 130.0)
         else:
-            self.coolant_temp = self._clamp_value(self.coolant_temp + random.uniform(-0.54, 1.8),158.0, 266.0 )
+            self.coolant_temp = self._clamp_value(self.coolant_temp + self._step(-0.54, 1.8),158.0, 266.0 )
         
         # OIL
         if self.specs["oil_unit"] == "bar":
-            self.oil_pressure = self._clamp_value(self.oil_pressure + random.uniform(-0.1, 0.5),1.5, 8.0)
+            self.oil_pressure = self._clamp_value(self.oil_pressure + self._step(-0.1, 0.5),1.5, 8.0)
         else: 
-            self.oil_pressure = self._clamp_value(self.oil_pressure + random.uniform(-1.45, 7.25),21.75, 116.0)
+            self.oil_pressure = self._clamp_value(self.oil_pressure + self._step(-1.45, 7.25),21.75, 116.0)
             
         # BATTERY
         if self.specs["batt_unit"] == "V":
-            self.battery_potential = self._clamp_value(self.battery_potential + random.uniform(-0.1, 0.2),10.0, 14.0)
+            self.battery_potential = self._clamp_value(self.battery_potential + self._step(-0.1, 0.2),10.0, 14.0)
         else:
-            self.battery_potential = self._clamp_value(self.battery_potential + random.uniform(-100,200),10000.0,14000.0)
+            self.battery_potential = self._clamp_value(self.battery_potential + self._step(-100,200),10000.0,14000.0)
         
         # CONSUMPTION
         if self.specs["consumption_unit"] == "l/h":
-            self.consumption = self._clamp_value(self.consumption + random.uniform(-1, 1),1.0, 50.0)
+            self.consumption = self._clamp_value(self.consumption + self._step(-1, 1),1.0, 50.0)
         else:
-            self.consumption = self._clamp_value(self.consumption + random.uniform(-0.26, 0.26), 0.26, 13.21)
+            self.consumption = self._clamp_value(self.consumption + self._step(-0.26, 0.26), 0.26, 13.21)
 
         # COMMUNICATIONS
 
-        self.rssi = self._clamp_value(self.rssi + random.uniform(-3,3),-120,-50)
+        self.rssi = self._clamp_value(self.rssi + self._step(-3,3),-120,-50)
 
-        self.snr = self._clamp_value(self.snr + random.uniform(-0.5,0.5),-20,10)
+        self.snr = self._clamp_value(self.snr + self._step(-0.5,0.5),-20,10)
 
-        self.rssi_channel = self._clamp_value(self.rssi_channel + random.uniform(-3,3),-120,-50)
+        self.rssi_channel = self._clamp_value(self.rssi_channel + self._step(-3,3),-120,-50)
 
     def _restart_machine(self):
         """Reset machine to normal operation"""
@@ -108,6 +201,8 @@ class Machine:
         """Process incoming MQTT control commands"""
 
         # Example command: "0x01 0x01 0x01 0xFA" (reduce RPM by 6)
+        # Example command: "0x01 0x02 0x00 0x32" (uplink every 5.0 s)
+        # Example command: "0x01 0x03 0x00 0x3C" (raw burst for 60 s)
         parts = command.split()
 
         if len(parts) != 4:
@@ -117,7 +212,7 @@ class Machine:
         # Byte 1: Message Type (0x01 = Control)        
         msg_type = parts[0]
 
-        # Byte 2: Action Type (0x01 = Modify Parameter)
+        # Byte 2: Action Type (0x01 = Modify Parameter, 0x02 = Reporting Period, 0x03 = Raw Burst)
         msg_mod = parts[1]
 
         # Byte 3: Parameter to modify
@@ -131,6 +226,26 @@ class Machine:
         if msg_type != "0x01":
             print("[ERROR] process_control_command: No 0x01 = Control")
             return
+
+        if msg_mod == "0x02":
+            # Bytes 3-4: new period in tenths of a second (unsigned, big endian)
+            period = ((int(parts[2], 16) << 8) | int(parts[3], 16)) / 10
+            if period <= 0:
+                print("[ERROR] process_control_command: reporting period must be > 0")
+                return
+            # Uplink cadence only: sampling goes on every update_time, the samples in between
+            # go out together (multi-sample uplink, or one summary per period)
+            self.report_ticks = max(1, round(period / self.update_time))
+            print(f"[{datetime.now()}] Reporting period set to {period}s ({self.report_ticks} sample(s) per uplink)")
+            return
+
+        if msg_mod == "0x03":
+            # Bytes 3-4: burst duration in seconds (unsigned, big endian)
+            duration = (int(parts[2], 16) << 8) | int(parts[3], 16)
+            self.burst_until = time.time() + duration
+            self.window.reset()
+            print(f"[{datetime.now()}] Raw burst mode for {duration}s")
+            return
             
         if msg_mod != "0x01":
             print("[ERROR] process_control_command: No 0x01 = modification")
@@ -172,34 +287,69 @@ class Machine:
             self.is_shutting_down = True
             self.waiting_for_adjustment = True
 
-    def generate_payload(self):
-        """Generate TTN-compatible JSON payload"""
-        return {
+    def reading(self):
+        """Current sensor values as they go into an uplink"""
+        values = {
+            "rpm": round(self.rpm,2),
+            "coolant_temperature": round(self.coolant_temp,2),
+            "oil_pressure": round(self.oil_pressure,2),
+            "battery_potential": round(self.battery_potential,2),
+            "consumption": round(self.consumption,2)
+        }
+        if self.faults:
+            self.faults.distort(self.machine_id, values)
+        return values
+
+    def clock(self):
+        """Device time, skewed when a clock fault is active"""
+        if self.faults:
+            return time.time() + self.faults.clock_offset(self.machine_id)
+        return time.time()
+
+    def record_sample(self):
+        """Store the current readings for the next multi-sample uplink"""
+        self.samples.append((self.clock(), self.reading()))
+
+    def in_burst(self):
+        return time.time() < self.burst_until
+
+    def take_readings(self):
+        """Drain the readings for the next uplink as (timestamp, values) pairs"""
+        if not self.samples:
+            return [(self.clock(), self.reading())]
+        readings = self.samples
+        self.samples = []
+        return readings
+
+    def _build_payload_template(self):
+        """Pre-serialize the constant part of this device's TTN payload"""
+        skeleton = {
             "end_device_ids": {
                 "machine_id": self.machine_id,
                 "application_id": "SRSA2025:industrial-monitoring",
-                "dev_eui": "".join(random.choices("0123456789ABCDEF", k=16)),
+                "dev_eui": self.dev_eui,
                 "join_eui": "0000000000000000",
-                "dev_addr": "".join(random.choices("0123456789ABCDEF", k=8))
+                "dev_addr": self.dev_addr
             },
-            "received_at": datetime.now().isoformat(),
+            "received_at": "@@received_at@@",
             "uplink_message": {
                 "f_port": 1,
                 "f_cnt": 1234,
                 "frm_payload": "BASE64_SIMULATED_PAYLOAD",
                 "decoded_payload": {
-                    "rpm": round(self.rpm,2),
-                    "coolant_temperature": round(self.coolant_temp,2),
-                    "oil_pressure": round(self.oil_pressure,2),
-                    "battery_potential": round(self.battery_potential,2),
-                    "consumption": round(self.consumption,2),
-                    "machine_type": self.machine_code
+                    "rpm": "@@rpm@@",
+                    "coolant_temperature": "@@coolant_temperature@@",
+                    "oil_pressure": "@@oil_pressure@@",
+                    "battery_potential": "@@battery_potential@@",
+                    "consumption": "@@consumption@@",
+                    "machine_type": self.machine_code,
+                    "extra": "@@extra@@"
                 },
                 "rx_metadata": [{
                     "gateway_id": "dei-gateway-1",
-                    "rssi": round(self.rssi,2),
-                    "snr": round(self.snr,2),
-                    "channel_rssi": round(self.rssi_channel,2),
+                    "rssi": "@@rssi@@",
+                    "snr": "@@snr@@",
+                    "channel_rssi": "@@channel_rssi@@",
                     "uplink_token": "SIMULATED_TOKEN"
                 }],
                 "settings": {
@@ -209,15 +359,144 @@ class Machine:
                         "spreading_factor": 7
                     },
                     "frequency": "868300000",
-                    "timestamp": int(time.time())
+                    "timestamp": "@@timestamp@@"
                 },
-                "consumed_airtime": f"{random.uniform(0.05, 0.07):.6f}s"
+                "consumed_airtime": "@@consumed_airtime@@"
             }
         }
 
+        # Turn the placeholders into str.format fields (strings keep their quotes)
+        template = json.dumps(skeleton).replace("{", "{{").replace("}", "}}")
+        template = template.replace(', "extra": "@@extra@@"', "{extra}")
+        for field in ("received_at", "consumed_airtime"):
+            template = template.replace(f"@@{field}@@", f"{{{field}}}")
+        for field in ("rpm", "coolant_temperature", "oil_pressure", "battery_potential",
+                      "consumption", "rssi", "snr", "channel_rssi", "timestamp"):
+            template = template.replace(f'"@@{field}@@"', f"{{{field}}}")
+        return template
+
+    def generate_payload(self, readings=None, backfill=False, summary=None, trace=None):
+        """Generate TTN-compatible JSON payload (already serialized)"""
+        if readings is None:
+            readings = self.take_readings()
+
+        # The top-level values are always the latest reading
+        sent_at, latest = readings[-1]
+
+        # Multi-sample mode: every reading with its offset (ms, <= 0) from the uplink time
+        extra = ""
+        if len(readings) > 1 or backfill:
+            samples = [dict(values, offset_ms=round((taken_at - sent_at) * 1000))
+                       for taken_at, values in readings]
+            extra = f', "samples": {json.dumps(samples)}'
+        if backfill:
+            extra += ', "backfill": true'
+        if summary:
+            extra += f', "summary": {json.dumps(summary)}'
+        if trace:
+            extra += f', "trace": {json.dumps(trace)}'
+
+        return self.payload_template.format(
+            received_at=datetime.fromtimestamp(sent_at).isoformat(),
+            extra=extra,
+            rssi=round(self.rssi,2),
+            snr=round(self.snr,2),
+            channel_rssi=round(self.rssi_channel,2),
+            timestamp=int(sent_at),
+            consumed_airtime=f"{random.uniform(0.05, 0.07):.6f}s",
+            **latest
+        )
+
+class UplinkBuffer:
+    """Connection-aware publishing with a bounded ring buffer for broker outages"""
+
+    def __init__(self, capacity, max_inflight, flush_batch):
+        self.pending = deque(maxlen=capacity)
+        self.max_inflight = max_inflight
+        self.flush_batch = flush_batch
+
+        self.connected = False
+        self.published = 0
+        self.acked = 0
+        self.dropped = 0
+
+    def on_connect(self):
+        # Anything in flight before the outage is gone, start a fresh window
+        self.published = 0
+        self.acked = 0
+        self.connected = True
+
+    def on_disconnect(self):
+        self.connected = False
+
+    def on_publish(self):
+        self.acked += 1
+
+    def window_open(self):
+        return self.connected and self.published - self.acked < self.max_inflight
+
+    def store(self, readings, summary=None):
+        """Keep readings for later, the oldest are dropped when the buffer is full
+
+        The last reading of a summary uplink carries the summary, (taken_at, values, summary),
+        so the summary is backfilled with it.
+        """
+        if summary:
+            taken_at, values = readings[-1]
+            readings = readings[:-1] + [(taken_at, values, summary)]
+        for reading in readings:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(reading)
+
+    def publish(self, client, topic, payload):
+        info = client.publish(topic, payload)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.connected = False
+            return False
+        self.published += 1
+        return True
+
+    def send(self, client, topic, machine, readings, summary=None, trace=None):
+        """Publish live readings, or buffer them while offline or behind on the backlog"""
+        self.flush(client, topic, machine)
+
+        if self.pending or not self.window_open():
+            self.store(readings, summary)
+            return False
+
+        if not self.publish(client, topic, machine.generate_payload(readings, summary=summary, trace=trace)):
+            self.store(readings, summary)
+            return False
+        return True
+
+    def flush(self, client, topic, machine):
+        """Send buffered readings in bulk multi-sample uplinks, as far as the window allows"""
+        flushed = 0
+        while self.pending and self.window_open():
+            # A batch ends at a summary, which goes out with the readings before it
+            entries = []
+            summary = None
+            while self.pending and len(entries) < self.flush_batch and summary is None:
+                entries.append(self.pending.popleft())
+                if len(entries[-1]) == 3:
+                    summary = entries[-1][2]
+            batch = [entry[:2] for entry in entries]
+
+            if not self.publish(client, topic, machine.generate_payload(batch, backfill=True, summary=summary)):
+                self.pending.extendleft(reversed(entries))
+                break
+            flushed += len(batch)
+
+        if flushed:
+            print(f"[{datetime.now()}] Flushed {flushed} buffered readings ({len(self.pending)} left, {self.dropped} dropped)")
+        return flushed
+
 # ===== MQTT CALLBACKS =====
 def on_connect(client, userdata, flags, rc):
     print(f"[{datetime.now()}] Connected to MQTT Broker (rc={rc})")
+    if rc == 0:
+        uplinks.on_connect()
     # Subscribe to control topics
     control_topic = f"v3/{group_id}@ttn/devices/{machine_id}/down/push_actuator"
     alert_topic = f"v3/{group_id}@ttn/devices/{machine_id}/down/push_alert"
@@ -226,9 +505,20 @@ def on_connect(client, userdata, flags, rc):
     print(f"[{datetime.now()}] Subscribed to: {control_topic}")
     print(f"[{datetime.now()}] Subscribed to: {alert_topic}")
 
+def on_disconnect(client, userdata, rc):
+    print(f"[{datetime.now()}] Disconnected from MQTT Broker (rc={rc}), buffering readings")
+    uplinks.on_disconnect()
+
+def on_publish(client, userdata, mid):
+    uplinks.on_publish()
+
 def on_message(client, userdata, msg):
     try:
         payload = json.loads(msg.payload.decode())
+        trace = payload.get("trace")
+        if trace:
+            tracer.hop(trace, "machine_downlink")
+
         if "downlinks" in payload and len(payload["downlinks"]) > 0:
             command = payload["downlinks"][0]["frm_payload"]
             
@@ -236,24 +526,52 @@ def on_message(client, userdata, msg):
                 machine.process_alert_command(command)
             elif "push_actuator" in msg.topic:
                 machine.process_control_command(command)
+
+        if trace:
+            tracer.hop(trace, "machine_applied")
+            tracer.complete(trace)
+            tracer.maybe_report()
     except Exception as e:
         print(f"[{datetime.now()}] Error processing message: {e}")
 
+def transmit(readings):
+    """Uplinks to send for this tick: the readings as they are, unless a transport fault interferes"""
+    if machine.faults:
+        return machine.faults.transmit(machine.machine_id, readings)
+    return [readings]
+
 # ===== MAIN EXECUTION =====
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python3 machine.py <GroupID> <UPDATE_TIME_SECONDS> <MACHINE_CODE>")
+    if len(sys.argv) not in (4, 5, 6):
+        print("Usage: python3 machine.py <GroupID> <UPDATE_TIME_SECONDS> <MACHINE_CODE> [SAMPLES_PER_UPLINK] [SUMMARY_TICKS]")
         print("Example: python3 machine.py 19 5 A23X")
+        print("Example: python3 machine.py 19 0.01 A23X 50  (100 Hz sampling, 2 uplinks/s)")
+        print("Example: python3 machine.py 19 1 A23X 1 60  (1 summary uplink/min, raw only in bursts)")
         sys.exit(1)
 
     group_id = sys.argv[1]
-    update_time = int(sys.argv[2])
+    update_time = float(sys.argv[2])
     machine_code = sys.argv[3]
+    samples_per_uplink = int(sys.argv[4]) if len(sys.argv) >= 5 else 1
+    summary_ticks = int(sys.argv[5]) if len(sys.argv) == 6 else 0
 
     # ===== MQTT CONFIG =====
     MQTT_BROKER_IP = "10.6.1.9"
     MQTT_PORT = 1883
 
+    # ===== OFFLINE BUFFER CONFIG =====
+    BUFFER_CAPACITY = 10000     # readings kept while the broker is unreachable
+    MAX_INFLIGHT = 20           # uplinks handed to paho but not yet sent
+    FLUSH_BATCH = 50            # readings per bulk uplink when flushing
+
+    # ===== TRACING CONFIG =====
+    TRACE_SAMPLE_RATE = 0.01    # fraction of ticks traced end-to-end (0 = off)
+    TRACE_REPORT_EVERY = 60     # seconds between p50/p99 reports
+
+    # ===== FAULT INJECTION CONFIG =====
+    FAULT_SCENARIO = None   # scenario name in config/fault_scenarios.json (None = off)
+    SEED = None             # fixes the random walk and the fault draws (None = new run every time)
+
     # ===== MACHINE CONFIGURATION =====
     machine_path = "config/all_machines.json"
 
@@ -270,29 +588,65 @@ if __name__ == "__main__":
 
     machine_id = MACHINE_SPECS[machine_code]["machine_id"]
 
+    if SEED is not None:
+        random.seed(SEED)
+
     machine = Machine(machine_code, update_time)
+    if FAULT_SCENARIO:
+        machine.faults = FaultInjector.from_file(FAULT_SCENARIO, SEED)
+    uplinks = UplinkBuffer(BUFFER_CAPACITY, MAX_INFLIGHT, FLUSH_BATCH)
+    scheduler = FixedRateScheduler(update_time)
+    tracer = tracing.Tracer(f"machine {machine_code}", TRACE_SAMPLE_RATE, report_every=TRACE_REPORT_EVERY)
 
     # MQTT Client Setup
     client = mqtt.Client()
     client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_publish = on_publish
     client.on_message = on_message
+    client.max_inflight_messages_set(MAX_INFLIGHT)
 
     try:
-        client.connect(MQTT_BROKER_IP, MQTT_PORT, 60)
+        # Async connect: the simulator keeps sampling (and buffering) while the broker is down
+        client.connect_async(MQTT_BROKER_IP, MQTT_PORT, 60)
         client.loop_start()
 
-        print(f"[{datetime.now()}] Started {machine_code} ({machine_id}) simulator (Update every {update_time}s)")
+        print(f"[{datetime.now()}] Started {machine_code} ({machine_id}) simulator (Update every {update_time}s, {samples_per_uplink} sample(s) per uplink)")
         while True:
             if machine.is_operational:
+                trace = tracer.start("machine_tick")
                 machine.update_sensors()
-                payload = machine.generate_payload()
-                    
-                # Publish to MQTT
+                if machine.faults:
+                    machine.faults.advance(machine.update_time)
                 topic = f"v3/{group_id}@ttn/devices/{machine_id}/up"
-                client.publish(topic, json.dumps(payload))
-                print(f"[{datetime.now()}] Published update to {topic}")
-                
-            time.sleep(update_time)
+                if trace:
+                    tracer.hop(trace, "machine_uplink")
+
+                if summary_ticks and not machine.in_burst():
+                    # One sample per tick, both in the window and as the uplink's own reading
+                    sample = (machine.clock(), machine.reading())
+                    machine.window.add(*sample)
+                    if machine.window.count >= (machine.report_ticks or summary_ticks):
+                        summary = machine.window.summary()
+                        machine.window.reset()
+                        # Raw samples left over from a burst go out with the summary
+                        machine.samples.append(sample)
+                        for readings in transmit(machine.take_readings()):
+                            if uplinks.send(client, topic, machine, readings, summary, trace):
+                                print(f"[{datetime.now()}] Published summary to {topic}")
+
+                else:
+                    per_uplink = machine.report_ticks or samples_per_uplink
+                    # Pending samples are completed even if the cadence just dropped to 1
+                    if per_uplink > 1 or machine.samples:
+                        machine.record_sample()
+
+                    if len(machine.samples) == 0 or len(machine.samples) >= per_uplink:
+                        for readings in transmit(machine.take_readings()):
+                            if uplinks.send(client, topic, machine, readings, trace=trace):
+                                print(f"[{datetime.now()}] Published update to {topic}")
+
+            scheduler.wait()
 
     except KeyboardInterrupt:
         print("\nShutting down...")
@@ -1,56 +1,221 @@
+import startup
 import paho.mqtt.client as mqtt
 import json
+import os
+import socket
 import sys
+import threading
+import time
+import metrics
+import tracing
+import logger
+import profiler
+import partitioning
+import config_store
 from datetime import datetime
 
+class ReportingPolicy:
+    """Slows healthy machines' uplinks down and speeds up machines close to their limits
+
+    The period sets how often a machine uplinks, not how often it samples: the samples
+    in between travel together in multi-sample uplinks or summaries (see machine.py).
+    """
+
+    def __init__(self, healthy_ranges, fast_period, normal_period, slow_period, margin, healthy_streak):
+        self.ranges = config_store.range_vectors(healthy_ranges)   # unless evaluate() gets the current ones
+        self.fast_period = fast_period
+        self.normal_period = normal_period
+        self.slow_period = slow_period
+        self.margin = margin                    # fraction of the range counted as "near a limit"
+        self.healthy_streak = healthy_streak    # healthy readings needed before slowing down
+
+        self.periods = {}       # machine_id -> last period commanded
+        self.streaks = {}       # machine_id -> consecutive healthy readings
+
+    def _headroom(self, sensor_data, ranges):
+        """Smallest distance to a limit over all parameters, as a fraction of the range"""
+        headroom = 1.0
+        for param, low, high, ideal, width in ranges:
+            value = sensor_data.get(param)
+            if value is not None:
+                headroom = min(headroom, (value - low) / width, (high - value) / width)
+        return headroom
+
+    def evaluate(self, machine_id, sensor_data, ranges=None):
+        """Return the new reporting period for the machine, or None if it should not change"""
+        if self._headroom(sensor_data, ranges or self.ranges) < self.margin:
+            # Near or outside the limits: report fast right away
+            self.streaks[machine_id] = 0
+            period = self.fast_period
+        else:
+            streak = self.streaks.get(machine_id, 0) + 1
+            self.streaks[machine_id] = streak
+            period = self.slow_period if streak >= self.healthy_streak else self.normal_period
+            # Step down from fast one level at a time
+            if self.periods.get(machine_id) == self.fast_period and streak < self.healthy_streak:
+                period = self.normal_period
+
+        if self.periods.get(machine_id, self.normal_period) == period:
+            return None
+        self.periods[machine_id] = period
+        return period
+
 class MachineDataManager:
-    def __init__(self, group_id, intervals):
+    def __init__(self, group_id, intervals, reporting_policy=None, burst_duration=0,
+                 partitions=0, instance_id=None, heartbeat=2, snapshot_every=10, config=None):
         self.group_id = group_id
         self.mqtt_client = mqtt.Client()
         
-        # Healthy intervals configuration
-        self.healthy_ranges = intervals
+        # Healthy intervals, compiled to range vectors (config_store.py); a watched store
+        # (__main__, fused.py) swaps them when intervals.json changes
+        self.configs = config or config_store.ConfigStore({}, intervals, component="manager")
         
         # MQTT topics
         self.data_topic = f"{group_id}/internal/machine_data"
         self.control_topic = f"{group_id}/internal/control_commands"
+        self.rate_topic = f"{group_id}/internal/rate_commands"
+
+        # Adaptive reporting rate (optional)
+        self.reporting_policy = reporting_policy
+
+        # Raw burst requested from summary-mode machines when they leave their range (0 = off)
+        self.burst_duration = burst_duration
+        self.bursts = {}    # machine_id -> time the current burst ends
         
         # MQTT callbacks
         self.mqtt_client.on_connect = self._on_mqtt_connect
         self.mqtt_client.on_message = self._on_mqtt_message
+        self.subscribed = False
         
         # Alarm tracking
         self.alarm_history = {}
 
+        # Partitioned mode (partitions > 0): this instance evaluates the partitions the
+        # coordinator assigns it, see partitioning.py. Per-machine state (reporting
+        # periods, healthy streaks, bursts) moves with its partition through a retained
+        # snapshot on internal/partition_state/<p>, also refreshed every snapshot_every
+        # seconds so a crashed owner's successor starts from a recent copy.
+        self.partitions = partitions
+        self.state_topic = f"{group_id}/internal/partition_state"
+        self.snapshot_every = snapshot_every
+        self.state_lock = threading.Lock()     # evaluation vs. handover
+        self.coordinator = None
+        if partitions:
+            self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+            self.coordinator = partitioning.PartitionCoordinator(
+                self.mqtt_client, group_id, self.instance_id, partitions, heartbeat, self._on_partitions_changed)
+
+        # Metrics (served on /metrics when METRICS_PORT is set)
+        self.metrics = metrics.Registry("manager_")
+        self.m_messages = self.metrics.counter("messages", "Readings received from the agent")
+        self.m_errors = self.metrics.counter("message_errors", "Readings that failed processing")
+        self.m_decode = self.metrics.histogram("decode_seconds", "JSON decode latency")
+        self.m_evaluate = self.metrics.histogram("evaluate_seconds", "Range evaluation latency")
+        self.m_commands = self.metrics.counter("control_commands", "Control commands issued", ["param"])
+        self.m_rate_commands = self.metrics.counter("rate_commands", "Reporting period / burst requests", ["type"])
+        self.metrics.gauge("config_version", "Version of the config in use").set_function(
+            lambda: self.configs.current.version)
+        if partitions:
+            self.m_owned = self.metrics.gauge("owned_partitions", "Partitions evaluated by this instance")
+            self.m_owned.set_function(lambda: len(self.coordinator.owned))
+            self.m_handovers = self.metrics.counter("partition_handovers", "Partitions gained or lost", ["change"])
+            self.m_imported = self.metrics.counter("imported_machines", "Machine states taken over from a snapshot")
+            self.m_unowned = self.metrics.counter("unowned_readings", "Readings dropped for partitions not owned")
+
+        # Logging categories (see logger.setup in __main__)
+        self.log = logger.get("manager", "main")
+        self.log_payload = logger.get("manager", "payload")
+        self.log_message = logger.get("manager", "message")
+        self.log_command = logger.get("manager", "command")
+        self.log_error = logger.get("manager", "error")
+
+        # End-to-end tracing: hops of the traces started by the machines
+        self.tracer = tracing.Tracer("manager", report_every=TRACE_REPORT_EVERY)
+
+        # Runtime profiling hooks, idle until a capture is requested
+        self.profiler = profiler.StageProfiler("manager", {
+            "decode": (self, "_decode"),
+            "evaluate": (self, "_process_machine_data"),
+            "publish": (self.mqtt_client, "publish")
+        })
+
     def _on_mqtt_connect(self, client, userdata, flags, rc):
-        print(f"Connected to MQTT broker with result code {rc}")
+        self.log.info("Connected to MQTT broker with result code %s", rc)
+        if not self.subscribed:
+            self.subscribed = True
+            startup.mark("subscribe")
+            startup.report("receiving")
+        if self.coordinator:
+            client.message_callback_add(f"{self.state_topic}/+", self._on_partition_state)
+            # Partitions owned before a reconnect are subscribed again
+            for partition in self.coordinator.owned:
+                self._subscribe_partition(partition)
+            self.coordinator.on_connect()
+            self.log.info("Joined as %s, %s partitions", self.instance_id, self.partitions)
+            return
         self.mqtt_client.subscribe(self.data_topic)
-        print(f"Subscribed to topic: {self.data_topic}")
+        self.log.info("Subscribed to topic: %s", self.data_topic)
 
     def _on_mqtt_message(self, client, userdata, msg):
+        self.m_messages.inc()
         try:
-            payload = json.loads(msg.payload.decode())
-            print(f"Received data from DataManagerAgent:\n{payload}")
-            self._process_machine_data(payload)
+            if self.coordinator and int(msg.topic.rsplit("/", 1)[1]) not in self.coordinator.owned:
+                # Still in flight when the partition moved away, its new owner evaluates from here on
+                self.m_unowned.inc()
+                return
+            start = time.perf_counter()
+            payload = self._decode(msg.payload)
+            self.m_decode.observe(time.perf_counter() - start)
+            self.log_payload.debug("Received data from DataManagerAgent:\n%s", payload)
+            self._evaluate(payload)
         except Exception as e:
-            print(f"Error processing message: {e}")
+            self.m_errors.inc()
+            self.log_error.error("Error processing message: %s", e)
+
+    def _decode(self, data):
+        return json.loads(data.decode())
+
+    def _evaluate(self, payload):
+        start = time.perf_counter()
+        with self.state_lock:
+            self._process_machine_data(payload)
+        self.m_evaluate.observe(time.perf_counter() - start)
 
     def _process_machine_data(self, payload):
         """Analyze sensor data and send control commands if needed"""
+        config = self.configs.current
         machine_id = payload["machine_id"]
         sensor_data = payload["sensor_data"]
+
+        trace = payload.get("trace")
+        if trace:
+            self.tracer.hop(trace, "manager_in")
+            self.tracer.maybe_report()
         
-        print(f"Analyzing data from {machine_id}")
+        self.log_message.info("Analyzing data from %s", machine_id)
         
         # Check each parameter against healthy ranges
-        for param, value in sensor_data.items():
-            if param in self.healthy_ranges:
-                healthy = self.healthy_ranges[param]
+        out_of_range = False
+        for param, low, high, ideal, width in config.ranges:
+            value = sensor_data.get(param)
+            if value is None:
+                continue
                 
-                # Check if value is outside healthy range
-                if value < healthy["low"] or value > healthy["high"]:
-                    adjustment = self._calculate_adjustment(param, value, healthy)
-                    self._send_control_command(machine_id, param, adjustment)
+            # Check if value is outside healthy range
+            if value < low or value > high:
+                if trace and not out_of_range:
+                    self.tracer.hop(trace, "manager_command")
+                out_of_range = True
+                adjustment = self._calculate_adjustment(param, value, config.intervals[param])
+                self._send_control_command(machine_id, param, adjustment, trace, config.version)
+
+        if out_of_range and self.burst_duration:
+            self._request_burst(machine_id, config.version)
+
+        if self.reporting_policy:
+            period = self.reporting_policy.evaluate(machine_id, sensor_data, config.ranges)
+            if period is not None:
+                self._send_rate_command(machine_id, period, config.version)
 
     def _calculate_adjustment(self, param, current_value, healthy_range):
         """Returns adjustment value with protective bounds"""
@@ -68,25 +233,174 @@ class MachineDataManager:
         
         return max(bounds[0], min(adjustment, bounds[1]))
 
-    def _send_control_command(self, machine_id, param, adjustment):
+    def _send_control_command(self, machine_id, param, adjustment, trace=None, config_version=None):
         """Send control command to Data Manager Agent"""
         command = {
             "machine_id": machine_id,
             "modify_param": param,
             "adjustment": round(adjustment,2),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            "config_version": config_version
         }
+        if trace:
+            command["trace"] = trace
         
-        self.mqtt_client.publish(self.control_topic, json.dumps(command))
-        print(f"Sent control command to {machine_id}: {param} by {adjustment}")
+        self._publish_internal(self.control_topic, command)
+        self.m_commands.labels(param).inc()
+        self.log_command.info("Sent control command to %s: %s by %s", machine_id, param, adjustment)
+
+    def _send_rate_command(self, machine_id, period, config_version=None):
+        """Ask the Data Manager Agent to change a machine's reporting period"""
+        command = {
+            "machine_id": machine_id,
+            "report_period": period,
+            "timestamp": datetime.now().isoformat(),
+            "config_version": config_version
+        }
+
+        # Separate topic: AlertManager counts every control command as an alarm
+        self._publish_internal(self.rate_topic, command)
+        self.m_rate_commands.labels("report_period").inc()
+        self.log_command.info("Sent reporting period to %s: %ss", machine_id, period)
+
+    def _request_burst(self, machine_id, config_version=None):
+        """Ask for raw high-resolution readings, once per burst"""
+        now = datetime.now().timestamp()
+        if now < self.bursts.get(machine_id, 0):
+            return
+        self.bursts[machine_id] = now + self.burst_duration
+
+        command = {
+            "machine_id": machine_id,
+            "burst_duration": self.burst_duration,
+            "timestamp": datetime.now().isoformat(),
+            "config_version": config_version
+        }
+
+        self._publish_internal(self.rate_topic, command)
+        self.m_rate_commands.labels("burst_duration").inc()
+        self.log_command.info("Requested %ss raw burst from %s", self.burst_duration, machine_id)
+
+    def _publish_internal(self, topic, command):
+        """Command to the Data Manager Agent (replaced in fused mode)"""
+        self.mqtt_client.publish(topic, json.dumps(command))
+
+    # ===== PARTITION HANDOVER =====
+
+    def _subscribe_partition(self, partition):
+        # State first: the retained snapshot is imported before most readings arrive
+        self.mqtt_client.subscribe(f"{self.state_topic}/{partition}")
+        self.mqtt_client.subscribe(f"{self.data_topic}/{partition}")
+
+    def _on_partitions_changed(self, gained, lost):
+        for partition in sorted(lost):
+            self.mqtt_client.unsubscribe(f"{self.data_topic}/{partition}")
+            self.mqtt_client.unsubscribe(f"{self.state_topic}/{partition}")
+            with self.state_lock:
+                self._publish_state(partition)
+                self._drop_state(partition)
+            self.m_handovers.labels("lost").inc()
+        for partition in sorted(gained):
+            self._subscribe_partition(partition)
+            self.m_handovers.labels("gained").inc()
+        self.log.info("Partitions gained %s, lost %s, owning %s",
+                      sorted(gained), sorted(lost), len(self.coordinator.owned))
+
+    def _partition_machines(self, partition):
+        machines = set(self.bursts)
+        if self.reporting_policy:
+            machines.update(self.reporting_policy.periods, self.reporting_policy.streaks)
+        return [machine_id for machine_id in machines
+                if partitioning.partition_of(machine_id, self.partitions) == partition]
+
+    def export_state(self, partition):
+        """Per-machine state of one partition, JSON-ready"""
+        policy = self.reporting_policy
+        return {machine_id: {
+            "period": policy.periods.get(machine_id) if policy else None,
+            "streak": policy.streaks.get(machine_id) if policy else None,
+            "burst_until": self.bursts.get(machine_id)
+        } for machine_id in self._partition_machines(partition)}
+
+    def import_state(self, machines):
+        """Take over machines from a snapshot, keeps the ones already evaluated here"""
+        policy = self.reporting_policy
+        imported = 0
+        for machine_id, state in machines.items():
+            if machine_id in self.bursts or (policy and (machine_id in policy.periods or machine_id in policy.streaks)):
+                continue
+            if policy and state["period"] is not None:
+                policy.periods[machine_id] = state["period"]
+            if policy and state["streak"] is not None:
+                policy.streaks[machine_id] = state["streak"]
+            if state["burst_until"] is not None:
+                self.bursts[machine_id] = state["burst_until"]
+            imported += 1
+        return imported
+
+    def _drop_state(self, partition):
+        policy = self.reporting_policy
+        for machine_id in self._partition_machines(partition):
+            self.bursts.pop(machine_id, None)
+            if policy:
+                policy.periods.pop(machine_id, None)
+                policy.streaks.pop(machine_id, None)
+
+    def _publish_state(self, partition):
+        snapshot = {"owner": self.instance_id, "ts": time.time(), "machines": self.export_state(partition)}
+        self.mqtt_client.publish(f"{self.state_topic}/{partition}", json.dumps(snapshot), retain=True)
+
+    def _on_partition_state(self, client, userdata, msg):
+        try:
+            snapshot = json.loads(msg.payload.decode())
+            if snapshot["owner"] == self.instance_id:
+                return
+            with self.state_lock:
+                imported = self.import_state(snapshot["machines"])
+            self.m_imported.inc(imported)
+            self.log.info("Took over %s machines of partition %s from %s",
+                          imported, msg.topic.rsplit("/", 1)[1], snapshot["owner"])
+        except Exception as e:
+            self.log_error.error("Error importing partition state: %s", e)
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(self.snapshot_every)
+            for partition in list(self.coordinator.owned):
+                with self.state_lock:
+                    self._publish_state(partition)
 
     def run(self):
         """Start the manager"""
+        if METRICS_PORT:
+            metrics.start_http_server(self.metrics, METRICS_PORT)
+
+        # Profiling on demand: kill -USR1 (stage timers) / -USR2 (cProfile), or the UDP channel
+        self.profiler.install_signal_handlers(PROFILE_DURATION)
+        if PROFILE_CONTROL_PORT:
+            self.profiler.serve_control(PROFILE_CONTROL_PORT)
+        self.configs.start()
+        startup.mark("servers")
         self.mqtt_client.connect(MQTT_BROKER_IP, MQTT_PORT)
-        self.mqtt_client.loop_forever()
+        startup.mark("mqtt_connect")
+        if not self.coordinator:
+            self.mqtt_client.loop_forever()
+            return
+
+        # Partitioned: hand the partitions over on Ctrl+C instead of waiting for expiry
+        threading.Thread(target=self._snapshot_loop, daemon=True).start()
+        self.mqtt_client.loop_start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.coordinator.leave()
+            self.mqtt_client.disconnect()
+            self.mqtt_client.loop_stop()
 
 
 if __name__ == "__main__":
+    startup.begin()
 
     # ===== MACHINE CONFIGURATION =====
     intervals_path = "config/intervals.json"
@@ -104,5 +418,53 @@ if __name__ == "__main__":
     MQTT_PORT = 1883
     GROUP_ID = "19"
 
-    manager = MachineDataManager(GROUP_ID,INTERVALS)
+    # ===== METRICS CONFIG =====
+    METRICS_PORT = 9102     # local /metrics endpoint (None = off)
+
+    # ===== TRACING CONFIG =====
+    TRACE_REPORT_EVERY = 60     # seconds between p50/p99 reports of traced hops
+
+    # ===== PROFILING CONFIG =====
+    PROFILE_DURATION = 30           # seconds per capture started by signal
+    PROFILE_CONTROL_PORT = 9202     # local UDP control channel (None = off)
+
+    # ===== LOGGING CONFIG =====
+    logger.setup(
+        "manager",
+        level="INFO",
+        json_output=False,
+        levels={"payload": "WARNING"},                  # "DEBUG" prints every payload
+        sample_rates={"message": 0.01},                 # 1% of per-message lines
+        rate_limits={"message": 20, "command": 50, "error": 10}   # lines per second
+    )
+
+    # ===== ADAPTIVE REPORTING CONFIG =====
+    FAST_PERIOD = 1         # seconds, machines near/outside their limits
+    NORMAL_PERIOD = 5       # seconds, default machine.py update time
+    SLOW_PERIOD = 30        # seconds, machines healthy for a while
+    LIMIT_MARGIN = 0.1      # within 10% of the range from a limit = "near"
+    HEALTHY_STREAK = 10     # healthy readings before slowing down
+
+    # ===== EDGE SUMMARY CONFIG =====
+    BURST_DURATION = 60     # seconds of raw readings requested when a machine leaves its range
+
+    # ===== CONFIG RELOAD =====
+    CONFIG_RELOAD_SECONDS = 2   # how often intervals.json is checked for changes (None = never)
+
+    # ===== PARTITIONING CONFIG =====
+    # Run N instances with the same PARTITIONS (and MANAGER_PARTITIONS in the agent)
+    PARTITIONS = 0              # partitions of internal/machine_data (0 = unpartitioned, one instance)
+    INSTANCE_ID = sys.argv[1] if len(sys.argv) > 1 else None    # default hostname-pid
+    HEARTBEAT_SECONDS = 2       # membership heartbeat, dead instances expire after 3
+    SNAPSHOT_SECONDS = 10       # partition state snapshot period
+
+    policy = ReportingPolicy(INTERVALS, FAST_PERIOD, NORMAL_PERIOD, SLOW_PERIOD, LIMIT_MARGIN, HEALTHY_STREAK)
+
+    configs = config_store.ConfigStore({}, INTERVALS, intervals_path=intervals_path,
+                                       reload_every=CONFIG_RELOAD_SECONDS, component="manager")
+    startup.mark("config")
+
+    manager = MachineDataManager(GROUP_ID,INTERVALS,policy,BURST_DURATION,
+                                 PARTITIONS, INSTANCE_ID, HEARTBEAT_SECONDS, SNAPSHOT_SECONDS, configs)
+    startup.mark("init")
     manager.run()
\ No newline at end of file
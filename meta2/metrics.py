@@ -0,0 +1,168 @@
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds (10 us .. 5 s)
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Batch size buckets (points per InfluxDB write, samples per uplink, ...)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Hot path note: updates are plain attribute arithmetic without locks. Under the GIL a
+# lost increment needs two threads updating the same child at once, which we accept
+# for monitoring data in exchange for ~100 ns per call.
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name + "_total", labels, self.value
+
+class Gauge:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set_function(self, function):
+        """Read the value from function() at scrape time (queue lengths, cache sizes...)"""
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name, labels, self.function() if self.function else self.value
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield name + "_bucket", labels + (("le", repr(float(bound))),), cumulative
+        yield name + "_bucket", labels + (("le", "+Inf"),), self.count
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, self.count
+
+class Family:
+    """A metric with labels, children are created on first use and then cached"""
+
+    def __init__(self, name, help_text, kind, label_names, factory):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield from child.samples(self.name, tuple(zip(self.label_names, values)))
+
+class Registry:
+    """Holds the metrics of one component and renders the Prometheus text format"""
+
+    def __init__(self, prefix="", const_labels=()):
+        self.prefix = prefix
+        self.const_labels = tuple(const_labels)     # (name, value) pairs on every sample, e.g. the group
+        self.families = []
+
+    def _add(self, name, help_text, kind, labels, factory):
+        family = Family(self.prefix + name, help_text, kind, tuple(labels), factory)
+        self.families.append(family)
+        # Unlabelled metrics are used directly, without a labels() lookup
+        return family.labels() if not labels else family
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(name, help_text, "counter", labels, Counter)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(name, help_text, "gauge", labels, Gauge)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        return self._add(name, help_text, "histogram", labels, lambda: Histogram(buckets))
+
+    def exposition(self):
+        return exposition([self])
+
+def exposition(registries):
+    """Prometheus text format of several registries, a family shared by several
+       (agents of different groups) is rendered as one group of samples"""
+    families = {}
+    for registry in registries:
+        for family in registry.families:
+            families.setdefault(family.name, []).append((registry.const_labels, family))
+
+    lines = []
+    for name, members in families.items():
+        lines.append(f"# HELP {name} {members[0][1].help}")
+        lines.append(f"# TYPE {name} {members[0][1].kind}")
+        for const_labels, family in members:
+            for sample_name, labels, value in family.samples():
+                labels = const_labels + labels
+                if labels:
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{sample_name}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{sample_name} {value}")
+    return "\n".join(lines) + "\n"
+
+def start_http_server(registries, port, host="127.0.0.1"):
+    """Serve GET /metrics for one or more registries from a daemon thread"""
+    if isinstance(registries, Registry):
+        registries = [registries]
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = exposition(registries).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass    # scrapes would flood stdout
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,125 @@
+import bisect
+import json
+import threading
+import time
+import zlib
+
+# Partitioned MachineDataManager: readings of machine M go to
+# {group}/internal/machine_data/<partition_of(M)> and every partition is owned by one
+# of the running manager instances, so per-machine state lives in exactly one place.
+#
+# Machines map to a fixed number of partitions (crc32, the same in every process);
+# partitions map to instances on a consistent-hash ring with virtual nodes, so an
+# instance joining or leaving moves only ~1/N of the partitions.
+#
+# Membership goes through the broker: each instance keeps a retained heartbeat on
+# {group}/internal/managers/<instance_id>, cleared on a clean leave and by its last
+# will when it dies. Every instance sees the same members and computes the same
+# assignment, there is no coordinator. An instance that stops heartbeating for
+# EXPIRY_HEARTBEATS periods is dropped even if the broker missed its will.
+# Ownership changes are not fenced: for a moment around a rebalance two instances can
+# both evaluate a partition.
+
+EXPIRY_HEARTBEATS = 3
+
+def partition_of(machine_id, partitions):
+    return zlib.crc32(machine_id.encode()) % partitions
+
+class HashRing:
+    def __init__(self, members, vnodes=64):
+        self.points = sorted((zlib.crc32(f"{member}#{i}".encode()), member)
+                             for member in members for i in range(vnodes))
+        self.hashes = [h for h, _ in self.points]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        i = bisect.bisect(self.hashes, zlib.crc32(key.encode())) % len(self.points)
+        return self.points[i][1]
+
+def assign(partitions, members, vnodes=64):
+    """{partition: member} for the given live members"""
+    ring = HashRing(sorted(members), vnodes)
+    return {p: ring.owner(f"partition-{p}") for p in range(partitions)}
+
+class PartitionCoordinator:
+    """Heartbeats, member list and owned partitions of one instance, on_change(gained, lost) on rebalance"""
+
+    def __init__(self, client, group_id, instance_id, partitions, heartbeat, on_change):
+        self.instance_id = instance_id
+        self.partitions = partitions
+        self.heartbeat = heartbeat
+        self.on_change = on_change
+        self.members_topic = f"{group_id}/internal/managers"
+        self.own_topic = f"{self.members_topic}/{instance_id}"
+        self.members = {}       # instance_id -> last heartbeat (monotonic)
+        self.owned = set()
+        self.lock = threading.Lock()
+        self.rebalance_lock = threading.Lock()  # one on_change at a time, in order
+        self.running = False
+        self.settle_until = 0   # no assignment before the retained heartbeats are in
+        self.bind(client)
+
+    def bind(self, client):
+        """Use this client (before connect, the will is part of the connection)"""
+        self.client = client
+        # A dead instance's heartbeat is cleared by the broker
+        client.will_set(self.own_topic, b"", retain=True)
+        client.message_callback_add(f"{self.members_topic}/+", self._on_member)
+
+    def on_connect(self):
+        """Call from the client's on_connect (subscriptions do not survive a reconnect)"""
+        if not self.running:
+            self.running = True
+            self.settle_until = time.monotonic() + self.heartbeat
+            threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        self.client.subscribe(f"{self.members_topic}/+")
+        self._beat()
+
+    def leave(self):
+        """Clean shutdown: give up every partition, then clear the heartbeat"""
+        self.running = False
+        with self.rebalance_lock:
+            lost, self.owned = self.owned, set()
+            if lost:
+                self.on_change(set(), lost)
+        self.client.publish(self.own_topic, b"", retain=True)
+
+    def _beat(self):
+        self.client.publish(self.own_topic, json.dumps({"ts": time.time(), "heartbeat": self.heartbeat}),
+                            retain=True)
+        with self.lock:
+            self.members[self.instance_id] = time.monotonic()
+
+    def _on_member(self, client, userdata, msg):
+        instance_id = msg.topic.rsplit("/", 1)[1]
+        with self.lock:
+            if msg.payload:
+                self.members[instance_id] = time.monotonic()
+            else:
+                self.members.pop(instance_id, None)
+        self._rebalance()
+
+    def _heartbeat_loop(self):
+        while self.running:
+            time.sleep(self.heartbeat)
+            if not self.running:
+                return
+            self._beat()
+            expiry = time.monotonic() - EXPIRY_HEARTBEATS * self.heartbeat
+            with self.lock:
+                for instance_id in [m for m, seen in self.members.items() if seen < expiry]:
+                    del self.members[instance_id]
+            self._rebalance()
+
+    def _rebalance(self):
+        with self.rebalance_lock:
+            if not self.running or time.monotonic() < self.settle_until:
+                return
+            with self.lock:
+                members = set(self.members) | {self.instance_id}
+            owned = {p for p, member in assign(self.partitions, members).items() if member == self.instance_id}
+            gained, lost = owned - self.owned, self.owned - owned
+            self.owned = owned
+            if gained or lost:
+                self.on_change(gained, lost)
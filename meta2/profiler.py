@@ -0,0 +1,187 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+import logger
+
+# Stages are (object, attribute) pairs naming a callable, e.g. (agent, "_standardize_units").
+# While a capture runs, the attribute is shadowed on the instance by a measuring wrapper;
+# when it ends the instance attribute is removed again, so a disabled profiler adds no
+# code at all to the message path.
+
+class StageProfiler:
+    """Time-boxed stage timing or sampled cProfile captures, switched on at runtime"""
+
+    def __init__(self, component, stages, output_dir="profiles"):
+        self.component = component
+        self.stages = stages
+        self.output_dir = output_dir
+        self.log = logger.get(component, "profile")
+
+        self.lock = threading.Lock()
+        self.mode = None
+        self.saved = []
+        self.timer = None
+
+    # ===== CAPTURE CONTROL =====
+
+    def start(self, mode="timers", duration=30, sample_every=10):
+        """Begin a capture that stops by itself after duration seconds"""
+        with self.lock:
+            if self.mode:
+                self.log.warning("A %s capture is already running", self.mode)
+                return False
+
+            self.mode = mode
+            self.started_at = datetime.now()
+            self.timings = {name: [] for name in self.stages}
+            self.profile = cProfile.Profile() if mode == "cprofile" else None
+            self.profile_lock = threading.Lock()
+
+            for name, (owner, attribute) in self.stages.items():
+                original = getattr(owner, attribute)
+                self.saved.append((owner, attribute, attribute in vars(owner), original))
+                if mode == "cprofile":
+                    wrapper = self._sampling_wrapper(original, sample_every)
+                else:
+                    wrapper = self._timing_wrapper(name, original)
+                setattr(owner, attribute, wrapper)
+
+            self.timer = threading.Timer(duration, self.stop)
+            self.timer.daemon = True
+            self.timer.start()
+
+        self.log.info("%s capture started for %ss", mode, duration)
+        return True
+
+    def stop(self):
+        """Remove the wrappers and write the capture to disk, returns the file path"""
+        with self.lock:
+            if not self.mode:
+                return None
+            if self.timer:
+                self.timer.cancel()
+
+            try:
+                for owner, attribute, had_attribute, original in reversed(self.saved):
+                    if had_attribute:
+                        setattr(owner, attribute, original)
+                    else:
+                        delattr(owner, attribute)
+                path = self._write()
+            finally:
+                # A failed write must not leave the profiler stuck "already running"
+                self.mode = None
+                self.timer = None
+                self.saved = []
+
+        self.log.info("Capture written to %s", path)
+        return path
+
+    # ===== WRAPPERS =====
+
+    def _timing_wrapper(self, name, function):
+        durations = self.timings[name]
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                durations.append(perf_counter() - start)
+        return timed
+
+    def _sampling_wrapper(self, function, sample_every):
+        counter = [0]
+
+        def sampled(*args, **kwargs):
+            counter[0] += 1
+            # One profiled call at a time: cProfile is not meant to be shared by threads
+            if counter[0] % sample_every == 0 and self.profile_lock.acquire(blocking=False):
+                try:
+                    return self.profile.runcall(function, *args, **kwargs)
+                finally:
+                    self.profile_lock.release()
+            return function(*args, **kwargs)
+        return sampled
+
+    # ===== OUTPUT =====
+
+    def _write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = self.started_at.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.output_dir, f"{self.component}-{self.mode}-{stamp}")
+
+        if self.mode == "cprofile":
+            self.profile.dump_stats(base + ".pstats")
+            text = io.StringIO()
+            self.profile.create_stats()
+            if self.profile.stats:
+                pstats.Stats(self.profile, stream=text).sort_stats("cumulative").print_stats(30)
+            else:
+                # pstats refuses an empty profile: no call was sampled during the capture
+                text.write("No sampled calls during the capture\n")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+            return base + ".pstats"
+
+        report = {"component": self.component, "started_at": self.started_at.isoformat(),
+                  "ended_at": datetime.now().isoformat(), "stages": {}}
+        for name, durations in self.timings.items():
+            ordered = sorted(durations)
+            count = len(ordered)
+            report["stages"][name] = {
+                "calls": count,
+                "total_s": sum(ordered),
+                "p50_us": ordered[int(0.50 * (count - 1))] * 1e6 if count else None,
+                "p99_us": ordered[int(0.99 * (count - 1))] * 1e6 if count else None,
+                "max_us": ordered[-1] * 1e6 if count else None
+            }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        return base + ".json"
+
+    # ===== CONTROL CHANNELS =====
+
+    def install_signal_handlers(self, duration=30):
+        """SIGUSR1 = stage timers, SIGUSR2 = sampled cProfile (main thread only)"""
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self._start_async("timers", duration))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self._start_async("cprofile", duration))
+
+    def _start_async(self, mode, duration, sample_every=10):
+        # Signal handlers must not block on self.lock held by the interrupted thread
+        threading.Thread(target=self.start, args=(mode, duration, sample_every), daemon=True).start()
+
+    def serve_control(self, port, host="127.0.0.1"):
+        """Local UDP control channel: "timers <seconds>", "cprofile <seconds> [sample_every]", "stop" """
+        def listen():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((host, port))
+            while True:
+                data, _ = sock.recvfrom(256)
+                parts = data.decode(errors="replace").split()
+                if not parts:
+                    continue
+                if parts[0] == "stop":
+                    self.stop()
+                elif parts[0] in ("timers", "cprofile"):
+                    # A malformed command is logged and ignored, the channel stays up
+                    try:
+                        duration = float(parts[1]) if len(parts) > 1 else 30
+                        sample_every = int(parts[2]) if len(parts) > 2 else 10
+                        if duration <= 0 or sample_every < 1:
+                            raise ValueError("duration must be > 0 and sample_every >= 1")
+                    except ValueError as e:
+                        self.log.warning("Ignored profiling command %r: %s", " ".join(parts), e)
+                        continue
+                    self.start(parts[0], duration, sample_every)
+
+        threading.Thread(target=listen, daemon=True).start()
+        self.log.info("Profiling control channel on udp://%s:%s", host, port)
@@ -0,0 +1,182 @@
+import math
+import threading
+
+# Streaming quantiles for "p95 coolant_temp of M3 over the last hour" without scanning
+# InfluxDB. Each value goes into a DDSketch: logarithmic bins with relative accuracy
+# ALPHA (a reported p95 of 100 degrees is within 1% of the true p95), mergeable by
+# adding bin counts. Negative values (none today, but standardization may change) get
+# mirrored bins. Bins per sketch are capped at MAX_BINS, beyond which the lowest bins
+# are collapsed (only extreme low quantiles lose accuracy), so memory is fixed: at most
+# SLICES x len(FIELDS) x MAX_BINS counters per machine.
+#
+# Rolling windows are rings of SLICES sketches, each covering window / SLICES seconds;
+# a query merges the slices that overlap the requested window. Sketches are kept per
+# machine, per machine type and for the fleet: a reading updates all three, so group
+# queries merge SLICES sketches instead of every machine's. Ad-hoc groups of machines
+# are merged on demand with merged().
+
+ALPHA = 0.01
+MAX_BINS = 128
+WINDOW_SECONDS = 3600
+SLICES = 12
+FIELDS = ("rpm", "coolant_temp", "oil_pressure", "battery_potential", "consumption")
+
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+INV_LOG_GAMMA = 1 / math.log(GAMMA)
+MIN_VALUE = 1e-9    # |values| below this count as zero
+KEY_OFFSET = 1 << 20
+
+def bin_key(value):
+    """Sortable bin key: positive bins above 0, zero at 0, negative bins below"""
+    if value > MIN_VALUE:
+        return KEY_OFFSET + math.ceil(math.log(value) * INV_LOG_GAMMA)
+    if value < -MIN_VALUE:
+        return -KEY_OFFSET - math.ceil(math.log(-value) * INV_LOG_GAMMA)
+    return 0
+
+def key_value(key):
+    """Representative value of a bin, within ALPHA of every value in it"""
+    if key > 0:
+        return 2 * GAMMA ** (key - KEY_OFFSET) / (GAMMA + 1)
+    if key < 0:
+        return -2 * GAMMA ** (-key - KEY_OFFSET) / (GAMMA + 1)
+    return 0.0
+
+class DDSketch:
+    __slots__ = ("bins", "count")
+
+    def __init__(self):
+        self.bins = {}      # bin key -> count
+        self.count = 0
+
+    def add(self, value):
+        self.add_key(bin_key(value))
+
+    def add_key(self, key):
+        self.count += 1
+        bins = self.bins
+        if key in bins:
+            bins[key] += 1
+        else:
+            bins[key] = 1
+            if len(bins) > MAX_BINS:
+                self._collapse()
+
+    def merge(self, other):
+        bins = self.bins
+        for key, n in other.bins.items():
+            bins[key] = bins.get(key, 0) + n
+        self.count += other.count
+        if len(bins) > MAX_BINS:
+            self._collapse()
+
+    def _collapse(self):
+        # Fold the lowest bins into the lowest one kept
+        ordered = sorted(self.bins)
+        excess = len(ordered) - MAX_BINS
+        folded = sum(self.bins.pop(key) for key in ordered[:excess])
+        self.bins[ordered[excess]] += folded
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return key_value(key)
+        return key_value(max(self.bins))
+
+class RollingSketches:
+    """Per-field sketches over a rolling window, as a ring of time slices"""
+    __slots__ = ("slice_ids", "slices")
+
+    def __init__(self):
+        self.slice_ids = [-1] * SLICES
+        self.slices = [None] * SLICES
+
+    def add(self, ts, keys):
+        """keys: (field index, bin key) of each field present in the reading"""
+        slice_id = int(ts // (WINDOW_SECONDS / SLICES))
+        position = slice_id % SLICES
+        current = self.slice_ids[position]
+        if current != slice_id:
+            if slice_id < current:
+                return      # older than the whole window
+            self.slice_ids[position] = slice_id
+            self.slices[position] = [DDSketch() for _ in FIELDS]
+        sketches = self.slices[position]
+        for i, key in keys:
+            # DDSketch.add_key inlined, this runs three times per field of every reading
+            sketch = sketches[i]
+            sketch.count += 1
+            bins = sketch.bins
+            if key in bins:
+                bins[key] += 1
+            else:
+                bins[key] = 1
+                if len(bins) > MAX_BINS:
+                    sketch._collapse()
+
+    def merge_into(self, target, field, now, window):
+        """Add the slices overlapping [now - window, now] to the target sketch"""
+        i = FIELDS.index(field)
+        slice_seconds = WINDOW_SECONDS / SLICES
+        newest = int(now // slice_seconds)
+        oldest = newest - min(SLICES, math.ceil(window / slice_seconds)) + 1
+        for slice_id, sketches in zip(self.slice_ids, self.slices):
+            if oldest <= slice_id <= newest:
+                target.merge(sketches[i])
+        return target
+
+class FleetSketches:
+    def __init__(self):
+        self.machines = {}      # machine_id -> RollingSketches
+        self.types = {}         # machine type -> RollingSketches
+        self.fleet = RollingSketches()
+        self.lock = threading.Lock()
+
+    def add(self, machine_id, ts, sensor_data):
+        """Record one standardized reading (machine_type included) taken at ts"""
+        machine_type = sensor_data["machine_type"]
+        # Bin keys are computed once and shared by the machine, type and fleet sketches
+        keys = []
+        for i, field in enumerate(FIELDS):
+            value = sensor_data.get(field)
+            if value is not None and value == value:
+                keys.append((i, bin_key(value)))
+        with self.lock:
+            machine = self.machines.get(machine_id)
+            if machine is None:
+                machine = self.machines[machine_id] = RollingSketches()
+            group = self.types.get(machine_type)
+            if group is None:
+                group = self.types[machine_type] = RollingSketches()
+            machine.add(ts, keys)
+            group.add(ts, keys)
+            self.fleet.add(ts, keys)
+
+    def quantiles(self, field, qs, now, window=WINDOW_SECONDS, machine_id=None, machine_type=None):
+        """{q: value} for one machine, one machine type or (neither given) the whole fleet"""
+        if machine_id is not None:
+            source = self.machines.get(machine_id)
+        elif machine_type is not None:
+            source = self.types.get(machine_type)
+        else:
+            source = self.fleet
+        if source is None:
+            return None
+        with self.lock:
+            sketch = source.merge_into(DDSketch(), field, now, window)
+        return {q: sketch.quantile(q) for q in qs}
+
+    def merged(self, machine_ids, field, qs, now, window=WINDOW_SECONDS):
+        """Quantiles over an arbitrary group of machines"""
+        sketch = DDSketch()
+        with self.lock:
+            for machine_id in machine_ids:
+                machine = self.machines.get(machine_id)
+                if machine is not None:
+                    machine.merge_into(sketch, field, now, window)
+        return {q: sketch.quantile(q) for q in qs}
@@ -0,0 +1,50 @@
+import os
+import sys
+import threading
+import time
+
+# Startup-time breakdown of a component process, printed when it starts receiving.
+#
+# Import this module first: STARTED is taken at its import, so the "imports" stage
+# marked by begin() covers the script's own imports. Stages run one after the other
+# on the main thread are timed from the previous mark; a stage on another thread
+# (the agent's deferred InfluxDB client) passes its own start instead. report() prints
+# the stages marked since the previous report. Nothing is recorded unless the
+# script's __main__ called begin(), so components built by the benchmarks stay quiet.
+
+STARTED = time.perf_counter()
+
+_tracking = False
+_stages = []
+_last = STARTED
+_lock = threading.Lock()
+
+def begin():
+    """Start tracking (from a script's __main__), marks the imports"""
+    global _tracking
+    _tracking = True
+    mark("imports")
+
+def mark(stage, since=None):
+    """End of a stage: time since the previous mark, or since `since` (perf_counter)"""
+    global _last
+    if not _tracking:
+        return
+    now = time.perf_counter()
+    with _lock:
+        _stages.append((stage, now - (_last if since is None else since)))
+        if since is None:
+            _last = now
+
+def report(what):
+    """Print the stages marked since the last report and the time since the start"""
+    if not _tracking:
+        return
+    with _lock:
+        stages = list(_stages)
+        _stages.clear()
+    if not stages:
+        return
+    total = time.perf_counter() - STARTED
+    breakdown = ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in stages)
+    print(f"[{os.path.basename(sys.argv[0])}] {what} after {total * 1000:.0f} ms: {breakdown}")
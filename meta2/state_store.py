@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+from array import array
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from paho.mqtt.client import topic_matches_sub
+
+import sketches
+
+# Latest value and recent history of every machine, in standardized units, kept by the
+# agent so "current state of M5" does not need an InfluxDB query.
+#
+# History is a fixed-size ring per machine: one float32 array per field plus a float64
+# array of timestamps (epoch seconds), allocated on the machine's first reading. A
+# reading costs 4 bytes per field + 8, i.e. 36 bytes with the 7 fields below:
+# 10k machines x 720 readings (1 h at the default 5 s period) is about 260 MB.
+# Readings are kept in arrival order; backfilled ones may be older than their
+# neighbours, which is why queries filter on the timestamp instead of slicing.
+
+FIELDS = ("rpm", "coolant_temp", "oil_pressure", "battery_potential", "consumption", "rssi", "snr")
+NAN = float("nan")
+
+class MachineHistory:
+    __slots__ = ("columns", "ts", "next", "count")
+
+    def __init__(self, capacity):
+        self.columns = [array("f", bytes(4 * capacity)) for _ in FIELDS]
+        self.ts = array("d", bytes(8 * capacity))
+        self.next = 0
+        self.count = 0
+
+    def add(self, ts, values, capacity):
+        i = self.next
+        self.ts[i] = ts
+        for column, value in zip(self.columns, values):
+            column[i] = value
+        self.next = (i + 1) % capacity
+        if self.count < capacity:
+            self.count += 1
+
+def _public(latest):
+    """Copy of a latest reading, NaN (field missing from the source) as None like window()"""
+    return {key: None if value != value else value for key, value in latest.items()}
+
+class StateStore:
+    def __init__(self, capacity=720, sketches=None):
+        self.capacity = capacity
+        self.sketches = sketches    # sketches.FleetSketches fed with every reading, optional
+        self.latest = {}        # machine_id -> {"ts", "machine_type", field: value...}
+        self.history = {}       # machine_id -> MachineHistory
+        self.lock = threading.Lock()
+
+    def add(self, machine_id, ts, sensor_data, comm_data):
+        """Record one standardized reading taken at ts (epoch seconds)"""
+        values = []
+        for field in FIELDS:
+            value = sensor_data.get(field)
+            if value is None:
+                value = comm_data.get(field)
+            values.append(NAN if value is None else value)
+        with self.lock:
+            history = self.history.get(machine_id)
+            if history is None:
+                history = self.history[machine_id] = MachineHistory(self.capacity)
+            history.add(ts, values, self.capacity)
+
+            latest = self.latest.get(machine_id)
+            if latest is None or ts >= latest["ts"]:
+                self.latest[machine_id] = dict(zip(FIELDS, values), ts=ts, machine_type=sensor_data["machine_type"])
+        if self.sketches is not None:
+            self.sketches.add(machine_id, ts, sensor_data)
+
+    # ===== QUERIES =====
+
+    def machines(self, machine_type=None):
+        with self.lock:
+            return {machine_id: latest["ts"] for machine_id, latest in self.latest.items()
+                    if machine_type is None or latest["machine_type"] == machine_type}
+
+    def get_latest(self, machine_id=None, machine_type=None):
+        """Latest reading of one machine, or of every machine (of a type)"""
+        with self.lock:
+            if machine_id is not None:
+                latest = self.latest.get(machine_id)
+                return _public(latest) if latest else None
+            return {m: _public(latest) for m, latest in self.latest.items()
+                    if machine_type is None or latest["machine_type"] == machine_type}
+
+    def window(self, machine_id, since=None, until=None, fields=FIELDS):
+        """Columns {"ts": [...], field: [...]} of the readings with since <= ts <= until, oldest first"""
+        indexes = [FIELDS.index(field) for field in fields]
+        with self.lock:
+            history = self.history.get(machine_id)
+            if history is None:
+                return None
+            # Copy the rings oldest first (C-level slicing), filter outside the lock
+            if history.count < self.capacity:
+                ts = history.ts[:history.count]
+                columns = [history.columns[i][:history.count] for i in indexes]
+            else:
+                cut = history.next
+                ts = history.ts[cut:] + history.ts[:cut]
+                columns = [history.columns[i][cut:] + history.columns[i][:cut] for i in indexes]
+
+        selected = [k for k, t in enumerate(ts) if (since is None or t >= since) and (until is None or t <= until)]
+        selected.sort(key=ts.__getitem__)   # already in order unless backfill arrived
+        result = {"ts": [ts[k] for k in selected]}
+        for field, column in zip(fields, columns):
+            # NaN (field missing from the source) is not valid JSON
+            result[field] = [round(column[k], 4) if column[k] == column[k] else None for k in selected]
+        return result
+
+    def memory_bytes(self):
+        """Bytes held by the history rings"""
+        return len(self.history) * self.capacity * (4 * len(FIELDS) + 8)
+
+# ===== WARM-UP =====
+
+def warm_from_influx(store, influx_client, seconds, group_id):
+    """Load the last seconds of the group's machine_data points, returns the number of readings"""
+    # Groups may share a bucket, only the points tagged with this group are loaded
+    group = str(group_id).replace("'", "''")
+    query = ("SELECT time, machine_id, machine_type, rpm, coolant_temp, oil_pressure, battery_potential, "
+             f"consumption, rssi, snr FROM machine_data WHERE time >= now() - INTERVAL '{int(seconds)} seconds' "
+             f"AND group_id = '{group}' ORDER BY time")
+    rows = influx_client.query(query=query, language="sql").to_pylist()
+    for row in rows:
+        ts = row["time"]
+        if isinstance(ts, datetime):
+            # The agent writes naive local wall times (datetime.now().isoformat(), machine.py's
+            # received_at) and InfluxDB stores them as if they were UTC. What comes back, with or
+            # without tzinfo, is the agent host's local wall time, converted in its timezone here
+            ts = ts.replace(tzinfo=None).timestamp()
+        store.add(row["machine_id"], ts, row, row)
+    return len(rows)
+
+def warm_from_traffic_log(store, reader, seconds, standardize, group_id):
+    """Replay the uplinks of the last seconds of a traffic log (traffic_log.py) into the store"""
+    end_ns = time.time_ns()
+    count = 0
+    for ts_ns, _, topic, payload in reader.records(start_ns=end_ns - int(seconds * 1e9)):
+        if not topic_matches_sub(f"v3/{group_id}@ttn/devices/+/up", topic):
+            continue
+        data = json.loads(payload)
+        machine_id = data["end_device_ids"]["machine_id"]
+        sensor_data = data["uplink_message"]["decoded_payload"]
+        store.add(machine_id, ts_ns / 1e9, standardize(machine_id, sensor_data),
+                  data["uplink_message"]["rx_metadata"][0])
+        count += 1
+    return count
+
+# ===== HTTP API =====
+
+def _quantiles(fleet_sketches, query):
+    field = query.get("field")
+    if field not in sketches.FIELDS:
+        raise ValueError(f"field must be among {', '.join(sketches.FIELDS)}")
+    qs = [float(q) for q in query.get("q", "0.5,0.95,0.99").split(",")]
+    if any(not 0 <= q <= 1 for q in qs):
+        raise ValueError("q must be between 0 and 1")
+    window = float(query.get("window", sketches.WINDOW_SECONDS))
+    now = time.time()
+    if "machines" in query:
+        result = fleet_sketches.merged(query["machines"].split(","), field, qs, now, window)
+    else:
+        result = fleet_sketches.quantiles(field, qs, now, window, query.get("machine"), query.get("type"))
+    if result is None:
+        return None
+    return {str(q): None if value is None else round(value, 4) for q, value in result.items()}
+
+def start_http_server(store, port, host="127.0.0.1", routes=None):
+    """Serve the store as JSON from a daemon thread, plus routes {"name": handler(query) -> body}
+       for other local indexes on /name:
+       GET /machines[?type=C89Z]                                  machine_id -> latest timestamp
+       GET /latest[?type=C89Z]                                    latest reading of every machine
+       GET /machines/<id>/latest                                  latest reading of one machine
+       GET /machines/<id>/history?window=300[&fields=rpm,snr]     readings of the last 300 s
+       GET /machines/<id>/history?since=<epoch>&until=<epoch>     readings in a time range
+       GET /quantiles?field=coolant_temp&q=0.5,0.95[&window=3600]  fleet-wide quantiles
+           [&machine=M3 | &type=C89Z | &machines=M1-0,M1-1]        of one machine, type or group
+    """
+    class StateHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            parts = url.path.strip("/").split("/")
+            try:
+                if parts == ["machines"]:
+                    body = store.machines(query.get("type"))
+                elif parts == ["latest"]:
+                    body = store.get_latest(machine_type=query.get("type"))
+                elif len(parts) == 3 and parts[0] == "machines" and parts[2] == "latest":
+                    body = store.get_latest(parts[1])
+                elif len(parts) == 3 and parts[0] == "machines" and parts[2] == "history":
+                    since = float(query["since"]) if "since" in query else None
+                    until = float(query["until"]) if "until" in query else None
+                    if "window" in query:
+                        since = time.time() - float(query["window"])
+                    fields = tuple(query["fields"].split(",")) if "fields" in query else FIELDS
+                    if any(field not in FIELDS for field in fields):
+                        self.send_error(400, f"fields must be among {', '.join(FIELDS)}")
+                        return
+                    body = store.window(parts[1], since, until, fields)
+                elif parts == ["quantiles"] and store.sketches is not None:
+                    body = _quantiles(store.sketches, query)
+                elif len(parts) == 1 and routes and parts[0] in routes:
+                    body = routes[parts[0]](query)
+                else:
+                    self.send_error(404)
+                    return
+            except ValueError as e:
+                self.send_error(400, str(e) or None)
+                return
+
+            if body is None:
+                self.send_error(404, "Unknown machine")
+                return
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), StateHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Machine state available on http://{host}:{port}/machines")
+    return server
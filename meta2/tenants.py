@@ -0,0 +1,341 @@
+import startup
+import json
+import queue
+import socket
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import config_store
+import data_manager_agent
+import logger
+import metrics
+import state_store
+from fused import configure
+
+# Multi-tenant agent: one process serves the Data Manager Agent of many groups (sites).
+#
+# Each group gets its own DataManagerAgent (state, dedup, quarantine, health ranking,
+# metrics labelled group=<id>), but they share one MQTT connection, one UDP listener
+# for the alert managers, and whatever the group configs have in common: groups naming
+# the same specs and intervals files share one config store (loaded, compiled and
+# watched once, see config_store.py), groups writing to the same InfluxDB target share
+# one client. The clients are created off-thread once the groups are subscribed, each
+# agent holds its messages until then (see DataManagerAgent.attach_influx).
+#
+# Routing never scans the groups: internal topics are looked up in a dict built at
+# startup, uplink topics (v3/<group>@ttn/devices/<device>/up) are split once and their
+# "<group>@ttn" segment looked up in another. The MQTT thread does only that, then
+# hands the message to the group's bounded inbox, consumed by the group's own worker
+# thread. A noisy site can therefore only fill its own inbox: uplinks over its rate
+# limit, and any message that finds its inbox full, are dropped and counted per group
+# while the other groups keep their share.
+
+class TopicRouter:
+    """Group, kind and device of a topic from precompiled lookups"""
+
+    def __init__(self):
+        self.exact = {}     # internal topic -> (tenant, kind)
+        self.uplinks = {}   # "<group>@ttn" -> tenant
+
+    def add(self, tenant):
+        agent = tenant.agent
+        for topic, kind in agent.routes.items():
+            self.exact[topic] = (tenant, kind)
+        self.uplinks[f"{tenant.group_id}@ttn"] = tenant
+
+    def route(self, topic):
+        """(tenant, kind, device_id or None), None for a topic of no served group"""
+        route = self.exact.get(topic)
+        if route is not None:
+            return route[0], route[1], None
+        parts = topic.split("/")
+        if len(parts) == 5 and parts[4] == "up":
+            tenant = self.uplinks.get(parts[1])
+            if tenant is not None:
+                return tenant, "up", parts[3]
+        return None
+
+class TokenBucket:
+    """rate tokens per second, at most burst saved (used from one thread only)"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class Tenant:
+    """One group: its agent, bounded inbox, uplink rate limit and worker thread"""
+
+    def __init__(self, group_id, agent, queue_size, uplinks_per_second, state_port=None):
+        self.group_id = group_id
+        self.agent = agent
+        self.inbox = queue.Queue(queue_size)
+        self.bucket = TokenBucket(uplinks_per_second, uplinks_per_second) if uplinks_per_second else None
+        self.state_port = state_port
+
+class SharedConfig:
+    """Config stores and InfluxDB clients created once, shared by every group naming them"""
+
+    def __init__(self, reload_every):
+        self.reload_every = reload_every
+        self.stores = {}            # (specs path, intervals path) -> config_store.ConfigStore
+        self.influx_clients = {}    # (url, token, org, bucket) -> client
+
+    def config(self, specs_path, intervals_path):
+        key = (specs_path, intervals_path)
+        if key not in self.stores:
+            loaded = []
+            for path in key:
+                with open(path, "r", encoding="utf-8") as f:
+                    loaded.append(json.load(f))
+            self.stores[key] = config_store.ConfigStore(
+                loaded[0], loaded[1], data_manager_agent.PARAM_MAP, data_manager_agent.REASON_MAP,
+                specs_path, intervals_path, self.reload_every)
+        return self.stores[key]
+
+    def influx(self, target):
+        """Client of an InfluxDB target (after data_manager_agent.import_influx())"""
+        key = (target["url"], target["token"], target["org"], target["bucket"])
+        if key not in self.influx_clients:
+            self.influx_clients[key] = data_manager_agent.InfluxDBClient3(host=key[0], token=key[1], database=key[3], org=key[2])
+        return self.influx_clients[key]
+
+class MultiTenantAgent:
+    def __init__(self, groups, defaults, reload_every=2):
+        self.mqtt_client = mqtt.Client()
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.shared = SharedConfig(reload_every)
+        self.router = TopicRouter()
+        self.tenants = {}
+        self.influx_targets = {}    # group -> InfluxDB target, clients created once subscribed
+        self.subscribed = False
+
+        self.metrics = metrics.Registry("tenant_")
+        self.m_dropped = self.metrics.counter("dropped", "Messages dropped by a group's limits", ["group", "reason"])
+        self.m_unrouted = self.metrics.counter("unrouted", "Messages for no served group")
+        queued = self.metrics.gauge("queued", "Messages waiting in a group's inbox", ["group"])
+
+        self.log = logger.get("agent", "main")
+        self.log_error = logger.get("agent", "error")
+
+        for group_id, config in groups.items():
+            config = dict(defaults, **config)
+            agent = data_manager_agent.DataManagerAgent(
+                group_id, self.shared.config(config["specs"], config["intervals"]), mqtt_client=self.mqtt_client)
+            self.influx_targets[group_id] = config["influx"]
+            agent.standalone = False
+            agent.metrics.const_labels = (("group", group_id),)
+            tenant = Tenant(group_id, agent, config["queue_size"], config["uplinks_per_second"],
+                            config.get("state_port"))
+            self.tenants[group_id] = tenant
+            self.router.add(tenant)
+            queued.labels(group_id).set_function(tenant.inbox.qsize)
+
+        # The agents set their own callbacks on the shared client, the router replaces them
+        self.mqtt_client.on_connect = self._on_mqtt_connect
+        self.mqtt_client.on_message = self._on_mqtt_message
+
+    def _on_mqtt_connect(self, client, userdata, flags, rc):
+        self.log.info("Connected to MQTT broker with result code %s", rc)
+        topics = []
+        for group_id, tenant in self.tenants.items():
+            topics.append((f"v3/{group_id}@ttn/devices/+/up", 0))
+            topics.extend((topic, 0) for topic in tenant.agent.routes)
+        client.subscribe(topics)
+        self.log.info("Subscribed to %s topics for %s groups", len(topics), len(self.tenants))
+
+        if not self.subscribed:
+            self.subscribed = True
+            startup.mark("subscribe")
+            startup.report("receiving")
+            threading.Thread(target=self._init_influx, daemon=True).start()
+
+    def _init_influx(self):
+        """InfluxDB clients created off the MQTT thread; each agent holds its messages until then"""
+        start = time.perf_counter()
+        try:
+            data_manager_agent.import_influx()
+            startup.mark("influx_import", start)
+            start = time.perf_counter()
+            clients = {group_id: self.shared.influx(target) for group_id, target in self.influx_targets.items()}
+            startup.mark("influx_clients", start)
+        except Exception as e:
+            self.log_error.error("Could not create the InfluxDB clients: %s", e)
+            return
+        start = time.perf_counter()
+        replayed = sum(self.tenants[group_id].agent.attach_influx(client) for group_id, client in clients.items())
+        startup.mark(f"replay of {replayed} held messages", start)
+        startup.report("storing")
+
+    def _on_mqtt_message(self, client, userdata, msg):
+        route = self.router.route(msg.topic)
+        if route is None:
+            self.m_unrouted.inc()
+            return
+        tenant, kind, device_id = route
+        if kind == "up" and tenant.bucket and not tenant.bucket.take(time.monotonic()):
+            self.m_dropped.labels(tenant.group_id, "rate").inc()
+            return
+        self._enqueue(tenant, (kind, msg, device_id))
+
+    def _enqueue(self, tenant, item):
+        try:
+            tenant.inbox.put_nowait(item)
+        except queue.Full:
+            self.m_dropped.labels(tenant.group_id, "queue").inc()
+
+    def _work(self, tenant):
+        """Worker of one group, runs its agent on the messages of its inbox"""
+        agent = tenant.agent
+        while True:
+            kind, message, device_id = tenant.inbox.get()
+            if kind != "udp_alert":
+                agent._handle_message(kind, message, device_id)
+                continue
+            agent.m_messages.labels(kind).inc()
+            if agent.influx_ready.is_set() or not agent._hold(kind, message):
+                agent._process(kind, message)
+
+    def _tenant_of_alert(self, alert):
+        tenant = self.tenants.get(alert.get("group_id"))
+        if tenant is None:
+            # Alert managers from before group_id was sent: the group that knows the machine
+            for candidate in self.tenants.values():
+                if alert["machine_id"] in candidate.agent.machine_types:
+                    return candidate
+        return tenant
+
+    def _handle_udp_alerts(self):
+        """One UDP listener for the alert managers of every group"""
+        self.udp_socket.settimeout(1.0)
+        self.udp_socket.bind((UDP_IP, UDP_PORT))
+        self.log.info("UDP listener started on port %s", UDP_PORT)
+
+        while True:
+            try:
+                data, addr = self.udp_socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            try:
+                alert = json.loads(data.decode())
+                tenant = self._tenant_of_alert(alert)
+                if tenant is None:
+                    self.m_unrouted.inc()
+                    continue
+                self._enqueue(tenant, ("udp_alert", alert, None))
+            except Exception as e:
+                self.log_error.error("Error routing UDP alert: %s", e)
+
+    def run(self):
+        """Start the agent of every group (blocks)"""
+        if METRICS_PORT:
+            metrics.start_http_server([self.metrics] + [t.agent.metrics for t in self.tenants.values()],
+                                      METRICS_PORT)
+        for store in self.shared.stores.values():
+            store.start()
+        for tenant in self.tenants.values():
+            if tenant.state_port:
+                state_store.start_http_server(tenant.agent.state, tenant.state_port,
+                                              routes=tenant.agent.state_routes())
+            if data_manager_agent.STATE_WARM_SECONDS:
+                threading.Thread(target=tenant.agent._warm_state, daemon=True).start()
+            threading.Thread(target=self._work, args=(tenant,), daemon=True).start()
+        startup.mark("servers")
+
+        threading.Thread(target=self._handle_udp_alerts, daemon=True).start()
+        self.mqtt_client.connect(MQTT_BROKER_IP, MQTT_PORT)
+        startup.mark("mqtt_connect")
+        self.mqtt_client.loop_forever()
+
+if __name__ == "__main__":
+    startup.begin()
+
+    # ===== GROUPS CONFIG =====
+    # Per group: specs/intervals files (loaded once per path), InfluxDB target (one client per
+    # target) and limits; missing keys come from GROUP_DEFAULTS. Groups may share a bucket:
+    # the InfluxDB points carry a group_id tag and each group warms from its own points.
+    INFLUX = {
+        "url": "https://eu-central-1-1.aws.cloud2.influxdata.com/",
+        "token": "############",
+        "org": "Coimbra lecd test",
+        "bucket": "Project part2"
+    }
+    GROUP_DEFAULTS = {
+        "specs": "config/all_machines.json",
+        "intervals": "config/intervals.json",
+        "influx": INFLUX,
+        "queue_size": 1000,             # messages waiting per group, more are dropped
+        "uplinks_per_second": 200       # per group, bursts of one second allowed (None = no limit)
+    }
+    GROUPS = {
+        "19": {"state_port": 9301},
+        "20": {"state_port": 9302},
+    }
+
+    # ===== MQTT CONFIG =====
+    MQTT_BROKER_IP = "10.6.1.9"
+    MQTT_PORT = 1883
+
+    # ==== UDP COMMUNICATIONS CONFIG ====
+    UDP_PORT = 5005     # alert managers of every group send here
+    UDP_IP = "localhost"
+
+    # ===== METRICS CONFIG =====
+    METRICS_PORT = 9101     # agent metrics of every group, labelled group=<id> (None = off)
+
+    # ===== CONFIG RELOAD =====
+    CONFIG_RELOAD_SECONDS = 2   # how often each specs/intervals pair is checked for changes (None = never)
+
+    # ===== LOGGING CONFIG =====
+    logger.setup("agent", level="INFO", levels={"payload": "WARNING"}, sample_rates={"message": 0.01},
+                 rate_limits={"message": 20, "storage": 20, "error": 10})
+
+    # ===== AGENT CONFIG (see data_manager_agent.py __main__, shared by every group) =====
+    try:
+        with open(GROUP_DEFAULTS["specs"], "r", encoding="utf-8") as f:
+            MACHINE_SPECS = json.load(f)
+        with open(GROUP_DEFAULTS["intervals"], "r", encoding="utf-8") as f:
+            INTERVALS = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        print("File not found/invalid")
+        sys.exit(1)
+    configure(
+        data_manager_agent,
+        MACHINE_SPECS=MACHINE_SPECS, INTERVALS=INTERVALS,
+        PARAM_MAP={
+            "rpm": ["0x01"],
+            "consumption": ["0x02", "consumption_unit"],
+            "coolant_temp": ["0x03", "temp_unit"],
+            "oil_pressure": ["0x04", "oil_unit"],
+            "battery_potential": ["0x05", "batt_unit"]
+        },
+        REASON_MAP={"high number of control alarms": "0x01"},
+        MQTT_BROKER_IP=MQTT_BROKER_IP, MQTT_PORT=MQTT_PORT, UDP_IP=UDP_IP, UDP_PORT=UDP_PORT,
+        URL=INFLUX["url"], TOKEN=INFLUX["token"], ORG=INFLUX["org"], BUCKET=INFLUX["bucket"],
+        METRICS_PORT=None, TRACE_REPORT_EVERY=60,
+        STATE_CAPACITY=720, STATE_PORT=None, STATE_WARM_SECONDS=3600, STATE_WARM_LOG=None,
+        QUANTILE_SKETCHES=True,
+        HEALTH_WEIGHTS={"deviation": 1.0, "commands": 0.2, "alarms": 2.0, "link": 0.5},
+        HEALTH_LINK_LEVELS={"rssi": {"good": -90, "bad": -120}, "snr": {"good": -5, "bad": -20}},
+        DEDUP_TTL=60, DEDUP_MAX_ENTRIES=100000,
+        QUARANTINE_SIZE=1000, QUARANTINE_FLOOD_REJECTS=50, QUARANTINE_FLOOD_WINDOW=10, QUARANTINE_BLOCK_SECONDS=60,
+        MANAGER_PARTITIONS=0, STARTUP_BUFFER=10000,
+        PROFILE_DURATION=30, PROFILE_CONTROL_PORT=None
+    )
+    startup.mark("config")
+
+    agent = MultiTenantAgent(GROUPS, GROUP_DEFAULTS, CONFIG_RELOAD_SECONDS)
+    startup.mark("init")
+    agent.run()
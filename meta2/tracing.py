@@ -0,0 +1,82 @@
+import random
+import time
+from array import array
+
+# A trace travels inside the messages as {"id": "<hex>", "hops": [[hop_name, t_ns], ...]}.
+# Timestamps come from time.monotonic_ns(), which on Linux is one system-wide clock:
+# hop durations are exact when the components share a host, across hosts only
+# the segments between two hops on the same host are meaningful.
+
+class SpanBuffer:
+    """Fixed-size ring of durations (ns) per segment between two hops"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rings = {}     # segment -> [array of durations, next index, count]
+
+    def add(self, segment, duration):
+        ring = self.rings.get(segment)
+        if ring is None:
+            ring = self.rings[segment] = [array("q", bytes(8 * self.capacity)), 0, 0]
+        ring[0][ring[1]] = duration
+        ring[1] = (ring[1] + 1) % self.capacity
+        if ring[2] < self.capacity:
+            ring[2] += 1
+
+    def percentiles(self):
+        """segment -> (samples, p50 ms, p99 ms) over the buffered spans"""
+        result = {}
+        for segment, (durations, _, count) in self.rings.items():
+            ordered = sorted(durations[:count])
+            p50 = ordered[int(0.50 * (count - 1))]
+            p99 = ordered[int(0.99 * (count - 1))]
+            result[segment] = (count, p50 / 1e6, p99 / 1e6)
+        return result
+
+class Tracer:
+    """Starts sampled traces and records the spans of the hops a component sees"""
+
+    def __init__(self, component, sample_rate=0.0, capacity=4096, report_every=60):
+        self.component = component
+        self.sample_rate = sample_rate
+        self.spans = SpanBuffer(capacity)
+        self.paths = SpanBuffer(capacity)
+        self.report_every = report_every
+        self.last_report = time.monotonic()
+
+    def start(self, hop):
+        """Begin a trace with probability sample_rate, None when not sampled"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return {"id": f"{random.getrandbits(64):016x}", "hops": [[hop, time.monotonic_ns()]]}
+
+    def hop(self, trace, hop):
+        """Stamp the trace with a hop and record the span since the previous one"""
+        now = time.monotonic_ns()
+        previous, started = trace["hops"][-1]
+        trace["hops"].append([hop, now])
+        self.spans.add(f"{previous} -> {hop}", now - started)
+
+    def complete(self, trace):
+        """Record every hop of a trace that reached its last hop, plus the end-to-end span"""
+        hops = trace["hops"]
+        for (previous, started), (hop, ended) in zip(hops, hops[1:]):
+            self.paths.add(f"{previous} -> {hop}", ended - started)
+        self.paths.add(f"{hops[0][0]} => {hops[-1][0]} (end-to-end)", hops[-1][1] - hops[0][1])
+
+    def report(self):
+        lines = []
+        for title, spans in (("span latencies", self.spans), ("completed trace latencies", self.paths)):
+            if not spans.rings:
+                continue
+            lines.append(f"[trace] {self.component} {title} (ms):")
+            for segment, (count, p50, p99) in sorted(spans.percentiles().items()):
+                lines.append(f"[trace]   {segment:<55} n={count:<6} p50={p50:9.3f} p99={p99:9.3f}")
+        return "\n".join(lines)
+
+    def maybe_report(self):
+        """Print the report at most every report_every seconds"""
+        now = time.monotonic()
+        if now - self.last_report >= self.report_every and self.spans.rings:
+            self.last_report = now
+            print(self.report())
@@ -0,0 +1,265 @@
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_right
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import topic_matches_sub
+
+# Binary traffic log, append-only:
+#   <log>      b"TRAFLOG1" then records: header (ts_ns int64, kind uint8, topic length uint16,
+#              payload length uint32, little endian), topic bytes, payload bytes
+#   <log>.idx  entries (ts_ns int64, offset int64), one per INDEX_EVERY_NS of traffic
+# ts_ns is the original wall-clock arrival time. The index only speeds up seeking: a
+# missing or short index (crash while recording) is rebuilt from the log itself.
+#
+# UDP datagrams are logged with kind KIND_UDP and the topic "udp/<port>" of the listener.
+
+MAGIC = b"TRAFLOG1"
+RECORD = struct.Struct("<qBHI")
+INDEX_ENTRY = struct.Struct("<qq")
+INDEX_EVERY_NS = 1_000_000_000
+
+KIND_MQTT = 0
+KIND_UDP = 1
+
+class TrafficLogWriter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.log = open(path, "ab", buffering=1024 * 1024)
+        self.index = open(path + ".idx", "ab")
+        if new:
+            self.log.write(MAGIC)
+        self.next_index_ns = 0
+        self.records = 0
+
+    def append(self, topic, payload, kind=KIND_MQTT, ts_ns=None):
+        if ts_ns is None:
+            ts_ns = time.time_ns()
+        topic = topic.encode()
+        with self.lock:
+            offset = self.log.tell()
+            if ts_ns >= self.next_index_ns:
+                self.index.write(INDEX_ENTRY.pack(ts_ns, offset))
+                self.next_index_ns = ts_ns + INDEX_EVERY_NS
+            self.log.write(RECORD.pack(ts_ns, kind, len(topic), len(payload)))
+            self.log.write(topic)
+            self.log.write(payload)
+            self.records += 1
+
+    def flush(self):
+        with self.lock:
+            self.log.flush()
+            self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.log.close()
+        self.index.close()
+
+class TrafficLogReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a traffic log")
+        self.index = self._load_index()
+
+    def _load_index(self):
+        entries = []
+        try:
+            with open(self.path + ".idx", "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            entries = [e for e in INDEX_ENTRY.iter_unpack(data[:usable])]
+        except FileNotFoundError:
+            pass
+
+        # Entries past the last complete record, or no index at all: rebuild by scanning
+        size = os.path.getsize(self.path)
+        if entries and entries[-1][1] < size:
+            return entries
+        entries = []
+        next_index_ns = 0
+        for ts_ns, offset in self._scan_headers(len(MAGIC)):
+            if ts_ns >= next_index_ns:
+                entries.append((ts_ns, offset))
+                next_index_ns = ts_ns + INDEX_EVERY_NS
+        return entries
+
+    def _scan_headers(self, offset):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                ts_ns, _, topic_length, payload_length = RECORD.unpack(header)
+                yield ts_ns, offset
+                offset += RECORD.size + topic_length + payload_length
+                f.seek(offset)
+
+    def first_ts(self):
+        return self.index[0][0] if self.index else None
+
+    def records(self, start_ns=None, end_ns=None, topic_filters=None):
+        """Yield (ts_ns, kind, topic, payload) in log order within [start_ns, end_ns)"""
+        offset = len(MAGIC)
+        if start_ns is not None and self.index:
+            # Last index entry at or before start_ns, records before it are skipped unread
+            position = bisect_right(self.index, (start_ns, float("inf"))) - 1
+            if position >= 0:
+                offset = self.index[position][1]
+
+        with open(self.path, "rb", buffering=1024 * 1024) as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                ts_ns, kind, topic_length, payload_length = RECORD.unpack(header)
+                topic = f.read(topic_length)
+                payload = f.read(payload_length)
+                if len(payload) < payload_length:
+                    return      # torn last record
+                if end_ns is not None and ts_ns >= end_ns:
+                    return
+                if start_ns is not None and ts_ns < start_ns:
+                    continue
+                topic = topic.decode()
+                if topic_filters and not any(topic_matches_sub(f, topic) for f in topic_filters):
+                    continue
+                yield ts_ns, kind, topic, payload
+
+class TrafficRecorder:
+    """Logs everything on the group's topics, plus the UDP alerts passing through a relay port"""
+
+    def __init__(self, group_id, path, udp_listen=None, udp_forward=None):
+        self.group_id = group_id
+        self.writer = TrafficLogWriter(path)
+        self.udp_listen = udp_listen        # (ip, port) the AlertManager sends to while recording
+        self.udp_forward = udp_forward      # (ip, port) of the agent, datagrams are relayed there
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+    def _on_connect(self, client, userdata, flags, rc):
+        print(f"Recorder connected to broker (rc={rc})")
+        client.subscribe(f"v3/{self.group_id}@ttn/devices/+/up")
+        client.subscribe(f"v3/{self.group_id}@ttn/devices/+/down/+")
+        client.subscribe(f"{self.group_id}/internal/#")
+
+    def _on_message(self, client, userdata, msg):
+        self.writer.append(msg.topic, msg.payload)
+
+    def _relay_udp(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(self.udp_listen)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        topic = f"udp/{self.udp_listen[1]}"
+        while True:
+            data, _ = listener.recvfrom(65535)
+            self.writer.append(topic, data, KIND_UDP)
+            if self.udp_forward:
+                sender.sendto(data, self.udp_forward)
+
+    def run(self):
+        if self.udp_listen:
+            threading.Thread(target=self._relay_udp, daemon=True).start()
+        self.client.connect(MQTT_BROKER_IP, MQTT_PORT)
+        self.client.loop_start()
+        try:
+            while True:
+                time.sleep(1)
+                self.writer.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.client.loop_stop()
+            self.writer.close()
+            print(f"Recorded {self.writer.records} messages to {self.writer.path}")
+
+class Replayer:
+    """Re-publishes a traffic log with its original pacing, scaled by speed (0 = as fast as possible)"""
+
+    def __init__(self, reader, publish, send_udp=None):
+        self.reader = reader
+        self.publish = publish      # publish(topic, payload): paho/LocalClient publish, LocalBroker.publish, ...
+        self.send_udp = send_udp    # send_udp(payload), UDP records are skipped when None
+        self.replayed = 0
+
+    def run(self, speed=1.0, start_ns=None, end_ns=None, topic_filters=None):
+        """Replay [start_ns, end_ns) of the log, returns the number of records sent"""
+        clock_start = None
+        for ts_ns, kind, topic, payload in self.reader.records(start_ns, end_ns, topic_filters):
+            if speed > 0:
+                if clock_start is None:
+                    clock_start, log_start = time.monotonic(), ts_ns
+                delay = (ts_ns - log_start) / 1e9 / speed - (time.monotonic() - clock_start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            if kind == KIND_UDP:
+                if self.send_udp:
+                    self.send_udp(payload)
+                    self.replayed += 1
+            else:
+                self.publish(topic, payload)
+                self.replayed += 1
+        return self.replayed
+
+if __name__ == "__main__":
+    # ===== CONFIGURATION =====
+    MQTT_BROKER_IP = "10.6.1.9"
+    MQTT_PORT = 1883
+    GROUP_ID = "19"
+
+    # ==== UDP COMMUNICATIONS CONFIG ====
+    # While recording, point the AlertManager's UDP_PORT at UDP_RELAY_PORT: alerts are
+    # logged and relayed to the agent on UDP_PORT. Replayed alerts go to UDP_PORT directly.
+    UDP_IP = "localhost"
+    UDP_PORT = 5005
+    UDP_RELAY_PORT = 5006
+
+    usage = ("Usage: python3 traffic_log.py record <LOG>\n"
+             "       python3 traffic_log.py replay <LOG> <SPEED|max> [FROM_S] [TO_S] [TOPIC_FILTER ...]\n"
+             "FROM_S/TO_S are seconds from the start of the log, TOPIC_FILTER uses MQTT wildcards "
+             "(udp/# selects the alerts)")
+    if len(sys.argv) < 3 or sys.argv[1] not in ("record", "replay"):
+        print(usage)
+        sys.exit(1)
+
+    if sys.argv[1] == "record":
+        recorder = TrafficRecorder(GROUP_ID, sys.argv[2], ("0.0.0.0", UDP_RELAY_PORT), (UDP_IP, UDP_PORT))
+        recorder.run()
+        sys.exit(0)
+
+    if len(sys.argv) < 4:
+        print(usage)
+        sys.exit(1)
+
+    reader = TrafficLogReader(sys.argv[2])
+    speed = 0 if sys.argv[3] == "max" else float(sys.argv[3])
+    origin = reader.first_ts() or 0
+    start_ns = origin + int(float(sys.argv[4]) * 1e9) if len(sys.argv) > 4 else None
+    end_ns = origin + int(float(sys.argv[5]) * 1e9) if len(sys.argv) > 5 else None
+    topic_filters = sys.argv[6:] or None
+
+    client = mqtt.Client()
+    client.connect(MQTT_BROKER_IP, MQTT_PORT)
+    client.loop_start()
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    replayer = Replayer(reader, client.publish, lambda payload: udp_socket.sendto(payload, (UDP_IP, UDP_PORT)))
+    started = time.monotonic()
+    sent = replayer.run(speed, start_ns, end_ns, topic_filters)
+    elapsed = time.monotonic() - started
+    print(f"Replayed {sent} messages in {elapsed:.1f}s ({sent / max(elapsed, 1e-9):.0f} msg/s)")
+
+    client.loop_stop()
+    client.disconnect()
@@ -0,0 +1,154 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Everything here is sized up front: a stream (topic or machine) costs the same memory
+# after ten messages as after ten million, and recording a message is O(1).
+#
+# record() runs on the MQTT thread, the views on a render thread. New streams are added
+# under TrafficStats.lock and the views iterate over a snapshot of the dicts taken under
+# it, so a stream appearing mid-render cannot break the iteration.
+
+RATE_WINDOW = 10    # seconds covered by the rolling rate
+
+# Payload size buckets in bytes, percentiles are read back as the bucket's upper bound
+SIZE_BOUNDS = (32, 64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 4096, 8192, 16384, 65536)
+
+class StreamStats:
+    """Rolling rate, size histogram and inter-arrival jitter of one topic or machine"""
+    __slots__ = ("count", "bytes", "slot_counts", "slot_seconds", "sizes",
+                 "last_arrival", "mean_gap", "jitter")
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.slot_counts = [0] * RATE_WINDOW
+        self.slot_seconds = [0] * RATE_WINDOW
+        self.sizes = [0] * (len(SIZE_BOUNDS) + 1)
+        self.last_arrival = None
+        self.mean_gap = None
+        self.jitter = 0.0
+
+    def record(self, now, size):
+        self.count += 1
+        self.bytes += size
+
+        second = int(now)
+        slot = second % RATE_WINDOW
+        if self.slot_seconds[slot] != second:
+            self.slot_seconds[slot] = second
+            self.slot_counts[slot] = 0
+        self.slot_counts[slot] += 1
+
+        self.sizes[bisect_left(SIZE_BOUNDS, size)] += 1
+
+        # Smoothed inter-arrival time and its mean deviation (RFC 3550 style, gain 1/16)
+        if self.last_arrival is not None:
+            gap = now - self.last_arrival
+            if self.mean_gap is None:
+                self.mean_gap = gap
+            else:
+                self.jitter += (abs(gap - self.mean_gap) - self.jitter) / 16
+                self.mean_gap += (gap - self.mean_gap) / 16
+        self.last_arrival = now
+
+    def rate(self, now):
+        """Messages per second over the last full RATE_WINDOW seconds"""
+        current = int(now)
+        total = 0
+        for second, count in zip(self.slot_seconds, self.slot_counts):
+            if current - RATE_WINDOW <= second < current:
+                total += count
+        return total / RATE_WINDOW
+
+    def size_percentile(self, q):
+        target = q * sum(self.sizes)
+        seen = 0
+        for i, count in enumerate(self.sizes):
+            seen += count
+            if count and seen >= target:
+                return SIZE_BOUNDS[i] if i < len(SIZE_BOUNDS) else float("inf")
+        return 0
+
+class TrafficStats:
+    """Per-topic and per-machine bus statistics, plus the machines that went silent"""
+
+    def __init__(self, silence_factor=3, min_silence=10):
+        self.topics = {}
+        self.machines = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.silence_factor = silence_factor    # silent after this many usual gaps...
+        self.min_silence = min_silence          # ...and never before this many seconds
+
+    def record(self, topic, size, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        # v3/<group>@ttn/devices/<machine_id>/up -> v3/<group>@ttn/devices/+/up
+        parts = topic.split("/")
+        if len(parts) > 3 and parts[0] == "v3":
+            machine_id = parts[3]
+            parts[3] = "+"
+            topic = "/".join(parts)
+
+            # Machine gaps and silence are about uplinks, downlinks would skew them
+            if parts[-1] == "up":
+                stats = self.machines.get(machine_id)
+                if stats is None:
+                    with self.lock:
+                        stats = self.machines.setdefault(machine_id, StreamStats())
+                stats.record(now, size)
+
+        stats = self.topics.get(topic)
+        if stats is None:
+            with self.lock:
+                stats = self.topics.setdefault(topic, StreamStats())
+        stats.record(now, size)
+
+    def snapshot(self):
+        """(topic, stats) and (machine_id, stats) lists, safe to iterate while recording"""
+        with self.lock:
+            return list(self.topics.items()), list(self.machines.items())
+
+    def silent_machines(self, now=None):
+        """(machine_id, seconds since last message) of machines overdue for a message"""
+        if now is None:
+            now = time.monotonic()
+        silent = []
+        for machine_id, stats in self.snapshot()[1]:
+            usual = stats.mean_gap if stats.mean_gap is not None else 0
+            quiet = now - stats.last_arrival
+            if quiet > max(self.min_silence, self.silence_factor * usual):
+                silent.append((machine_id, quiet))
+        return sorted(silent, key=lambda item: -item[1])
+
+    def render(self, rows=15):
+        """Terminal view, in the spirit of top"""
+        now = time.monotonic()
+        topics, machines = self.snapshot()
+        total = sum(s.count for _, s in topics)
+        total_rate = sum(s.rate(now) for _, s in topics)
+
+        lines = [
+            f"MQTT bus top  |  uptime {now - self.started:7.0f}s  |  {total} msgs  |  "
+            f"{total_rate:9.1f} msg/s  |  {len(machines)} machines",
+            "",
+            f"{'TOPIC':<48} {'MSG/S':>9} {'TOTAL':>10} {'P50 B':>7} {'P99 B':>7} {'JITTER ms':>10}"
+        ]
+        by_rate = sorted(topics, key=lambda item: -item[1].rate(now))
+        for topic, s in by_rate[:rows]:
+            lines.append(f"{topic[-48:]:<48} {s.rate(now):9.1f} {s.count:10d} "
+                         f"{s.size_percentile(0.5):7} {s.size_percentile(0.99):7} {s.jitter * 1000:10.1f}")
+
+        lines += ["", f"{'MACHINE':<20} {'MSG/S':>9} {'TOTAL':>10} {'GAP ms':>10} {'JITTER ms':>10}"]
+        by_rate = sorted(machines, key=lambda item: -item[1].rate(now))
+        for machine_id, s in by_rate[:rows]:
+            gap = s.mean_gap * 1000 if s.mean_gap is not None else 0
+            lines.append(f"{machine_id:<20} {s.rate(now):9.1f} {s.count:10d} {gap:10.1f} {s.jitter * 1000:10.1f}")
+
+        silent = self.silent_machines(now)
+        lines += ["", f"SILENT MACHINES ({len(silent)})"]
+        for machine_id, quiet in silent[:rows]:
+            lines.append(f"{machine_id:<20} quiet for {quiet:8.1f}s")
+        return "\n".join(lines)
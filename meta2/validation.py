@@ -0,0 +1,193 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Shape check of TTN uplinks before the agent touches them, and a bounded quarantine
+# for the ones that fail.
+#
+# A schema is a dict of keys (a trailing "?" marks an optional key, extra keys are
+# allowed) whose values are a type or tuple of types, a nested dict, ListOf(...) or
+# OneOf(...). compile_schema() generates and compiles one flat Python function for it,
+# once: validating a message is then a run of dict lookups and isinstance() calls in a
+# single frame, with no exception raised. A failure is reported as "<problem>:<path>",
+# e.g. "missing:uplink_message.rx_metadata" or
+# "value:uplink_message.decoded_payload.machine_type" (unknown machine code).
+
+NUMBER = (int, float)
+MISSING = object()
+
+class ListOf:
+    def __init__(self, item, min_length=0):
+        self.item = item
+        self.min_length = min_length
+
+class OneOf:
+    def __init__(self, values):
+        self.values = frozenset(values)
+
+def compile_schema(schema):
+    """Validator function(value) -> None if valid, else the failure reason"""
+    lines = ["def validate(value):"]
+    constants = {"MISSING": MISSING}
+    _emit(schema, "value", "", lines, 1, constants, itertools.count())
+    lines.append("    return None")
+    namespace = dict(constants)
+    exec(compile("\n".join(lines), "<uplink schema>", "exec"), namespace)
+    return namespace["validate"]
+
+def _emit(schema, expr, path, lines, depth, constants, names):
+    pad = "    " * depth
+    if isinstance(schema, dict):
+        lines.append(f"{pad}if not isinstance({expr}, dict): return {'type:' + (path or 'payload')!r}")
+        for key, child in schema.items():
+            optional = key.endswith("?")
+            key = key.rstrip("?")
+            child_path = f"{path}.{key}" if path else key
+            var = f"v{next(names)}"
+            lines.append(f"{pad}{var} = {expr}.get({key!r}, MISSING)")
+            if optional:
+                lines.append(f"{pad}if {var} is not MISSING:")
+                _emit(child, var, child_path, lines, depth + 1, constants, names)
+            else:
+                lines.append(f"{pad}if {var} is MISSING: return {'missing:' + child_path!r}")
+                _emit(child, var, child_path, lines, depth, constants, names)
+
+    elif isinstance(schema, ListOf):
+        lines.append(f"{pad}if not isinstance({expr}, list): return {'type:' + path!r}")
+        if schema.min_length:
+            lines.append(f"{pad}if len({expr}) < {schema.min_length}: return {'empty:' + path!r}")
+        item = f"v{next(names)}"
+        lines.append(f"{pad}for {item} in {expr}:")
+        _emit(schema.item, item, path + "[]", lines, depth + 1, constants, names)
+
+    elif isinstance(schema, OneOf):
+        # Type check first, unhashable values (lists, dicts) cannot be looked up in a set
+        values, types = f"c{next(names)}", f"c{next(names)}"
+        constants[values] = schema.values
+        constants[types] = tuple({type(value) for value in schema.values})
+        lines.append(f"{pad}if not isinstance({expr}, {types}) or {expr} not in {values}: return {'value:' + path!r}")
+
+    else:
+        name = f"c{next(names)}"
+        constants[name] = schema if isinstance(schema, tuple) else (schema,)
+        # bool is an int subclass, it is never a valid number here
+        exclude_bool = "" if bool in constants[name] else f" or {expr} is True or {expr} is False"
+        lines.append(f"{pad}if not isinstance({expr}, {name}){exclude_bool}: return {'type:' + path!r}")
+
+def uplink_schema(machine_codes):
+    """TTN uplink as sent by machine.py / fleet.py (raw, multi-sample, backfill or summary)"""
+    sensors = {
+        "rpm": NUMBER,
+        "coolant_temperature": NUMBER,
+        "oil_pressure": NUMBER,
+        "battery_potential": NUMBER,
+        "consumption": NUMBER
+    }
+    stats = {"min": NUMBER, "max": NUMBER, "mean": NUMBER, "last": NUMBER}
+    summary = {field + "?": stats for field in sensors}
+    summary.update({"count": NUMBER, "window_ms": NUMBER})
+    decoded_payload = dict(sensors)
+    decoded_payload.update({
+        "machine_type": OneOf(machine_codes),
+        "samples?": ListOf(dict(sensors, offset_ms=NUMBER), 1),
+        "summary?": summary,
+        "backfill?": bool,
+        "trace?": dict
+    })
+    return {
+        "end_device_ids": {"machine_id": str},
+        "received_at": str,
+        "uplink_message": {
+            "f_cnt?": int,
+            "decoded_payload": decoded_payload,
+            "rx_metadata": ListOf({"rssi": NUMBER, "snr": NUMBER}, 1)
+        }
+    }
+
+_validators = {}
+
+def uplink_validator(machine_codes):
+    """Compiled uplink_schema, shared by every agent with the same machine codes"""
+    key = frozenset(machine_codes)
+    validator = _validators.get(key)
+    if validator is None:
+        validator = _validators[key] = compile_schema(uplink_schema(machine_codes))
+    return validator
+
+class Quarantine:
+    """Last `capacity` rejected messages, reject counts per reason and per device, and
+       a block list: a device with more than flood_rejects rejects in flood_window
+       seconds is refused by topic, before decoding, for block_seconds"""
+
+    def __init__(self, capacity=1000, flood_rejects=50, flood_window=10, block_seconds=60,
+                 max_devices=10000, max_bytes=2048):
+        self.messages = deque(maxlen=capacity)
+        self.flood_rejects = flood_rejects
+        self.flood_window = flood_window
+        self.block_seconds = block_seconds
+        self.max_devices = max_devices
+        self.max_bytes = max_bytes
+        self.reasons = {}                   # reason -> rejects
+        self.devices = OrderedDict()        # device id -> [rejects, window start, rejects in window], LRU order
+        self.blocked_until = OrderedDict()  # device id -> monotonic time, in blocking order
+        self.lock = threading.Lock()
+
+    def blocked(self, device_id, now=None):
+        until = self.blocked_until.get(device_id)
+        if until is None:
+            return False
+        if (time.monotonic() if now is None else now) < until:
+            return True
+        with self.lock:
+            self.blocked_until.pop(device_id, None)
+        return False
+
+    def reject(self, device_id, reason, raw, now=None):
+        """Keep a rejected message, returns True when the device just got blocked"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+            self.messages.append((time.time(), device_id, reason, raw[:self.max_bytes]))
+
+            device = self.devices.get(device_id)
+            if device is None:
+                device = self.devices[device_id] = [0, now, 0]
+                if len(self.devices) > self.max_devices:
+                    self.devices.popitem(last=False)
+            else:
+                # LRU, so churn of spoofed ids evicts idle devices before a flooding one
+                self.devices.move_to_end(device_id)
+            device[0] += 1
+            if now - device[1] > self.flood_window:
+                device[1], device[2] = now, 0
+            device[2] += 1
+            if device[2] > self.flood_rejects and device_id not in self.blocked_until:
+                self._evict_blocks(now)
+                self.blocked_until[device_id] = now + self.block_seconds
+                return True
+        return False
+
+    def _evict_blocks(self, now):
+        """Drop expired blocks of devices that went quiet, and the oldest past max_devices"""
+        # blocks all last block_seconds, so blocking order is expiry order
+        while self.blocked_until:
+            device_id, until = next(iter(self.blocked_until.items()))
+            if until > now and len(self.blocked_until) < self.max_devices:
+                break
+            del self.blocked_until[device_id]
+
+    def snapshot(self, limit=50):
+        """JSON-ready view: counts per reason and device, blocked devices, latest rejects"""
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "reasons": dict(self.reasons),
+                "devices": {device_id: device[0] for device_id, device in
+                            sorted(self.devices.items(), key=lambda item: -item[1][0])[:limit]},
+                "blocked": {device_id: round(until - now, 1) for device_id, until in self.blocked_until.items()
+                            if until > now},
+                "latest": [{"ts": ts, "device_id": device_id, "reason": reason,
+                            "payload": raw.decode("utf-8", "replace")}
+                           for ts, device_id, reason, raw in list(self.messages)[-limit:]]
+            }